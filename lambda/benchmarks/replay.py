@@ -0,0 +1,239 @@
+"""
+Replays recorded Slack events through MessageHandler and reports per-stage latency.
+
+External services are replaced with the local stand-ins in benchmarks.stand_ins, so
+the results only depend on the configured latencies and the code under test. Run it
+from the lambda directory:
+
+    python -m benchmarks.replay --iterations 20 --output results.json
+    python -m benchmarks.replay --iterations 20 --baseline results.json
+
+The JSON report has sorted keys and millisecond values rounded to a microsecond, so
+reports of different runs can be diffed, or compared with --baseline.
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+
+REPORT_SCHEMA_VERSION = 1
+PERCENTILES = (50, 95, 99)
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "corpus.json")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Corpus of recorded events")
+    parser.add_argument("--cases", nargs="*", help="Only replay these cases")
+    parser.add_argument("--iterations", type=int, default=10, help="Replays of each case")
+    parser.add_argument("--warm", action="store_true", help="Keep caches between iterations")
+    parser.add_argument("--streaming", action="store_true", help="Stream responses into Slack")
+    parser.add_argument("--model-id", default="claude-3-5-haiku", help="Model key or ARN")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for latency jitter")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative latency jitter")
+    parser.add_argument("--slack-latency-ms", type=float, default=60.0)
+    parser.add_argument("--files-latency-ms", type=float, default=80.0)
+    parser.add_argument("--files-bytes-per-ms", type=float, default=20000.0, help="Download bandwidth")
+    parser.add_argument("--dynamodb-latency-ms", type=float, default=8.0)
+    parser.add_argument("--bedrock-first-token-ms", type=float, default=600.0)
+    parser.add_argument("--bedrock-ms-per-token", type=float, default=1.0)
+    parser.add_argument("--bedrock-output-tokens", type=int, default=300)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="Print a comparison with a previous JSON report")
+    return parser.parse_args(argv)
+
+def configure_environment(args, attachment_cache_dir):
+    """Settings are read when config is imported, so they are set before importing the handler."""
+    os.environ["BEDROCK_MODEL_ID"] = args.model_id
+    os.environ["DYNAMODB_TABLE_NAME"] = "benchmark-preferences"
+    os.environ["IDEMPOTENCY_TABLE_NAME"] = "benchmark-events"
+    os.environ["ATTACHMENT_CACHE_DIR"] = attachment_cache_dir
+    os.environ["STREAMING_RESPONSES_ENABLED"] = "true" if args.streaming else "false"
+    os.environ["METRICS_EMF_ENABLED"] = "false"
+    os.environ.pop("THREAD_STORE_TABLE_NAME", None)
+    os.environ.pop("ATTACHMENT_CACHE_BUCKET", None)
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+def summarize(durations):
+    """Milliseconds statistics of a list of durations in seconds."""
+    values = sorted(seconds * 1000 for seconds in durations)
+    summary = {"count": len(values), "mean_ms": round(sum(values) / len(values), 3)}
+    for percent in PERCENTILES:
+        summary[f"p{percent}_ms"] = round(percentile(values, percent), 3)
+    return summary
+
+def build_thread(case, bot_user_id, file_host):
+    """Generate the messages of a recorded thread, ending with the replayed event."""
+    event = case["event"]
+    spec = case["thread"]
+    seconds, fraction = event["thread_ts"].split(".")
+    text = ("lorem ipsum dolor sit amet " * (spec.get("text_chars", 200) // 27 + 1))[:spec.get("text_chars", 200)]
+    files_every = spec.get("files_every", 0)
+
+    def ts(index):
+        return f"{seconds}.{int(fraction) + index * 100:06d}"
+
+    messages = [{"user": event["user"], "ts": event["thread_ts"], "text": text}]
+    for index in range(1, spec["replies"] + 1):
+        # Replies alternate between the bot and the user, starting with the bot
+        from_bot = index % 2 == 1
+        message = {"user": bot_user_id if from_bot else event["user"], "ts": ts(index), "text": text}
+        if files_every and not from_bot and index % files_every == 0:
+            message["files"] = [file_host.add_file(slack_file({
+                "id": f"F{case['name'].upper()}{index:04d}",
+                "name": f"log-{index}.txt",
+                "filetype": "txt",
+                "size": spec.get("file_size", 65536),
+            }))]
+        messages.append(message)
+
+    last = {key: event[key] for key in ("user", "text")}
+    last.update(ts=ts(spec["replies"] + 1), files=event.get("files", []))
+    messages.append(last)
+    return messages, last["ts"]
+
+def slack_file(file_info):
+    file_info["url_private_download"] = f"https://files.slack.com/files-pri/TBENCH-{file_info['id']}/{file_info['name']}"
+    return file_info
+
+def compare(report, baseline):
+    """Lines comparing the percentiles of each stage with a baseline report."""
+    lines = [f"{'stage':<24}{'p50 ms':>20}{'p95 ms':>20}{'p99 ms':>20}"]
+    for stage, summary in sorted(report["stages"].items()):
+        previous = baseline.get("stages", {}).get(stage)
+        columns = []
+        for percent in PERCENTILES:
+            value = summary[f"p{percent}_ms"]
+            if previous:
+                before = previous[f"p{percent}_ms"]
+                change = (value - before) / before * 100 if before else 0.0
+                columns.append(f"{value:>10.1f} ({change:+6.1f}%)")
+            else:
+                columns.append(f"{value:>10.1f}   (new)  ")
+        lines.append(f"{stage:<24}" + "".join(f"{column:>20}" for column in columns))
+    return lines
+
+def main(argv=None):
+    args = parse_args(argv)
+    attachment_cache_dir = tempfile.mkdtemp(prefix="slackllm-benchmark-")
+    configure_environment(args, attachment_cache_dir)
+
+    from config import logger
+    from handlers.message_handler import MessageHandler
+    from service.metrics import Metrics
+    from service.shared_clients import SharedClients
+    from service.slack_metadata_cache import SlackMetadataCache
+    from service.user_preferences_accessor import UserPreferencesAccessor
+    from service.event_idempotency_store import EventIdempotencyStore
+    from service.thread_conversation_store import InMemoryThreadStoreBackend, ThreadConversationStore
+    from service.token_estimator import TokenEstimator
+    from service.document_text_extractor import DocumentTextExtractor
+    from service.image_normalizer import ImageNormalizer
+    from benchmarks.stand_ins import (
+        Latency, FakeSlackClient, FakeFileHost, FakeBedrockClient, FakeDynamoDB, LatencyThreadStoreBackend,
+    )
+
+    logger.setLevel(logging.WARNING)
+    with open(args.corpus) as corpus_file:
+        corpus = json.load(corpus_file)
+    cases = [case for case in corpus["cases"] if not args.cases or case["name"] in args.cases]
+
+    rng = random.Random(args.seed)
+    slack_latency = Latency(args.slack_latency_ms, args.jitter, rng)
+    dynamodb_latency = Latency(args.dynamodb_latency_ms, args.jitter, rng)
+    file_host = FakeFileHost(Latency(args.files_latency_ms, args.jitter, rng), args.files_bytes_per_ms)
+    slack_client = FakeSlackClient(slack_latency, corpus["bot_user_id"])
+    SharedClients.set_client("http", file_host)
+    SharedClients.set_client("dynamodb", FakeDynamoDB(
+        dynamodb_latency, {"benchmark-preferences": "user_id", "benchmark-events": "event_id"}
+    ))
+    SharedClients.set_client("bedrock-runtime", FakeBedrockClient(
+        Latency(args.bedrock_first_token_ms, args.jitter, rng),
+        args.bedrock_ms_per_token,
+        args.bedrock_output_tokens
+    ))
+
+    handler = MessageHandler()
+    handler.thread_store = ThreadConversationStore(
+        LatencyThreadStoreBackend(InMemoryThreadStoreBackend(), dynamodb_latency)
+    )
+
+    # Prepare the recorded events, generating thread history and file content
+    bodies = {}
+    for case in cases:
+        event = copy.deepcopy(case["event"])
+        event["files"] = [file_host.add_file(slack_file(file)) for file in event.get("files", [])]
+        if "thread" in case:
+            messages, event["ts"] = build_thread(dict(case, event=event), corpus["bot_user_id"], file_host)
+            slack_client.threads[(event["channel"], event["thread_ts"])] = messages
+        bodies[case["name"]] = {"type": "event_callback", "event": event}
+
+    durations = defaultdict(lambda: defaultdict(list))
+    current_case = {}
+    lock = threading.Lock()
+
+    def record(stage, seconds):
+        with lock:
+            durations[current_case["name"]][stage].append(seconds)
+
+    def say(text=None, thread_ts=None, **kwargs):
+        slack_client.chat_postMessage(text=text, thread_ts=thread_ts)
+
+    Metrics.add_sink(record)
+    try:
+        for iteration in range(args.iterations):
+            for case in cases:
+                if not args.warm:
+                    for clear in (SlackMetadataCache.clear, UserPreferencesAccessor.clear_cache,
+                                  InMemoryThreadStoreBackend.clear, TokenEstimator.clear_cache,
+                                  DocumentTextExtractor._cache.clear, ImageNormalizer._cache.clear):
+                        clear()
+                    shutil.rmtree(attachment_cache_dir, ignore_errors=True)
+                EventIdempotencyStore.clear()
+                body = dict(bodies[case["name"]], event_id=f"Ev{case['name']}{iteration}")
+                current_case["name"] = case["name"]
+                handler.handle_message(body, say, slack_client)
+                print(f"{case['name']} {iteration + 1}/{args.iterations}", file=sys.stderr)
+    finally:
+        Metrics.remove_sink(record)
+        shutil.rmtree(attachment_cache_dir, ignore_errors=True)
+
+    all_durations = defaultdict(list)
+    for stages in durations.values():
+        for stage, values in stages.items():
+            all_durations[stage].extend(values)
+
+    report = {
+        "schema_version": REPORT_SCHEMA_VERSION,
+        "settings": {key: value for key, value in sorted(vars(args).items()) if key not in ("output", "baseline")},
+        "stages": {stage: summarize(values) for stage, values in all_durations.items()},
+        "cases": {
+            name: {stage: summarize(values) for stage, values in stages.items()}
+            for name, stages in durations.items()
+        },
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print("\n".join(compare(report, baseline)), file=sys.stderr)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Local stand-ins for the Slack Web API, Slack file hosting, Bedrock and DynamoDB.
+
+Each stand-in sleeps for a configurable latency before answering, so a replayed
+event spends its time in the same places it would in production.
+"""
+import io
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, images are filled with placeholder bytes without it
+    Image = None
+
+class Latency:
+    """A latency in milliseconds with uniform jitter, drawn from a seeded generator."""
+
+    def __init__(self, milliseconds, jitter=0.0, rng=None):
+        self.milliseconds = milliseconds
+        self.jitter = jitter
+        self.rng = rng or random.Random(0)
+        self._lock = threading.Lock()
+
+    def sleep(self, extra_milliseconds=0.0):
+        with self._lock:
+            factor = 1.0 + self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 1.0
+        time.sleep(max(0.0, (self.milliseconds + extra_milliseconds) * factor) / 1000)
+
+class FakeSlackClient:
+    """The parts of the Slack WebClient used by the message handler."""
+
+    def __init__(self, latency, bot_user_id, threads=None, token="xoxb-benchmark"):
+        self.latency = latency
+        self.bot_user_id = bot_user_id
+        self.threads = threads if threads is not None else {}
+        self.token = token
+        self._ts_counter = 0
+        self._lock = threading.Lock()
+
+    def auth_test(self):
+        self.latency.sleep()
+        return {"user_id": self.bot_user_id, "bot_id": "BBENCH", "team_id": "TBENCH"}
+
+    def conversations_replies(self, channel, ts, limit=200, cursor=None, oldest=None):
+        self.latency.sleep()
+        messages = self.threads.get((channel, ts), [])
+        start = int(cursor) if cursor else 0
+        page = messages[start:start + limit]
+        response = {"messages": page}
+        if start + limit < len(messages):
+            response["response_metadata"] = {"next_cursor": str(start + limit)}
+        return response
+
+    def chat_postMessage(self, **kwargs):
+        self.latency.sleep()
+        return {"ts": self._next_ts()}
+
+    def chat_update(self, **kwargs):
+        self.latency.sleep()
+        return {"ts": kwargs.get("ts")}
+
+    def users_info(self, user):
+        self.latency.sleep()
+        return {"user": {"id": user, "name": user.lower()}}
+
+    def conversations_info(self, channel):
+        self.latency.sleep()
+        return {"channel": {"id": channel, "name": channel.lower()}}
+
+    def _next_ts(self):
+        with self._lock:
+            self._ts_counter += 1
+            return f"1800000000.{self._ts_counter:06d}"
+
+class _FakeFileResponse:
+    def __init__(self, content, latency, bytes_per_millisecond):
+        self.content = content
+        self.latency = latency
+        self.bytes_per_millisecond = bytes_per_millisecond
+        self.headers = {"Content-Length": str(len(content))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        self.latency.sleep()
+        for start in range(0, len(self.content), chunk_size):
+            chunk = self.content[start:start + chunk_size]
+            if self.bytes_per_millisecond:
+                time.sleep(len(chunk) / self.bytes_per_millisecond / 1000)
+            yield chunk
+
+class FakeFileHost:
+    """Serves Slack files to the shared HTTP session by URL."""
+
+    def __init__(self, latency, bytes_per_millisecond=0):
+        self.latency = latency
+        self.bytes_per_millisecond = bytes_per_millisecond
+        self.files = {}
+
+    def add_file(self, file_info):
+        """Generate content for a Slack file object, returning the object."""
+        self.files[file_info["url_private_download"]] = generate_file_content(file_info)
+        return file_info
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        return _FakeFileResponse(self.files[url], self.latency, self.bytes_per_millisecond)
+
+    def head(self, url, timeout=None):
+        self.latency.sleep()
+
+def generate_file_content(file_info):
+    """Deterministic content of the size and type given by a Slack file object."""
+    size = file_info.get("size", 1024)
+    if file_info["filetype"] in ("png", "jpg", "jpeg") and Image is not None:
+        width, height = file_info.get("dimensions", (1024, 768))
+        image = Image.radial_gradient("L").resize((width, height)).convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format="PNG" if file_info["filetype"] == "png" else "JPEG")
+        content = output.getvalue()
+        file_info["size"] = len(content)
+        return content
+    words = b"latency benchmark replay corpus line of recorded text\n"
+    return (words * (size // len(words) + 1))[:size]
+
+class FakeBedrockClient:
+    """Answers converse and converse_stream with canned text after a simulated generation time."""
+
+    def __init__(self, first_token_latency, milliseconds_per_token, output_tokens=300, chunk_tokens=20):
+        self.first_token_latency = first_token_latency
+        self.milliseconds_per_token = milliseconds_per_token
+        self.output_tokens = output_tokens
+        self.chunk_tokens = chunk_tokens
+
+    def converse(self, **params):
+        self.first_token_latency.sleep(self.output_tokens * self.milliseconds_per_token)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": self._text(self.output_tokens)}]}},
+            "usage": self._usage(params),
+            "stopReason": "end_turn",
+        }
+
+    def converse_stream(self, **params):
+        return {"stream": self._stream(params)}
+
+    def list_async_invokes(self, **kwargs):
+        self.first_token_latency.sleep()
+        return {"asyncInvokeSummaries": []}
+
+    def _stream(self, params):
+        self.first_token_latency.sleep()
+        for _ in range(0, self.output_tokens, self.chunk_tokens):
+            time.sleep(self.chunk_tokens * self.milliseconds_per_token / 1000)
+            yield {"contentBlockDelta": {"delta": {"text": self._text(self.chunk_tokens)}, "contentBlockIndex": 0}}
+        yield {"messageStop": {"stopReason": "end_turn"}}
+        yield {"metadata": {"usage": self._usage(params)}}
+
+    def _text(self, tokens):
+        return "word " * tokens
+
+    def _usage(self, params):
+        input_tokens = sum(
+            len(block.get("text", "")) // 4 + 1
+            for message in params["messages"]
+            for block in message["content"]
+        )
+        return {
+            "inputTokens": input_tokens,
+            "outputTokens": self.output_tokens,
+            "totalTokens": input_tokens + self.output_tokens,
+        }
+
+class FakeTable:
+    """A DynamoDB table supporting the item operations of the preferences and event tables."""
+
+    def __init__(self, key_name, latency):
+        self.key_name = key_name
+        self.latency = latency
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def get_item(self, Key, **kwargs):
+        self.latency.sleep()
+        with self._lock:
+            item = self.items.get(Key[self.key_name])
+        return {"Item": dict(item)} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, **kwargs):
+        self.latency.sleep()
+        with self._lock:
+            # Conditional puts are only used to claim new keys
+            if ConditionExpression and Item[self.key_name] in self.items:
+                raise ClientError(
+                    {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}},
+                    "PutItem"
+                )
+            self.items[Item[self.key_name]] = dict(Item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self.latency.sleep()
+        with self._lock:
+            self.items.pop(Key[self.key_name], None)
+        return {}
+
+class FakeDynamoDB:
+    """A DynamoDB service resource whose tables are FakeTables keyed as configured."""
+
+    def __init__(self, latency, key_names):
+        self.latency = latency
+        self.key_names = key_names
+        self._tables = {}
+
+    def Table(self, name):
+        if name not in self._tables:
+            self._tables[name] = FakeTable(self.key_names.get(name, "id"), self.latency)
+        return self._tables[name]
+
+class LatencyThreadStoreBackend:
+    """Adds DynamoDB latency to another thread store backend."""
+
+    def __init__(self, backend, latency):
+        self.backend = backend
+        self.latency = latency
+
+    def load(self, thread_key):
+        self.latency.sleep()
+        return self.backend.load(thread_key)
+
+    def save(self, thread_key, data):
+        self.latency.sleep()
+        self.backend.save(thread_key, data)
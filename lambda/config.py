@@ -10,22 +10,238 @@ logger.setLevel(logging.INFO)
 SLACK_BOT_TOKEN = os.environ.get("SLACK_BOT_TOKEN")
 SLACK_SIGNING_SECRET = os.environ.get("SLACK_SIGNING_SECRET")
 
+# Slack metadata cache configuration
+SLACK_IDENTITY_CACHE_TTL_SECONDS = float(os.environ.get("SLACK_IDENTITY_CACHE_TTL_SECONDS", "3600"))
+
 # AWS configuration
 DYNAMODB_TABLE_NAME = os.environ.get("DYNAMODB_TABLE_NAME")
 DEFAULT_BEDROCK_MODEL_ID = os.environ.get("BEDROCK_MODEL_ID")
 
+# Client configuration
+# Open connections to AWS and Slack during the init phase, before the first invocation
+CLIENT_PREWARM_ENABLED = os.environ.get("CLIENT_PREWARM_ENABLED", "false").lower() == "true"
+CLIENT_PREWARM_TIMEOUT_SECONDS = float(os.environ.get("CLIENT_PREWARM_TIMEOUT_SECONDS", "2"))
+
+# Execution mode configuration
+# "lazy" runs each message in a self-invoked lazy listener, "queue" enqueues it for workers
+EXECUTION_MODE = os.environ.get("EXECUTION_MODE", "lazy").lower()
+JOB_QUEUE_URL = os.environ.get("JOB_QUEUE_URL")
+# Attempts before a job is moved to the dead-letter queue (the SQS redrive policy in production)
+JOB_QUEUE_MAX_ATTEMPTS = int(os.environ.get("JOB_QUEUE_MAX_ATTEMPTS", "3"))
+JOB_QUEUE_VISIBILITY_TIMEOUT_SECONDS = float(os.environ.get("JOB_QUEUE_VISIBILITY_TIMEOUT_SECONDS", "900"))
+WORKER_BATCH_SIZE = int(os.environ.get("WORKER_BATCH_SIZE", "10"))
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "4"))
+# Jobs for reasoning models run on their own queue and workers, so a burst of them cannot
+# hold the capacity that quick replies and UI interactions need
+REASONING_JOB_QUEUE_URL = os.environ.get("REASONING_JOB_QUEUE_URL")
+WORKER_REASONING_CONCURRENCY = int(os.environ.get("WORKER_REASONING_CONCURRENCY", "2"))
+
+# Event idempotency configuration
+IDEMPOTENCY_TABLE_NAME = os.environ.get("IDEMPOTENCY_TABLE_NAME")
+# Slack gives up retrying an event after about an hour
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(2 * 60 * 60)))
+IDEMPOTENCY_LOCAL_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_LOCAL_MAX_ENTRIES", "1024"))
+
+# Usage tracking configuration
+USAGE_TABLE_NAME = os.environ.get("USAGE_TABLE_NAME")
+# Counters of a user and window are spread over this many items
+USAGE_COUNTER_SHARDS = int(os.environ.get("USAGE_COUNTER_SHARDS", "8"))
+USAGE_WINDOW_SECONDS = int(os.environ.get("USAGE_WINDOW_SECONDS", str(60 * 60)))
+USAGE_TTL_SECONDS = int(os.environ.get("USAGE_TTL_SECONDS", str(90 * 24 * 60 * 60)))
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "false").lower() == "true"
+# Tokens a user can spend in a burst, refilled continuously over an hour by default
+RATE_LIMIT_CAPACITY_TOKENS = int(os.environ.get("RATE_LIMIT_CAPACITY_TOKENS", "500000"))
+RATE_LIMIT_REFILL_TOKENS_PER_SECOND = float(
+    os.environ.get("RATE_LIMIT_REFILL_TOKENS_PER_SECOND", str(RATE_LIMIT_CAPACITY_TOKENS / 3600))
+)
+# Usage is written in the background, and waited for this long once the reply is delivered
+USAGE_RECORD_POOL_SIZE = int(os.environ.get("USAGE_RECORD_POOL_SIZE", "4"))
+USAGE_RECORD_WAIT_SECONDS = float(os.environ.get("USAGE_RECORD_WAIT_SECONDS", "2"))
+
+# Thread conversation store configuration
+THREAD_STORE_TABLE_NAME = os.environ.get("THREAD_STORE_TABLE_NAME")
+THREAD_STORE_TTL_SECONDS = int(os.environ.get("THREAD_STORE_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+THREAD_STORE_CHUNK_BYTES = int(os.environ.get("THREAD_STORE_CHUNK_BYTES", str(350 * 1024)))
+
+# Thread summarization configuration
+THREAD_SUMMARY_ENABLED = os.environ.get("THREAD_SUMMARY_ENABLED", "false").lower() == "true"
+# Older turns are summarized once a thread has more than this many unsummarized turns
+THREAD_SUMMARY_TRIGGER_TURNS = int(os.environ.get("THREAD_SUMMARY_TRIGGER_TURNS", "20"))
+# Number of most recent turns that are always sent verbatim
+THREAD_SUMMARY_KEEP_RECENT_TURNS = int(os.environ.get("THREAD_SUMMARY_KEEP_RECENT_TURNS", "8"))
+THREAD_SUMMARY_MODEL_ID = os.environ.get("THREAD_SUMMARY_MODEL_ID", DEFAULT_BEDROCK_MODEL_ID)
+
+# Thread history configuration
+THREAD_HISTORY_PAGE_SIZE = int(os.environ.get("THREAD_HISTORY_PAGE_SIZE", "200"))
+# Newest messages kept from each read, older ones are fetched and then dropped
+THREAD_HISTORY_MAX_MESSAGES = int(os.environ.get("THREAD_HISTORY_MAX_MESSAGES", "1000"))
+THREAD_HISTORY_MAX_TOKENS = int(os.environ.get("THREAD_HISTORY_MAX_TOKENS", "150000"))
+
+# Prefetch configuration
+PREFETCH_POOL_SIZE = int(os.environ.get("PREFETCH_POOL_SIZE", "16"))
+PREFETCH_IDENTITY_TIMEOUT_SECONDS = float(os.environ.get("PREFETCH_IDENTITY_TIMEOUT_SECONDS", "5"))
+PREFETCH_PREFERENCES_TIMEOUT_SECONDS = float(os.environ.get("PREFETCH_PREFERENCES_TIMEOUT_SECONDS", "5"))
+PREFETCH_THREAD_TIMEOUT_SECONDS = float(os.environ.get("PREFETCH_THREAD_TIMEOUT_SECONDS", "20"))
+# Attachments are optional, on timeout the remaining files are downloaded while preparing the message
+PREFETCH_ATTACHMENTS_TIMEOUT_SECONDS = float(os.environ.get("PREFETCH_ATTACHMENTS_TIMEOUT_SECONDS", "30"))
+PREFETCH_USAGE_TIMEOUT_SECONDS = float(os.environ.get("PREFETCH_USAGE_TIMEOUT_SECONDS", "2"))
+
+# User preferences cache configuration
+USER_PREFERENCES_CACHE_TTL_SECONDS = float(os.environ.get("USER_PREFERENCES_CACHE_TTL_SECONDS", "60"))
+USER_PREFERENCES_CACHE_MAX_ENTRIES = int(os.environ.get("USER_PREFERENCES_CACHE_MAX_ENTRIES", "1024"))
+
+# File download configuration
+FILE_DOWNLOAD_POOL_SIZE = int(os.environ.get("FILE_DOWNLOAD_POOL_SIZE", "8"))
+FILE_DOWNLOAD_MAX_CONCURRENCY_PER_MESSAGE = int(os.environ.get("FILE_DOWNLOAD_MAX_CONCURRENCY_PER_MESSAGE", "4"))
+FILE_DOWNLOAD_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("FILE_DOWNLOAD_CONNECT_TIMEOUT_SECONDS", "3"))
+FILE_DOWNLOAD_READ_TIMEOUT_SECONDS = float(os.environ.get("FILE_DOWNLOAD_READ_TIMEOUT_SECONDS", "10"))
+FILE_DOWNLOAD_TOTAL_TIMEOUT_SECONDS = float(os.environ.get("FILE_DOWNLOAD_TOTAL_TIMEOUT_SECONDS", "30"))
+FILE_DOWNLOAD_MAX_BYTES = int(os.environ.get("FILE_DOWNLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+FILE_DOWNLOAD_CHUNK_BYTES = int(os.environ.get("FILE_DOWNLOAD_CHUNK_BYTES", str(256 * 1024)))
+
+# Attachment cache configuration
+ATTACHMENT_CACHE_DIR = os.environ.get("ATTACHMENT_CACHE_DIR", "/tmp/slackllm-attachments")
+ATTACHMENT_CACHE_MAX_BYTES = int(os.environ.get("ATTACHMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+ATTACHMENT_CACHE_BUCKET = os.environ.get("ATTACHMENT_CACHE_BUCKET")
+ATTACHMENT_CACHE_PREFIX = os.environ.get("ATTACHMENT_CACHE_PREFIX", "attachments/")
+
+# Image normalization configuration
+IMAGE_NORMALIZATION_ENABLED = os.environ.get("IMAGE_NORMALIZATION_ENABLED", "true").lower() == "true"
+IMAGE_NORMALIZATION_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_NORMALIZATION_CACHE_MAX_ENTRIES", "64"))
+IMAGE_NORMALIZATION_CACHE_TTL_SECONDS = float(os.environ.get("IMAGE_NORMALIZATION_CACHE_TTL_SECONDS", "3600"))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+
+# Document text extraction configuration
+DOCUMENT_TEXT_EXTRACTION_ENABLED = os.environ.get("DOCUMENT_TEXT_EXTRACTION_ENABLED", "false").lower() == "true"
+DOCUMENT_TEXT_CACHE_MAX_ENTRIES = int(os.environ.get("DOCUMENT_TEXT_CACHE_MAX_ENTRIES", "128"))
+DOCUMENT_TEXT_CACHE_TTL_SECONDS = float(os.environ.get("DOCUMENT_TEXT_CACHE_TTL_SECONDS", "3600"))
+
+# Context window configuration
+# Fraction of the input budget kept free to absorb token estimation error
+CONTEXT_WINDOW_SAFETY_MARGIN = float(os.environ.get("CONTEXT_WINDOW_SAFETY_MARGIN", "0.1"))
+TOKEN_ESTIMATE_CACHE_MAX_ENTRIES = int(os.environ.get("TOKEN_ESTIMATE_CACHE_MAX_ENTRIES", "256"))
+TOKEN_ESTIMATE_CACHE_TTL_SECONDS = float(os.environ.get("TOKEN_ESTIMATE_CACHE_TTL_SECONDS", "3600"))
+
+# Prompt caching configuration
+PROMPT_CACHING_ENABLED = os.environ.get("PROMPT_CACHING_ENABLED", "true").lower() == "true"
+
+# Logging configuration
+# Longest payload, such as a prompt or model response, written to a log message
+LOG_FIELD_MAX_CHARS = int(os.environ.get("LOG_FIELD_MAX_CHARS", "2000"))
+# Fraction of requests whose payloads are logged
+LOG_DETAIL_SAMPLE_RATE = float(os.environ.get("LOG_DETAIL_SAMPLE_RATE", "0.01"))
+# Users whose requests are always logged in full
+LOG_DEBUG_USER_IDS = frozenset(
+    user_id.strip() for user_id in os.environ.get("LOG_DEBUG_USER_IDS", "").split(",") if user_id.strip()
+)
+
+# Metrics configuration
+# Write per-request stage timings as CloudWatch Embedded Metric Format documents
+METRICS_EMF_ENABLED = os.environ.get("METRICS_EMF_ENABLED", "false").lower() == "true"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "SlackLLM")
+
+# Bedrock client configuration
+BEDROCK_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("BEDROCK_CONNECT_TIMEOUT_SECONDS", "5"))
+# Converse sends nothing until the reply is complete, reasoning replies take minutes. Kept
+# below the 5 minute function timeout so a timed out call still leaves time to tell the user
+BEDROCK_READ_TIMEOUT_SECONDS = float(os.environ.get("BEDROCK_READ_TIMEOUT_SECONDS", "240"))
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "25"))
+# Attempts per call, including the first
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "4"))
+BEDROCK_RETRY_BASE_DELAY_SECONDS = float(os.environ.get("BEDROCK_RETRY_BASE_DELAY_SECONDS", "0.5"))
+BEDROCK_RETRY_MAX_DELAY_SECONDS = float(os.environ.get("BEDROCK_RETRY_MAX_DELAY_SECONDS", "8"))
+# Consecutive failed calls to a model before its calls fail fast, and for how long
+BEDROCK_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("BEDROCK_CIRCUIT_FAILURE_THRESHOLD", "5"))
+BEDROCK_CIRCUIT_RESET_SECONDS = float(os.environ.get("BEDROCK_CIRCUIT_RESET_SECONDS", "30"))
+
+# Hedging configuration
+# Requests to a model with a fallback_model also invoke the fallback when the first is slow
+HEDGING_ENABLED = os.environ.get("HEDGING_ENABLED", "false").lower() == "true"
+HEDGE_FIRST_TOKEN_TIMEOUT_SECONDS = float(os.environ.get("HEDGE_FIRST_TOKEN_TIMEOUT_SECONDS", "8"))
+HEDGE_POOL_SIZE = int(os.environ.get("HEDGE_POOL_SIZE", "8"))
+
+# Streaming configuration
+STREAMING_RESPONSES_ENABLED = os.environ.get("STREAMING_RESPONSES_ENABLED", "false").lower() == "true"
+STREAMING_UPDATE_INTERVAL_SECONDS = float(os.environ.get("STREAMING_UPDATE_INTERVAL_SECONDS", "1.0"))
+STREAMING_UPDATE_MIN_CHARS = int(os.environ.get("STREAMING_UPDATE_MIN_CHARS", "200"))
+
 @dataclass
 class BedrockModelConfig:
     arn: str
     description: str
     default_system_prompt: str = ""
     isReasoningModel: bool = False
+    # Images are downscaled so their long edge fits this many pixels, 0 disables normalization
+    max_image_dimension: int = 1568
+    # Format images are re-encoded to (jpeg, png or webp)
+    image_output_format: str = "jpeg"
+    # Send documents as raw blocks even when text extraction is enabled
+    prefers_document_layout: bool = False
+    # Tokens the model accepts, input and output together
+    context_window_tokens: int = 200000
+    # Tokens reserved for the response
+    max_output_tokens: int = 8192
+    # Model accepts Converse cachePoint blocks
+    supports_prompt_caching: bool = False
+    # Unique key stored in user preferences, defaults to the ARN
+    key: str = ""
+    # Content types the model accepts (text, image, document, video)
+    modalities: tuple = ("text", "image", "document")
+    # Extended thinking budget for reasoning models, must be less than max_output_tokens
+    thinking_budget_tokens: int = 0
+    # Model can be invoked with converse_stream
+    supports_streaming: bool = True
+    # Key of the model also invoked when this one is slow to respond, with hedging enabled
+    fallback_model: str = ""
+
+    def __post_init__(self):
+        if not self.key:
+            self.key = self.arn
+
+class ModelRegistry:
+    """
+    Index of the configured models, built once.
+
+    Models are looked up by their unique key. Lookups by ARN are also accepted, for the
+    BEDROCK_MODEL_ID environment variable and preferences stored before keys existed.
+    Before keys existed, an ARN shared by several models was always invoked in reasoning
+    mode, so an ARN lookup returns the reasoning variant if there is one, and otherwise
+    the first model configured with that ARN.
+    """
+
+    def __init__(self, models):
+        self._models = list(models)
+        self._by_key = {}
+        self._by_arn = {}
+        for model in self._models:
+            if model.key in self._by_key:
+                raise ValueError(f"Duplicate model key: {model.key}")
+            self._by_key[model.key] = model
+            if model.isReasoningModel and not getattr(self._by_arn.get(model.arn), "isReasoningModel", False):
+                self._by_arn[model.arn] = model
+            else:
+                self._by_arn.setdefault(model.arn, model)
+        for model in self._models:
+            if model.fallback_model and model.fallback_model not in self._by_key:
+                raise ValueError(f"Unknown fallback model {model.fallback_model} for {model.key}")
+
+    def get(self, model_id):
+        """Get the model for a key or ARN, or None if it is not a known model."""
+        if model_id is None:
+            return None
+        return self._by_key.get(model_id) or self._by_arn.get(model_id)
+
+    def all(self):
+        """Get every configured model, in configuration order."""
+        return list(self._models)
 
 # Bedrock model configurations
 BEDROCK_MODELS = [
     BedrockModelConfig(
         arn="arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0",
         description="Anthropic Claude 3.5 Sonnet V2 (Text, Image, Document)",
+        key="claude-3-5-sonnet-v2",
+        fallback_model="claude-3-5-haiku",
         default_system_prompt=\
 '''The assistant is Claude, created by Anthropic.
 The current date is {datetime}.
@@ -66,6 +282,8 @@ Claude is now being connected with a human.
     BedrockModelConfig(
         arn="arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.anthropic.claude-3-5-haiku-20241022-v1:0",
         description="Anthropic Claude 3.5 Haiku (Text, Image, Document)",
+        key="claude-3-5-haiku",
+        supports_prompt_caching=True,
         default_system_prompt=\
 '''The assistant is Claude, created by Anthropic.
 The current date is {datetime}.
@@ -106,16 +324,30 @@ Claude is now being connected with a human.
     BedrockModelConfig(
         arn="arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.amazon.nova-pro-v1:0",
         description="Amazon Nova Pro (Text, Image, Document, Video)",
-        default_system_prompt="You are Nova, a helpful AI assistant. The current time is {datetime}."
+        key="nova-pro",
+        fallback_model="nova-lite",
+        modalities=("text", "image", "document", "video"),
+        supports_prompt_caching=True,
+        default_system_prompt="You are Nova, a helpful AI assistant. The current date is {datetime}.",
+        context_window_tokens=300000,
+        max_output_tokens=5000
     ),
     BedrockModelConfig(
         arn="arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.amazon.nova-lite-v1:0",
         description="Amazon Nova Lite (Text, Image, Document, Video)",
-        default_system_prompt="You are Nova, a helpful AI assistant. The current time is {datetime}."
+        key="nova-lite",
+        modalities=("text", "image", "document", "video"),
+        supports_prompt_caching=True,
+        default_system_prompt="You are Nova, a helpful AI assistant. The current date is {datetime}.",
+        context_window_tokens=300000,
+        max_output_tokens=5000
     ),
     BedrockModelConfig(
         arn="arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.anthropic.claude-3-7-sonnet-20250219-v1:0",
         description="Anthropic Claude 3.7 Sonnet (Text, Image, Document)",
+        key="claude-3-7-sonnet",
+        fallback_model="claude-3-5-sonnet-v2",
+        supports_prompt_caching=True,
         default_system_prompt=\
 '''The assistant is Claude, created by Anthropic.
 The current date is {datetime}.
@@ -169,7 +401,11 @@ Claude is now being connected with a person.
     BedrockModelConfig(
         arn="arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.anthropic.claude-3-7-sonnet-20250219-v1:0",
         description="Anthropic Claude 3.7 Sonnet Reasoning (Text, Image, Document)",
+        key="claude-3-7-sonnet-reasoning",
+        supports_prompt_caching=True,
         isReasoningModel=True,
+        max_output_tokens=64000,
+        thinking_budget_tokens=48000,
         default_system_prompt=\
 '''The assistant is Claude, created by Anthropic.
 The current date is {datetime}.
@@ -222,3 +458,5 @@ Claude is now being connected with a person.
 '''
     )
 ]
+
+MODEL_REGISTRY = ModelRegistry(BEDROCK_MODELS)
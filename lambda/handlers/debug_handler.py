@@ -1,5 +1,6 @@
 import os
 from config import logger
+from service.log_detail import LogDetail
 
 class DebugHandler:
     @staticmethod
@@ -11,7 +12,7 @@ class DebugHandler:
             message (dict): The message event from Slack.
             say (function): A function to send a response message.
         """
-        logger.info(f"Received debug message: {message['text']}")
+        logger.info(f"Received debug message: {LogDetail.field(message['text'])}")
         
         # Collect debug information
         debug_info = {
@@ -1,120 +1,369 @@
-import base64
-import itertools
-from config import logger
+import math
+from config import (
+    logger,
+    STREAMING_RESPONSES_ENABLED,
+    THREAD_HISTORY_MAX_MESSAGES,
+    THREAD_HISTORY_MAX_TOKENS,
+    PREFETCH_IDENTITY_TIMEOUT_SECONDS,
+    PREFETCH_PREFERENCES_TIMEOUT_SECONDS,
+    PREFETCH_THREAD_TIMEOUT_SECONDS,
+    PREFETCH_ATTACHMENTS_TIMEOUT_SECONDS,
+    PREFETCH_USAGE_TIMEOUT_SECONDS,
+    DEFAULT_BEDROCK_MODEL_ID,
+    MODEL_REGISTRY,
+)
 from service.bedrock_service import BedrockService
 from service.user_preferences_accessor import UserPreferencesAccessor
 from service.message_preparation_helper import MessagePreparationHelper
+from service.slack_message_streamer import SlackMessageStreamer
+from service.slack_metadata_cache import SlackMetadataCache
+from service.thread_conversation_store import ThreadConversationStore
+from service.thread_history_reader import ThreadHistoryReader
+from service.thread_summarizer import ThreadSummarizer
+from service.event_idempotency_store import EventIdempotencyStore
+from service.prefetcher import Prefetcher
+from service.usage_tracker import UsageTracker
+from service.bedrock_invoker import is_transient_error
+from service.metrics import Metrics
+from service.log_detail import LogDetail
 
 class MessageHandler:
     def __init__(self):
         self.bedrock_service = BedrockService()
         self.user_preferences_accessor = UserPreferencesAccessor()
         self.message_preparation_helper = MessagePreparationHelper()
+        self.slack_metadata_cache = SlackMetadataCache()
+        self.thread_store = ThreadConversationStore()
+        self.thread_history_reader = ThreadHistoryReader()
+        self.thread_summarizer = ThreadSummarizer(self.bedrock_service)
+        self.event_idempotency_store = EventIdempotencyStore()
+        self.usage_tracker = UsageTracker()
 
-    def handle_message(self, body, say, app_client):
-        bot_user_id = app_client.auth_test()["user_id"]
-        message_text = body["event"].get("text", "")
-        user_id = body["event"]["user"]
-        files = body["event"].get("files", [])
+    def handle_message(self, body, say, app_client, raise_errors=False):
+        """
+        Reply to a Slack message event, if the bot should.
+
+        Errors are replied to the user in the thread. Callers that retry events can
+        ask for transient errors, such as an overloaded or unavailable model, to be
+        raised again after the user is told the reply is being retried.
+
+        Args:
+            body (dict): The Slack event body.
+            say (callable): Posts a message to the event's channel.
+            app_client: The Slack app client.
+            raise_errors (bool, optional): Re-raise transient errors. Defaults to False.
+        """
+        try:
+            with (
+                LogDetail.request(user_id=body["event"].get("user")),
+                Metrics.request(ChannelType=body["event"].get("channel_type")),
+                Metrics.stage("request"),
+            ):
+                self._handle_event(body, say, app_client, raise_errors)
+        finally:
+            # Token usage is written while the reply is delivered, finish it before the invocation ends
+            UsageTracker.wait_for_pending()
+
+    def _handle_event(self, body, say, app_client, raise_errors):
+        event = body["event"]
+        prefetch = self._start_prefetch(event, app_client)
+        bot_user_id = prefetch.get("bot_user_id", PREFETCH_IDENTITY_TIMEOUT_SECONDS)
+        message_text = event.get("text", "")
+        user_id = event["user"]
+        channel = event.get("channel")
+        files = event.get("files", [])
+        thread_ts = event.get("thread_ts")
         logger.info(f"Processing message from user {user_id} with {len(files)} files.")
 
-        # Process app mentions in public & private channels
+        # Work out whether the bot replies before claiming the event or loading anything for the reply,
+        # so ignored messages cost no more than the bot identity and stored thread state lookups
+        thread_state = None
         if f"<@{bot_user_id}>" in message_text:
-            self._handle_mention(message_text, bot_user_id, body["event"]["ts"], user_id, say, files, app_client)
+            attachments = files
+        elif not thread_ts and event["channel_type"] == "im":
+            attachments = files
+        elif thread_ts:
+            thread_state = self._get_thread_state(prefetch, event, bot_user_id, say, app_client, raise_errors)
+            if thread_state is None:
+                return
+            attachments = [file for turn in thread_state.all_turns() for file in turn["files"]]
+        else:
             return
 
-        # Process direct messages
-        if "thread_ts" not in body["event"] and body["event"]["channel_type"] == "im":
-            self._handle_direct_message(message_text, body["event"]["ts"], user_id, say, files, app_client)
+        # Slack retries and duplicate lazy invocations exit before downloading anything or calling the model
+        if not self._claim(body):
             return
+        self._start_reply_prefetch(prefetch, user_id)
+        self._start_attachment_prefetch(prefetch, attachments, app_client)
 
+        # Process app mentions in public & private channels
+        if f"<@{bot_user_id}>" in message_text:
+            self._handle_mention(message_text, bot_user_id, event["ts"], say, files, app_client, channel, prefetch, raise_errors)
+        # Process direct messages
+        elif thread_state is None:
+            self._handle_direct_message(message_text, event["ts"], say, files, app_client, channel, prefetch, raise_errors)
         # Process threaded conversations
-        thread_ts = body["event"].get("thread_ts")
+        else:
+            self._handle_thread(event, thread_ts, thread_state, say, app_client, prefetch, raise_errors)
+
+    def _claim(self, body):
+        """Claims the event, returning False if another invocation already processed it."""
+        event_id = body.get("event_id") or f"{body['event'].get('channel')}:{body['event']['ts']}"
+        if not self.event_idempotency_store.claim(event_id):
+            logger.info(f"Event {event_id} has already been processed, skipping it.")
+            return False
+        return True
+
+    def _get_thread_state(self, prefetch, event, bot_user_id, say, app_client, raise_errors):
+        """
+        Reads the history of the event's thread, if the bot replies in it.
+
+        A thread stored with a bot reply starts loading the reply's dependencies while its
+        history is read. Any other thread needs its history read to find out whether the
+        bot replied in it, since its state may not have been stored.
+
+        Returns:
+            ThreadState: The thread state, or None if the bot does not reply in the thread
+                or its history could not be read, in which case the error was replied.
+        """
+        try:
+            stored_thread_state = prefetch.get("stored_thread_state", PREFETCH_THREAD_TIMEOUT_SECONDS)
+            if stored_thread_state.bot_responded:
+                self._start_reply_prefetch(prefetch, event["user"])
+            prefetch.start(
+                "thread_state",
+                lambda: self._append_thread_history(app_client, stored_thread_state, bot_user_id)
+            )
+            thread_state = prefetch.get("thread_state", PREFETCH_THREAD_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error(f"Error while processing threaded conversation: {str(e)}")
+            self._handle_error(e, say, None, event["thread_ts"], raise_errors)
+            return None
+
+        if not thread_state.bot_responded:
+            logger.info("Bot has not responded earlier in the thread. Skipping processing.")
+            return None
+        return thread_state
+
+    def _start_prefetch(self, event, app_client):
+        """
+        Starts loading what is needed to decide whether the bot replies.
+
+        The bot identity and, for thread replies, the stored thread state load concurrently.
+        """
+        channel = event.get("channel")
+        thread_ts = event.get("thread_ts")
+
+        prefetch = Prefetcher()
+        prefetch.start("bot_user_id", self._timed("identity_lookup", self.slack_metadata_cache.get_bot_user_id, app_client))
         if thread_ts:
-            self._handle_thread(body["event"], bot_user_id, thread_ts, user_id, say, app_client)
+            prefetch.start("stored_thread_state", self._timed("thread_state_load", self.thread_store.load, channel, thread_ts))
+        return prefetch
+
+    def _start_reply_prefetch(self, prefetch, user_id):
+        """Starts loading the user's preferences and usage allowance once the bot is known to reply."""
+        if prefetch.started("preferences"):
             return
+        prefetch.start("preferences", self._timed("preferences_read", self.user_preferences_accessor.get_user_preferences, user_id))
+        prefetch.start("allowance", self._timed("usage_check", self.usage_tracker.check, user_id))
+
+    def _start_attachment_prefetch(self, prefetch, attachments, app_client):
+        """Downloads the attachments of a claimed event into the cache once the user is within their budget."""
+        def load_attachments(allowance):
+            if not allowance.allowed:
+                return 0
+            with Metrics.stage("attachments_prefetch"):
+                return self.message_preparation_helper.prefetch_files(attachments, app_client)
+
+        prefetch.start("attachments", load_attachments, depends_on=("allowance",))
+
+    def _timed(self, stage, function, *args):
+        """Wraps a call as a zero-argument loader timed as a stage."""
+        def load():
+            with Metrics.stage(stage):
+                return function(*args)
+        return load
 
-    def _handle_mention(self, message_text, bot_user_id, ts, user_id, say, files, app_client):
+    def _append_thread_history(self, app_client, thread_state, bot_user_id):
+        # Only fetch the messages posted since the stored state was last updated
+        new_messages = self.thread_history_reader.iter_messages(
+            app_client,
+            thread_state.channel,
+            thread_state.thread_ts,
+            oldest=thread_state.cursor,
+            max_messages=THREAD_HISTORY_MAX_MESSAGES,
+            max_tokens=THREAD_HISTORY_MAX_TOKENS
+        )
+
+        with Metrics.stage("history_fetch"):
+            appended = thread_state.append_messages(new_messages, bot_user_id)
+        logger.info(f"Read {appended} new messages after {len(thread_state.turns)} stored turns.")
+        return thread_state
+
+    def _reject_if_over_budget(self, prefetch, say, thread_ts):
+        """
+        Replies with a rejection when the user has used up their token budget.
+
+        Returns:
+            bool: Whether the request was rejected.
+        """
+        try:
+            allowance = prefetch.get("allowance", PREFETCH_USAGE_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f"Could not check token usage, allowing the request: {e}")
+            return False
+        if allowance.allowed:
+            return False
+
+        minutes = max(1, math.ceil(allowance.retry_after_seconds / 60))
+        logger.info(f"User is over their token budget for another {allowance.retry_after_seconds:.0f} seconds.")
+        Metrics.count("rate_limited_requests", 1)
+        say(
+            text=f"You've used up your token budget for now. Please try again in about {minutes} minute{'s' if minutes != 1 else ''}.",
+            thread_ts=thread_ts
+        )
+        return True
+
+    def _wait_for_attachments(self, prefetch):
+        """Waits for prefetched attachments, missing ones are downloaded while preparing the message."""
+        try:
+            prefetch.get("attachments", PREFETCH_ATTACHMENTS_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f"Attachments were not prefetched: {e}")
+
+    def _handle_mention(self, message_text, bot_user_id, ts, say, files, app_client, channel, prefetch, raise_errors):
         logger.info("Processing app mention")
+        streamer = None
         try:
-            message = self.message_preparation_helper.prepare_message(
-                message_text.replace(f"<@{bot_user_id}>", "").strip(), 
-                files, 
-                app_client
-            )
-            model_response = self._get_model_response([message], user_id)
-            say(model_response, thread_ts=ts)
+            if self._reject_if_over_budget(prefetch, say, ts):
+                return
+            streamer = self._start_streamer(app_client, channel, ts)
+            preferences = prefetch.get("preferences", PREFETCH_PREFERENCES_TIMEOUT_SECONDS)
+            self._wait_for_attachments(prefetch)
+            with Metrics.stage("message_preparation"):
+                message = self.message_preparation_helper.prepare_message(
+                    message_text.replace(f"<@{bot_user_id}>", "").strip(), 
+                    files, 
+                    app_client,
+                    model_id=preferences.model_id
+                )
+            self._deliver_response([message], preferences, say, streamer, ts)
         except Exception as e:
             logger.error(f"An error occurred while processing the app mention: {str(e)}")
-            say(text=f"Error: {str(e)}", thread_ts=ts)
+            self._handle_error(e, say, streamer, ts, raise_errors)
 
-    def _handle_direct_message(self, message_text, ts, user_id, say, files, app_client):
+    def _handle_direct_message(self, message_text, ts, say, files, app_client, channel, prefetch, raise_errors):
         logger.info("Processing direct message")
+        streamer = None
         try:
-            message = self.message_preparation_helper.prepare_message(message_text, files, app_client)
-            model_response = self._get_model_response([message], user_id)
-            say(model_response, thread_ts=ts)
+            if self._reject_if_over_budget(prefetch, say, ts):
+                return
+            streamer = self._start_streamer(app_client, channel, ts)
+            preferences = prefetch.get("preferences", PREFETCH_PREFERENCES_TIMEOUT_SECONDS)
+            self._wait_for_attachments(prefetch)
+            with Metrics.stage("message_preparation"):
+                message = self.message_preparation_helper.prepare_message(
+                    message_text,
+                    files,
+                    app_client,
+                    model_id=preferences.model_id
+                )
+            self._deliver_response([message], preferences, say, streamer, ts)
         except Exception as e:
             logger.error(f"An error occurred while processing direct message: {str(e)}")
-            say(text=f"Error: {str(e)}", thread_ts=ts)
+            self._handle_error(e, say, streamer, ts, raise_errors)
 
-    def _handle_thread(self, event, bot_user_id, thread_ts, user_id, say, app_client):
+    def _handle_thread(self, event, thread_ts, thread_state, say, app_client, prefetch, raise_errors):
         logger.info("Processing threaded conversation")
         channel = event["channel"]
+        streamer = None
 
         try:
-            conversation_history = app_client.conversations_replies(
-                channel=channel,
-                ts=thread_ts,
-                limit=100,
-            )
-
-            bot_responded_earlier = any(
-                message.get("user") == bot_user_id
-                for message in conversation_history["messages"]
-                if message.get("user") is not None
-            )
+            self.thread_store.save(thread_state)
 
-            if not bot_responded_earlier:
-                logger.info("Bot has not responded earlier in the thread. Skipping processing.")
+            if self._reject_if_over_budget(prefetch, say, thread_ts):
                 return
+            streamer = self._start_streamer(app_client, channel, thread_ts)
+            preferences = prefetch.get("preferences", PREFETCH_PREFERENCES_TIMEOUT_SECONDS)
+            self._wait_for_attachments(prefetch)
 
-            # Group messages by user and prepare them with files
-            messages = []
-            for is_assistant, group in itertools.groupby(
-                (m for m in conversation_history["messages"] if m.get("user") is not None),
-                key=lambda m: m.get("user") == bot_user_id
-            ):
-                group_messages = list(group)
-                # Concatenate text from all messages in the group
-                combined_text = " ".join(msg.get("text", "") for msg in group_messages)
-                
-                # Get files from all messages in the group
-                all_files = []
-                for msg in group_messages:
-                    if msg.get("files"):
-                        all_files.extend(msg.get("files"))
-
-                # Prepare the message with text and files
-                prepared_message = self.message_preparation_helper.prepare_message(combined_text, all_files, app_client)
-                prepared_message["role"] = "assistant" if is_assistant else "user"
-                messages.append(prepared_message)
-
-            model_response = self._get_model_response(messages, user_id)
-            say(model_response, thread_ts=thread_ts)
+            # Prepare each turn with its files, attachments were prefetched into the cache
+            with Metrics.stage("message_preparation"):
+                messages = self.thread_summarizer.summary_messages(thread_state)
+                for turn in thread_state.all_turns():
+                    prepared_message = self.message_preparation_helper.prepare_message(
+                        turn["text"],
+                        turn["files"],
+                        app_client,
+                        model_id=preferences.model_id
+                    )
+                    prepared_message["role"] = turn["role"]
+                    messages.append(prepared_message)
+
+            self._deliver_response(messages, preferences, say, streamer, thread_ts)
+
+            # Compact older turns after replying, so summarization never delays the response
+            if self.thread_summarizer.update(thread_state, user_id=event["user"]):
+                self.thread_store.save(thread_state)
 
         except Exception as e:
             logger.error(f"Error while processing threaded conversation: {str(e)}")
-            say(text=f"Error: {str(e)}", thread_ts=thread_ts)
+            self._handle_error(e, say, streamer, thread_ts, raise_errors)
 
-    def _get_model_response(self, messages, user_id):
-        # Get user's preferred model
-        model_id = self.user_preferences_accessor.get_user_model(user_id)
+    def _start_streamer(self, app_client, channel, thread_ts):
+        """Posts a placeholder reply when streaming is enabled, so users see progress right away."""
+        if not STREAMING_RESPONSES_ENABLED:
+            return None
+        streamer = SlackMessageStreamer(app_client, channel, thread_ts)
+        streamer.start()
+        return streamer
+
+    def _deliver_response(self, messages, preferences, say, streamer, thread_ts):
+        model_config = MODEL_REGISTRY.get(preferences.model_id or DEFAULT_BEDROCK_MODEL_ID)
+        Metrics.set_dimension("Model", model_config.key if model_config else preferences.model_id)
+        if streamer:
+            with Metrics.stage("model_invocation"):
+                model_response = self._get_model_response(messages, preferences, on_text=streamer.update)
+            with Metrics.stage("slack_delivery"):
+                streamer.finish(model_response)
+        else:
+            with Metrics.stage("model_invocation"):
+                model_response = self._get_model_response(messages, preferences)
+            with Metrics.stage("slack_delivery"):
+                say(model_response, thread_ts=thread_ts)
+
+    def _handle_error(self, error, say, streamer, thread_ts, raise_errors):
+        """Replies with the error, and raises it again when it is transient and the caller retries."""
+        if raise_errors and is_transient_error(error):
+            self._deliver_error(f"Error: {str(error)}\nTrying again shortly.", say, streamer, thread_ts)
+            raise error
+        self._deliver_error(f"Error: {str(error)}", say, streamer, thread_ts)
+
+    def _deliver_error(self, error_text, say, streamer, thread_ts):
+        if streamer:
+            try:
+                streamer.fail(error_text)
+                return
+            except Exception as e:
+                logger.error(f"Error updating streamed message with error: {str(e)}")
+        say(text=error_text, thread_ts=thread_ts)
+
+    def _get_model_response(self, messages, preferences, on_text=None):
+        # Stream the response into Slack when a progress callback is given
+        if on_text:
+            return self.bedrock_service.invoke_model_stream(
+                messages=messages,
+                model_id=preferences.model_id,
+                user_id=preferences.user_id,
+                preferences=preferences,
+                on_text=on_text
+            )
 
         # Invoke the model with the prepared messages
         response = self.bedrock_service.invoke_model(
             messages=messages,
-            model_id=model_id,
-            user_id=user_id
+            model_id=preferences.model_id,
+            user_id=preferences.user_id,
+            preferences=preferences
         )
         return response 
\ No newline at end of file
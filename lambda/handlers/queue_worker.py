@@ -0,0 +1,145 @@
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from slack_bolt.context.say import Say
+from config import (
+    logger,
+    JOB_QUEUE_MAX_ATTEMPTS,
+    WORKER_BATCH_SIZE,
+    WORKER_CONCURRENCY,
+    WORKER_REASONING_CONCURRENCY,
+)
+from service.job_queue import Job, LANE_REASONING, LANE_STANDARD
+
+class QueueWorker:
+    """
+    Processes queued message jobs in small batches.
+
+    Jobs of different threads in a batch run concurrently, jobs of the same thread run
+    one after another in queue order. Consecutive replies in a thread are coalesced:
+    only the last one is processed, since its thread history already includes the
+    earlier ones, so a burst of replies produces a single answer.
+
+    Each execution lane has its own workers and concurrency limit, so threads waiting
+    on a reasoning model never hold the workers of quick replies.
+
+    Transient failures, such as an overloaded model, fail the job so the queue retries
+    it, until its last attempt, which replies to the user with the error instead.
+    """
+
+    def __init__(self, message_handler, app_client, concurrency=WORKER_CONCURRENCY,
+                 reasoning_concurrency=WORKER_REASONING_CONCURRENCY, max_attempts=JOB_QUEUE_MAX_ATTEMPTS):
+        self.message_handler = message_handler
+        self.app_client = app_client
+        self.max_attempts = max_attempts
+        self.lane_concurrency = {
+            LANE_STANDARD: concurrency,
+            LANE_REASONING: reasoning_concurrency,
+        }
+
+    def handle_sqs_event(self, event):
+        """
+        Processes a batch delivered by the Lambda SQS event source.
+
+        Args:
+            event (dict): The Lambda event with SQS records.
+
+        Returns:
+            dict: A partial batch response listing the jobs to retry.
+        """
+        jobs = [
+            Job.from_json(
+                record["body"],
+                receipt=record["messageId"],
+                attempts=int(record.get("attributes", {}).get("ApproximateReceiveCount", 1))
+            )
+            for record in event["Records"]
+        ]
+        failed_jobs = self.process_batch(jobs)
+        return {"batchItemFailures": [{"itemIdentifier": job.receipt} for job in failed_jobs]}
+
+    def drain(self, queue, batch_size=WORKER_BATCH_SIZE, max_batches=None):
+        """
+        Processes jobs from a local queue until it is empty.
+
+        Args:
+            queue (SQLiteJobQueue): The queue to drain.
+            batch_size (int, optional): The most jobs received at once.
+            max_batches (int, optional): Stop after this many batches. Defaults to None.
+
+        Returns:
+            int: The number of jobs received.
+        """
+        received = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            jobs = queue.receive(batch_size)
+            if not jobs:
+                break
+            failed_receipts = {job.receipt for job in self.process_batch(jobs)}
+            for job in jobs:
+                if job.receipt in failed_receipts:
+                    queue.fail(job)
+                else:
+                    queue.ack(job)
+            received += len(jobs)
+            batches += 1
+        return received
+
+    def process_batch(self, jobs):
+        """
+        Processes a batch of jobs.
+
+        Args:
+            jobs (list): The jobs, in queue order.
+
+        Returns:
+            list: The jobs that failed. After a failure the remaining jobs of its thread
+                are not run and are returned as well, so they are retried in order.
+        """
+        groups = OrderedDict()
+        for job in jobs:
+            groups.setdefault(job.group_id, []).append(job)
+        logger.info(f"Processing {len(jobs)} jobs from {len(groups)} threads")
+
+        if len(groups) == 1:
+            return self._process_group(jobs)
+
+        # A thread runs in the lane of its first job, each lane on its own workers
+        lane_sizes = Counter(group_jobs[0].lane for group_jobs in groups.values())
+        executors = {
+            lane: ThreadPoolExecutor(
+                max_workers=min(self.lane_concurrency.get(lane, self.lane_concurrency[LANE_STANDARD]), size),
+                thread_name_prefix=f"queue-worker-{lane}"
+            )
+            for lane, size in lane_sizes.items()
+        }
+        try:
+            futures = [
+                executors[group_jobs[0].lane].submit(self._process_group, group_jobs)
+                for group_jobs in groups.values()
+            ]
+            return [job for future in futures for job in future.result()]
+        finally:
+            for executor in executors.values():
+                executor.shutdown()
+
+    def _process_group(self, jobs):
+        for index, job in enumerate(jobs):
+            next_job = jobs[index + 1] if index + 1 < len(jobs) else None
+            if job.is_thread_reply and next_job is not None and next_job.is_thread_reply:
+                logger.info(f"Job {job.job_id} is covered by the next reply in its thread, skipping it")
+                continue
+            try:
+                self._process_job(job)
+            except Exception as e:
+                logger.error(f"Job {job.job_id} failed on attempt {job.attempts}: {e}")
+                # Let the retry run again instead of being treated as a duplicate
+                self.message_handler.event_idempotency_store.release(job.job_id)
+                return jobs[index:]
+        return []
+
+    def _process_job(self, job):
+        say = Say(client=self.app_client, channel=job.body["event"].get("channel"))
+        self.message_handler.handle_message(
+            job.body, say, self.app_client, raise_errors=job.attempts < self.max_attempts
+        )
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import threading
+import uuid
+from config import (
+    logger,
+    ATTACHMENT_CACHE_DIR,
+    ATTACHMENT_CACHE_MAX_BYTES,
+    ATTACHMENT_CACHE_BUCKET,
+    ATTACHMENT_CACHE_PREFIX,
+)
+from service.shared_clients import SharedClients
+
+class AttachmentCache:
+    """
+    Content-addressed cache for Slack file downloads.
+
+    Files are looked up by Slack file ID. The ID maps to the SHA-256 digest of the
+    content, and the content itself is stored once per digest. There are two tiers:
+
+    - a local tier in /tmp, shared by every instance in the container and kept under
+      a byte budget by evicting the least recently used blobs, and
+    - an optional shared tier in S3, enabled by setting ATTACHMENT_CACHE_BUCKET, so
+      that a cold container can still skip the Slack download.
+    """
+    # Serializes eviction and index updates within the container
+    _lock = threading.Lock()
+
+    def __init__(self, cache_dir=ATTACHMENT_CACHE_DIR, max_bytes=ATTACHMENT_CACHE_MAX_BYTES,
+                 bucket=ATTACHMENT_CACHE_BUCKET, prefix=ATTACHMENT_CACHE_PREFIX):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.bucket = bucket
+        self.prefix = prefix
+        self._s3 = None
+
+    @property
+    def s3(self):
+        """Lazy initialization of the S3 client."""
+        if self._s3 is None:
+            self._s3 = SharedClients.s3()
+        return self._s3
+
+    def get(self, file_info):
+        """
+        Get cached content for a Slack file.
+
+        Args:
+            file_info (dict): The Slack file object.
+
+        Returns:
+            bytes: The file content, or None on a cache miss.
+        """
+        file_id = file_info.get("id")
+        if not file_id:
+            return None
+
+        content = self._get_local(file_id)
+        if content is None and self.bucket:
+            content = self._get_shared(file_id)
+            if content is not None:
+                self._put_local(file_id, content, self._digest(content))
+
+        if content is not None and not self._matches_size(file_info, content):
+            logger.info(f"Cached attachment {file_id} is stale, ignoring it")
+            return None
+        return content
+
+    def put(self, file_info, content):
+        """
+        Store the content of a Slack file in every enabled tier.
+
+        Failures are logged and swallowed, the cache is only an optimization.
+
+        Args:
+            file_info (dict): The Slack file object.
+            content (bytes): The file content.
+        """
+        file_id = file_info.get("id")
+        if not file_id:
+            return
+
+        digest = self._digest(content)
+        self._put_local(file_id, content, digest)
+        if self.bucket:
+            try:
+                self.s3.put_object(
+                    Bucket=self.bucket,
+                    Key=f"{self.prefix}{file_id}",
+                    Body=content,
+                    Metadata={"sha256": digest}
+                )
+            except Exception as e:
+                logger.warning(f"Error writing attachment {file_id} to shared cache: {e}")
+
+    def _get_local(self, file_id):
+        try:
+            with open(self._index_path(file_id)) as index_file:
+                digest = index_file.read().strip()
+            blob_path = self._blob_path(digest)
+            with open(blob_path, "rb") as blob_file:
+                content = blob_file.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Error reading attachment {file_id} from local cache: {e}")
+            return None
+
+        if self._digest(content) != digest:
+            logger.warning(f"Local cache entry for attachment {file_id} is corrupt, ignoring it")
+            return None
+
+        # Record the access so eviction keeps recently used blobs
+        try:
+            os.utime(blob_path)
+        except OSError:
+            pass
+        logger.info(f"Attachment {file_id} served from local cache")
+        return content
+
+    def _get_shared(self, file_id):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{file_id}")
+            content = response["Body"].read()
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                logger.warning(f"Error reading attachment {file_id} from shared cache: {e}")
+            return None
+
+        expected_digest = response.get("Metadata", {}).get("sha256")
+        if expected_digest and self._digest(content) != expected_digest:
+            logger.warning(f"Shared cache entry for attachment {file_id} is corrupt, ignoring it")
+            return None
+        logger.info(f"Attachment {file_id} served from shared cache")
+        return content
+
+    def _put_local(self, file_id, content, digest):
+        if len(content) > self.max_bytes:
+            return
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self._blob_path(digest)), exist_ok=True)
+                os.makedirs(os.path.dirname(self._index_path(file_id)), exist_ok=True)
+                self._write_atomically(self._blob_path(digest), content)
+                self._write_atomically(self._index_path(file_id), digest.encode())
+                self._evict()
+        except Exception as e:
+            logger.warning(f"Error writing attachment {file_id} to local cache: {e}")
+
+    def _evict(self):
+        """Removes least recently used blobs until the local tier fits its byte budget."""
+        blob_dir = os.path.join(self.cache_dir, "blobs")
+        blobs = []
+        total_bytes = 0
+        for entry in os.scandir(blob_dir):
+            stat = entry.stat()
+            blobs.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+
+        for _, size, path in sorted(blobs):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(path)
+            total_bytes -= size
+            # Index entries pointing at evicted blobs are treated as misses on read
+
+    def _write_atomically(self, path, data):
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+    def _matches_size(self, file_info, content):
+        size = file_info.get("size")
+        return size is None or size == len(content)
+
+    def _digest(self, content):
+        return hashlib.sha256(content).hexdigest()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, "blobs", digest)
+
+    def _index_path(self, file_id):
+        safe_file_id = "".join(c if c.isalnum() else "_" for c in file_id)
+        return os.path.join(self.cache_dir, "ids", safe_file_id)
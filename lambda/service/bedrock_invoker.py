@@ -0,0 +1,201 @@
+import random
+import threading
+import time
+from botocore.exceptions import (
+    ClientError,
+    ConnectionError as BotocoreConnectionError,
+    HTTPClientError,
+    ReadTimeoutError,
+)
+from config import (
+    logger,
+    BEDROCK_MAX_ATTEMPTS,
+    BEDROCK_RETRY_BASE_DELAY_SECONDS,
+    BEDROCK_RETRY_MAX_DELAY_SECONDS,
+    BEDROCK_CIRCUIT_FAILURE_THRESHOLD,
+    BEDROCK_CIRCUIT_RESET_SECONDS,
+)
+from service.metrics import Metrics
+
+# Errors that say Bedrock or the model is overloaded or briefly unavailable
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+}
+# Errors that count against a model's circuit breaker without being retried
+DEGRADED_ERROR_CODES = RETRYABLE_ERROR_CODES | {"ModelTimeoutException"}
+
+class ModelUnavailableError(Exception):
+    """Raised without calling Bedrock while a model's circuit breaker is open."""
+
+def is_transient_error(error):
+    """
+    Check whether a failed request is worth trying again later.
+
+    Args:
+        error (Exception): The error the request failed with.
+
+    Returns:
+        bool: True if the model was overloaded, unavailable or could not be reached.
+    """
+    if isinstance(error, ModelUnavailableError):
+        return True
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in DEGRADED_ERROR_CODES
+    # A read timeout used up most of the invocation, a redelivered job would time out again
+    if isinstance(error, ReadTimeoutError):
+        return False
+    return isinstance(error, (BotocoreConnectionError, HTTPClientError))
+
+class CircuitBreaker:
+    """
+    Stops calling a model that keeps failing.
+
+    After BEDROCK_CIRCUIT_FAILURE_THRESHOLD consecutive failed calls the circuit opens
+    and calls fail fast for BEDROCK_CIRCUIT_RESET_SECONDS. After that, a single trial
+    call is let through, closing the circuit if it succeeds and opening it again if it
+    fails. Breakers are kept per model for the lifetime of the container.
+    """
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+    def __init__(self, model_id, failure_threshold=BEDROCK_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds=BEDROCK_CIRCUIT_RESET_SECONDS):
+        self.model_id = model_id
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_model(cls, model_id):
+        """Get the breaker shared by every call to a model."""
+        with cls._breakers_lock:
+            breaker = cls._breakers.get(model_id)
+            if breaker is None:
+                breaker = cls._breakers[model_id] = cls(model_id)
+            return breaker
+
+    @classmethod
+    def clear(cls):
+        """Forget all breakers."""
+        with cls._breakers_lock:
+            cls._breakers.clear()
+
+    def allow(self):
+        """
+        Check whether a call may be made, claiming the trial call once the circuit can reset.
+
+        Returns:
+            float: 0 if the call may be made, otherwise the seconds until the next trial call.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            remaining = self._opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0 or self._trial_in_flight:
+                return max(remaining, 1)
+            self._trial_in_flight = True
+            return 0
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit for {self.model_id} closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Circuit for {self.model_id} opened after {self._failures} failed calls")
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+class BedrockInvoker:
+    """
+    Calls Bedrock with retries, and a circuit breaker per model.
+
+    Throttling, transient service errors and connection failures are retried up to
+    BEDROCK_MAX_ATTEMPTS times in total, read timeouts are not, sleeping a random time between zero and an
+    exponentially growing cap (full jitter) so retrying containers spread out. The
+    client itself runs in adaptive retry mode, which slows down sending once Bedrock
+    throttles. Retries and time spent backing off are recorded as metrics.
+    """
+
+    def __init__(self, max_attempts=BEDROCK_MAX_ATTEMPTS, base_delay=BEDROCK_RETRY_BASE_DELAY_SECONDS,
+                 max_delay=BEDROCK_RETRY_MAX_DELAY_SECONDS):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def call(self, operation, **params):
+        """
+        Call a Bedrock runtime operation.
+
+        Args:
+            operation (callable): The client method, such as converse or converse_stream.
+            **params: The operation's parameters, including modelId.
+
+        Returns:
+            The operation's response.
+
+        Raises:
+            ModelUnavailableError: If the model's circuit breaker is open.
+            ClientError: If Bedrock rejects the call, or keeps failing after all attempts.
+        """
+        model_id = params.get("modelId")
+        breaker = CircuitBreaker.for_model(model_id)
+        retry_in = breaker.allow()
+        if retry_in:
+            Metrics.count("bedrock_circuit_rejections", 1)
+            raise ModelUnavailableError(
+                f"This model is temporarily unavailable. Please try again in about {int(retry_in) + 1} seconds "
+                f"or choose another model on the Home tab."
+            )
+
+        retries = 0
+        backoff_seconds = 0.0
+        try:
+            while True:
+                try:
+                    response = operation(**params)
+                except Exception as e:
+                    if not self._is_retryable(e) or retries + 1 >= self.max_attempts:
+                        if self._is_degraded(e):
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                        raise
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retries))
+                    retries += 1
+                    logger.warning(f"Retrying {model_id} in {delay:.2f}s after attempt {retries} failed: {e}")
+                    time.sleep(delay)
+                    backoff_seconds += delay
+                    continue
+                breaker.record_success()
+                return response
+        finally:
+            Metrics.count("bedrock_retries", retries)
+            if retries:
+                Metrics.record("bedrock_backoff", backoff_seconds)
+
+    def _is_retryable(self, error):
+        if isinstance(error, ClientError):
+            return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+        # A read timeout already used up most of the invocation, another attempt could not finish
+        if isinstance(error, ReadTimeoutError):
+            return False
+        return isinstance(error, (BotocoreConnectionError, HTTPClientError))
+
+    def _is_degraded(self, error):
+        if isinstance(error, ClientError):
+            return error.response.get("Error", {}).get("Code") in DEGRADED_ERROR_CODES
+        return isinstance(error, (BotocoreConnectionError, HTTPClientError))
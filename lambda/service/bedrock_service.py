@@ -1,81 +1,138 @@
-import boto3
 import datetime
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from botocore.exceptions import ClientError
-from config import logger, DEFAULT_BEDROCK_MODEL_ID, BEDROCK_MODELS
+from config import (
+    logger,
+    DEFAULT_BEDROCK_MODEL_ID,
+    MODEL_REGISTRY,
+    PROMPT_CACHING_ENABLED,
+    HEDGING_ENABLED,
+    HEDGE_FIRST_TOKEN_TIMEOUT_SECONDS,
+    HEDGE_POOL_SIZE,
+)
 from service.user_preferences_accessor import UserPreferencesAccessor
+from service.context_window_manager import ContextWindowManager
+from service.shared_clients import SharedClients
+from service.metrics import Metrics
+from service.log_detail import LogDetail
+from service.usage_tracker import UsageTracker
+from service.bedrock_invoker import BedrockInvoker
+
+# Only the date is substituted for {datetime}, so a system prompt stays byte-identical,
+# and its prompt cache entry stays usable, for a whole day
+SYSTEM_PROMPT_DATETIME_FORMAT = "%Y-%m-%d UTC"
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+class _HedgeRace:
+    """Decides which of the hedged requests answers, and cancels the others."""
+
+    def __init__(self):
+        # Resolves to the key of the model that answers
+        self.won = Future()
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def opened(self, key, stream):
+        with self._lock:
+            self._streams[key] = stream
+            lost = self.won.done() and self.won.result() != key
+        if lost:
+            self._close(stream)
+
+    def claim(self, key):
+        """Claim the answer for a request, returns whether it answers."""
+        with self._lock:
+            if not self.won.done():
+                self.won.set_result(key)
+            losers = [stream for other, stream in self._streams.items() if other != key]
+            won = self.won.result() == key
+        if won:
+            for stream in losers:
+                self._close(stream)
+        return won
+
+    def lost(self, key):
+        return self.won.done() and self.won.result() != key
+
+    def _close(self, stream):
+        try:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+        except Exception as e:
+            logger.info(f"Error closing a cancelled stream: {e}")
 
 class BedrockService:
+    # Shared by every service so hedged requests in the container stay bounded
+    _hedge_executor = ThreadPoolExecutor(
+        max_workers=HEDGE_POOL_SIZE,
+        thread_name_prefix="hedge"
+    )
+
     def __init__(self):
-        self.client = boto3.client("bedrock-runtime")
+        self._client = None
         self.user_preferences = UserPreferencesAccessor()
+        self.context_window_manager = ContextWindowManager()
+        self.usage_tracker = UsageTracker()
+        self.invoker = BedrockInvoker()
+
+    @property
+    def client(self):
+        """Lazy initialization of the shared Bedrock runtime client."""
+        if self._client is None:
+            self._client = SharedClients.bedrock_runtime()
+        return self._client
 
-    def invoke_model(self, messages, model_id=None, user_id=None):
+    def invoke_model(self, messages, model_id=None, user_id=None, preferences=None, system_prompt=None):
         """
         Invokes a bedrock model using the provided messages.
 
+        With HEDGING_ENABLED, a model that has a fallback_model is hedged with it, see
+        _invoke_hedged.
+
         Args:
             messages (list): A list of messages to be sent to the model.
             model_id (str, optional): The specific model ID to use. Defaults to None.
             user_id (str, optional): The Slack user ID. Defaults to None.
+            preferences (UserPreferences, optional): The user's preference snapshot. When
+                given, the system prompt is taken from it instead of being read again.
+            system_prompt (str, optional): A system prompt that replaces the user's and
+                the model's default prompt, for internal requests. Defaults to None.
 
         Returns:
             str: The output text generated by the model.
 
         Raises:
+            ContextWindowExceededError: If the messages cannot fit the model's context window.
+            ModelUnavailableError: If the model keeps failing and is not being called for now.
             ClientError: If there's an error invoking the Bedrock model.
         """
         try:
             model_id = model_id or DEFAULT_BEDROCK_MODEL_ID
-            logger.info(f"Invoking model {model_id} with {len(messages)} messages.")
+            # Internal requests with their own system prompt are not hedged
+            model_config = MODEL_REGISTRY.get(model_id)
+            fallback_config = None if system_prompt else self._hedge_fallback(model_config)
+            if fallback_config:
+                return self._invoke_hedged(messages, model_id, fallback_config, user_id, preferences)
 
-            system_prompt = None
-            if user_id:
-                system_prompt = self.user_preferences.get_user_system_prompt(user_id, model_id)
-
-            # If no custom system prompt, use default for this model
-            if not system_prompt:
-                system_prompt = self._get_default_system_prompt(model_id)
-            else:
-                # Replace datetime placeholder with current UTC time
-                current_utc = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")
-                system_prompt = system_prompt.replace("{datetime}", current_utc)
-            logger.info(f"Latest message text: {messages[-1]['content'][0]['text']}")
-            logger.info(f"Using system prompt: {system_prompt}")
-            
-            # Check if this is a reasoning model
-            is_reasoning_model = self._is_reasoning_model(model_id)
-            
-            # Prepare converse parameters
-            converse_params = {
-                "messages": messages,
-                "modelId": model_id,
-                "system": [{"text": system_prompt}],
-            }
-            
-            # Add thinking configuration for reasoning models
-            if is_reasoning_model:
-                logger.info(f"Using extended thinking mode for reasoning model: {model_id}")
-                converse_params["inferenceConfig"] = {"maxTokens": 64000}
-                converse_params["additionalModelRequestFields"] = {
-                    "thinking": {
-                        "type": "enabled",
-                        "budget_tokens": 48000, # needs to be less than maxTokens
-                    }
-                }
+            converse_params = self._build_converse_params(messages, model_id, user_id, preferences, system_prompt)
             
             # Invoke the model
-            response = self.client.converse(**converse_params)
-            logger.info(f"Model response: {response}")
+            response = self.invoker.call(self.client.converse, **converse_params)
+            if LogDetail.sampled():
+                logger.info(f"Model response: {LogDetail.field(response)}")
             
             # Process the response
-            if is_reasoning_model:
+            if self._is_reasoning_model(model_id):
                 output_text = self._process_reasoning_response(response)
             else:
                 output_text = "".join(
                     content["text"] for content in response["output"]["message"]["content"]
                 )
 
-            self._log_usage_metrics(response)
+            self._log_usage_metrics(response, user_id)
             return output_text
 
         except ClientError as e:
@@ -85,6 +142,262 @@ class BedrockService:
             logger.error(f"Unexpected error occurred: {e}")
             raise
 
+    def invoke_model_stream(self, messages, model_id=None, user_id=None, preferences=None, on_text=None):
+        """
+        Invokes a bedrock model with converse_stream, reporting partial output as it arrives.
+
+        Models that do not support streaming are invoked with converse instead, and
+        on_text is not called. With HEDGING_ENABLED, a model that has a fallback_model
+        is hedged with it, see _invoke_hedged.
+
+        Args:
+            messages (list): A list of messages to be sent to the model.
+            model_id (str, optional): The specific model ID to use. Defaults to None.
+            user_id (str, optional): The Slack user ID. Defaults to None.
+            preferences (UserPreferences, optional): The user's preference snapshot.
+            on_text (callable, optional): Called every time a new text or reasoning delta
+                arrives with a zero-argument function that renders the formatted output
+                so far. Rendering is deferred so callers that batch updates only pay for
+                formatting when they actually flush.
+
+        Returns:
+            str: The complete output text generated by the model, formatted the same
+                way as invoke_model.
+
+        Raises:
+            ContextWindowExceededError: If the messages cannot fit the model's context window.
+            ModelUnavailableError: If the model keeps failing and is not being called for now.
+            ClientError: If there's an error invoking the Bedrock model.
+        """
+        model_id = model_id or DEFAULT_BEDROCK_MODEL_ID
+        model_config = MODEL_REGISTRY.get(model_id)
+        if model_config and not model_config.supports_streaming:
+            logger.info(f"Model {model_id} does not support streaming, invoking it with converse")
+            return self.invoke_model(messages, model_id=model_id, user_id=user_id, preferences=preferences)
+
+        fallback_config = self._hedge_fallback(model_config)
+        if fallback_config:
+            return self._invoke_hedged(messages, model_id, fallback_config, user_id, preferences, on_text)
+
+        try:
+            converse_params = self._build_converse_params(messages, model_id, user_id, preferences)
+            return self._stream_response(converse_params, model_id, user_id, on_text=on_text)
+
+        except ClientError as e:
+            logger.error(f"ERROR: Can't stream '{model_id}'. Reason: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error occurred while streaming: {e}")
+            raise
+
+    def _stream_response(self, converse_params, model_id, user_id, on_text=None, on_open=None, on_first_token=None):
+        """
+        Invokes converse_stream and reads the response to the end.
+
+        Args:
+            converse_params (dict): The converse_stream parameters.
+            model_id (str): The model key or ARN.
+            user_id (str): The Slack user ID the usage is charged to.
+            on_text (callable, optional): Called with a renderer of the output so far, as
+                in invoke_model_stream.
+            on_open (callable, optional): Called with the event stream once it is open.
+            on_first_token (callable, optional): Called when the first delta arrives, or
+                when the stream ends without any. Reading stops if it returns False.
+
+        Returns:
+            str: The formatted output text, or None if on_first_token stopped reading.
+        """
+        is_reasoning_model = self._is_reasoning_model(model_id)
+
+        started_at = time.monotonic()
+        first_token_at = None
+        standard_text = ""
+        thinking_text = ""
+        metadata = {}
+        stop_reason = None
+
+        response = self.invoker.call(self.client.converse_stream, **converse_params)
+        if on_open:
+            on_open(response["stream"])
+        for event in response["stream"]:
+            if "contentBlockDelta" in event:
+                delta = event["contentBlockDelta"]["delta"]
+                if "text" in delta:
+                    standard_text += delta["text"]
+                elif "reasoningContent" in delta and "text" in delta["reasoningContent"]:
+                    thinking_text += delta["reasoningContent"]["text"]
+                else:
+                    continue
+
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                    if on_first_token and not on_first_token():
+                        return None
+                    logger.info(f"Time to first token: {first_token_at - started_at:.3f}s")
+                    Metrics.record("time_to_first_token", first_token_at - started_at)
+
+                if on_text:
+                    on_text(lambda: self._format_output(thinking_text, standard_text, is_reasoning_model))
+            elif "messageStop" in event:
+                stop_reason = event["messageStop"].get("stopReason")
+            elif "metadata" in event:
+                metadata = event["metadata"]
+
+        if first_token_at is None and on_first_token and not on_first_token():
+            return None
+
+        output_text = self._format_output(thinking_text, standard_text, is_reasoning_model)
+        if "usage" in metadata:
+            self._log_usage_metrics({"usage": metadata["usage"], "stopReason": stop_reason}, user_id)
+        logger.info(f"Streamed {len(output_text)} characters in {time.monotonic() - started_at:.3f}s")
+        return output_text
+
+    def _hedge_fallback(self, model_config):
+        """Get the model a request is hedged with, or None when it is not hedged."""
+        if not (HEDGING_ENABLED and model_config and model_config.fallback_model and model_config.supports_streaming):
+            return None
+        fallback_config = MODEL_REGISTRY.get(model_config.fallback_model)
+        if fallback_config is None or not fallback_config.supports_streaming:
+            return None
+        return fallback_config
+
+    def _invoke_hedged(self, messages, model_id, fallback_config, user_id, preferences, on_text=None):
+        """
+        Invokes a model, and its fallback model as well when the first one is slow.
+
+        The fallback request starts when the preferred model has not produced a first
+        token within HEDGE_FIRST_TOKEN_TIMEOUT_SECONDS, or as soon as it fails. The first
+        request to produce a token answers and is streamed, the other one is cancelled by
+        closing its stream. A reply from the fallback model ends with a note naming it, and
+        saying whether the preferred model failed or was slow.
+
+        Raises:
+            Exception: The preferred model's error, if neither request produced a token,
+                or the answering request's error.
+        """
+        model_config = MODEL_REGISTRY.get(model_id)
+        race = _HedgeRace()
+        attempts = {}
+
+        def start(config, requested_model_id):
+            attempts[config.key] = self._hedge_executor.submit(
+                Metrics.bind(self._hedge_attempt), race, config.key, requested_model_id, messages, user_id, preferences, on_text
+            )
+
+        start(model_config, model_id)
+        primary = attempts[model_config.key]
+        wait([primary, race.won], timeout=HEDGE_FIRST_TOKEN_TIMEOUT_SECONDS, return_when=FIRST_COMPLETED)
+        if not race.won.done():
+            if primary.done():
+                logger.warning(f"{model_config.key} failed before its first token, invoking {fallback_config.key}")
+            else:
+                logger.warning(
+                    f"No first token from {model_config.key} within {HEDGE_FIRST_TOKEN_TIMEOUT_SECONDS}s, "
+                    f"also invoking {fallback_config.key}"
+                )
+            Metrics.count("hedged_requests", 1)
+            start(fallback_config, fallback_config.key)
+
+        while not race.won.done():
+            pending = [future for future in [race.won, *attempts.values()] if not future.done()]
+            if pending == [race.won]:
+                break
+            wait(pending, return_when=FIRST_COMPLETED)
+
+        if not race.won.done():
+            # Every request failed before producing a token
+            return primary.result()
+
+        winner = race.won.result()
+        output_text = attempts[winner].result()
+        if winner == model_config.key:
+            return output_text
+        logger.info(f"{fallback_config.key} answered instead of {model_config.key}")
+        Metrics.count("hedge_fallback_answers", 1)
+        # A cancelled primary request returns None, only a real failure leaves an exception
+        reason = "failed" if primary.done() and primary.exception() is not None else "was slow to respond"
+        return f"{output_text}\n\n_Answered by {fallback_config.description} because {model_config.description} {reason}._"
+
+    def _hedge_attempt(self, race, key, model_id, messages, user_id, preferences, on_text):
+        """Runs one of the hedged requests, returns None if it was cancelled."""
+        try:
+            converse_params = self._build_converse_params(messages, model_id, user_id, preferences)
+            return self._stream_response(
+                converse_params,
+                model_id,
+                user_id,
+                on_text=on_text,
+                on_open=lambda stream: race.opened(key, stream),
+                on_first_token=lambda: race.claim(key)
+            )
+        except Exception as e:
+            if race.lost(key):
+                # Reading a stream closed by the race fails, that is the cancellation
+                return None
+            logger.error(f"Hedged request to {key} failed: {e}")
+            raise
+
+    def _build_converse_params(self, messages, model_id, user_id, preferences=None, system_prompt=None):
+        """Builds the keyword arguments shared by converse and converse_stream."""
+        logger.info(f"Invoking model {model_id} with {len(messages)} messages.")
+        model_config = MODEL_REGISTRY.get(model_id)
+
+        # An explicit system prompt takes precedence over the user's custom prompt
+        if not system_prompt and preferences:
+            system_prompt = preferences.get_system_prompt(model_id)
+        elif not system_prompt and user_id:
+            system_prompt = self.user_preferences.get_user_system_prompt(user_id, model_id)
+
+        # If no custom system prompt, use default for this model
+        if not system_prompt:
+            system_prompt = self._get_default_system_prompt(model_id)
+        else:
+            # Replace datetime placeholder with current UTC date
+            system_prompt = system_prompt.replace("{datetime}", self._current_datetime())
+        if LogDetail.sampled():
+            logger.info(f"Latest message text: {LogDetail.field(messages[-1]['content'][0]['text'])}")
+            logger.info(f"Using system prompt: {LogDetail.field(system_prompt)}")
+
+        # Trim the history to the model's context window before making the request
+        if model_config:
+            messages = self.context_window_manager.fit(messages, model_config, system_prompt)
+
+        # Prepare converse parameters
+        converse_params = {
+            "messages": messages,
+            "modelId": model_config.arn if model_config else model_id,
+            "system": [{"text": system_prompt}],
+        }
+
+        # Cache the system prompt and the history shared with the next reply in the thread
+        if PROMPT_CACHING_ENABLED and model_config and model_config.supports_prompt_caching:
+            converse_params["system"].append(CACHE_POINT)
+            if len(messages) > 1:
+                converse_params["messages"] = self._add_history_cache_point(messages)
+
+        # Add thinking configuration for reasoning models
+        if model_config and model_config.isReasoningModel:
+            logger.info(f"Using extended thinking mode for reasoning model: {model_id}")
+            converse_params["inferenceConfig"] = {"maxTokens": model_config.max_output_tokens}
+            converse_params["additionalModelRequestFields"] = {
+                "thinking": {
+                    "type": "enabled",
+                    "budget_tokens": model_config.thinking_budget_tokens, # needs to be less than maxTokens
+                }
+            }
+
+        return converse_params
+
+    def _add_history_cache_point(self, messages):
+        """
+        Returns a copy of the messages with a cache point after the last message before
+        the new user message. That prefix is resent unchanged with the next reply.
+        """
+        messages = list(messages)
+        stable_message = messages[-2]
+        messages[-2] = {**stable_message, "content": stable_message["content"] + [CACHE_POINT]}
+        return messages
+
     def _process_reasoning_response(self, response):
         """
         Process the response from Claude 3.7 Sonnet Reasoning model.
@@ -96,7 +409,7 @@ class BedrockService:
         Returns:
             str: The formatted output text with reasoning as quoted messages.
         """
-        output_text = ""
+        thinking_texts = []
         standard_text = ""
         
         # Process each content block
@@ -105,16 +418,35 @@ class BedrockService:
                 standard_text = block["text"]
             elif "reasoningContent" in block:
                 # Extract thinking/reasoning text
-                thinking_text = block["reasoningContent"]["reasoningText"]["text"]
-                
-                # Format thinking text as quoted messages in Slack markdown
-                # Split by newlines and format each paragraph as a quote
-                thinking_paragraphs = thinking_text.split("\n\n")
-                for paragraph in thinking_paragraphs:
-                    if paragraph.strip():
-                        # Format as Slack quote (> at the beginning of each line)
-                        formatted_paragraph = "\n".join([f"> {line}" for line in paragraph.split("\n")])
-                        output_text += f"{formatted_paragraph}\n\n"
+                thinking_texts.append(block["reasoningContent"]["reasoningText"]["text"])
+        
+        return self._format_output("\n\n".join(thinking_texts), standard_text, True)
+
+    def _format_output(self, thinking_text, standard_text, is_reasoning_model):
+        """
+        Formats model output for Slack, rendering any reasoning text as quoted paragraphs.
+
+        Args:
+            thinking_text (str): The reasoning text produced by the model, if any.
+            standard_text (str): The final answer text produced by the model.
+            is_reasoning_model (bool): Whether the reasoning text should be rendered.
+
+        Returns:
+            str: The formatted output text.
+        """
+        if not is_reasoning_model:
+            return standard_text
+
+        output_text = ""
+
+        # Format thinking text as quoted messages in Slack markdown
+        # Split by newlines and format each paragraph as a quote
+        thinking_paragraphs = thinking_text.split("\n\n")
+        for paragraph in thinking_paragraphs:
+            if paragraph.strip():
+                # Format as Slack quote (> at the beginning of each line)
+                formatted_paragraph = "\n".join([f"> {line}" for line in paragraph.split("\n")])
+                output_text += f"{formatted_paragraph}\n\n"
         
         # Add the standard response text after the thinking blocks
         output_text += standard_text
@@ -131,29 +463,35 @@ class BedrockService:
         Returns:
             bool: True if the model is a reasoning model, False otherwise.
         """
-        for model in BEDROCK_MODELS:
-            if model.arn == model_id and model.isReasoningModel:
-                return True
-        return False
+        model = MODEL_REGISTRY.get(model_id)
+        return bool(model and model.isReasoningModel)
     
-    def _log_usage_metrics(self, response):
-        """Log token usage and other metrics from the model response."""
+    def _log_usage_metrics(self, response, user_id=None):
+        """Log token usage and other metrics from the model response, and charge it to the user."""
         token_usage = response["usage"]
         logger.info(f"Input tokens: {token_usage['inputTokens']}")
         logger.info(f"Output tokens: {token_usage['outputTokens']}")
         logger.info(f"Total tokens: {token_usage['totalTokens']}")
+        logger.info(f"Cache read input tokens: {token_usage.get('cacheReadInputTokens', 0)}")
+        logger.info(f"Cache write input tokens: {token_usage.get('cacheWriteInputTokens', 0)}")
         logger.info(f"Stop reason: {response['stopReason']}")
+        Metrics.count("input_tokens", token_usage["inputTokens"])
+        Metrics.count("output_tokens", token_usage["outputTokens"])
+        Metrics.count("cache_read_input_tokens", token_usage.get("cacheReadInputTokens", 0))
+        Metrics.count("cache_write_input_tokens", token_usage.get("cacheWriteInputTokens", 0))
+        # Written in the background, the handler waits for it once the reply is delivered
+        self.usage_tracker.record_in_background(user_id, token_usage)
 
     def _get_default_system_prompt(self, model_id=None):
         """Returns the default system prompt for the specified model."""
         # If model_id is provided, try to get its specific default prompt
-        if model_id:
-            for model in BEDROCK_MODELS:
-                if model.arn == model_id:
-                    if model.default_system_prompt:
-                        current_utc = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")
-                        return model.default_system_prompt.replace("{datetime}", current_utc)
-                    break
+        model = MODEL_REGISTRY.get(model_id)
+        if model and model.default_system_prompt:
+            return model.default_system_prompt.replace("{datetime}", self._current_datetime())
 
         # Fallback to generic prompt if no model-specific prompt found
-        return f"You are a helpful AI assistant. The current time is {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")}."
+        return f"You are a helpful AI assistant. The current date is {self._current_datetime()}."
+
+    def _current_datetime(self):
+        """Returns the text substituted for the {datetime} placeholder in system prompts."""
+        return datetime.datetime.now(datetime.timezone.utc).strftime(SYSTEM_PROMPT_DATETIME_FORMAT)
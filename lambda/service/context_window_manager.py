@@ -0,0 +1,109 @@
+import re
+from config import logger, CONTEXT_WINDOW_SAFETY_MARGIN
+from service.token_estimator import TokenEstimator
+
+DOCUMENT_NAME_PATTERN = re.compile(r'^<document name="(.*?)">')
+
+class ContextWindowExceededError(ValueError):
+    """Raised when a request cannot be made to fit the model's context window."""
+
+class ContextWindowManager:
+    """
+    Fits Converse messages into a model's context window before they are sent.
+
+    When the estimated input is larger than the model allows, attachments are elided
+    from the oldest messages first and then the oldest turns are dropped. The latest
+    message is never changed; if it does not fit on its own the request is rejected
+    without calling the model.
+    """
+
+    def __init__(self):
+        self.token_estimator = TokenEstimator()
+
+    def input_budget(self, model_config, system_prompt=""):
+        """
+        Get the number of message tokens a request to a model may use.
+
+        Args:
+            model_config (BedrockModelConfig): The target model.
+            system_prompt (str, optional): The system prompt sent with the messages.
+
+        Returns:
+            int: The input token budget for the messages.
+        """
+        available = model_config.context_window_tokens - model_config.max_output_tokens
+        return int(available * (1 - CONTEXT_WINDOW_SAFETY_MARGIN)) - self.token_estimator.estimate_text(system_prompt)
+
+    def fit(self, messages, model_config, system_prompt=""):
+        """
+        Fit messages into a model's context window.
+
+        Args:
+            messages (list): Converse messages, oldest first, ending with a user message.
+            model_config (BedrockModelConfig): The target model.
+            system_prompt (str, optional): The system prompt sent with the messages.
+
+        Returns:
+            list: The messages to send. The input list is returned unchanged when it
+                fits, otherwise a new list; the input messages are never modified.
+
+        Raises:
+            ContextWindowExceededError: If the latest message alone does not fit.
+        """
+        budget = self.input_budget(model_config, system_prompt)
+        estimates = [self.token_estimator.estimate_message(message) for message in messages]
+        total = sum(estimates)
+        if total <= budget:
+            return messages
+
+        logger.info(f"Estimated {total} input tokens exceed the budget of {budget}, trimming history")
+        messages = list(messages)
+
+        # Elide attachments from the oldest messages first
+        for index in range(len(messages) - 1):
+            if total <= budget:
+                break
+            elided_message = self._elide_attachments(messages[index])
+            if elided_message is not None:
+                elided_estimate = self.token_estimator.estimate_message(elided_message)
+                total += elided_estimate - estimates[index]
+                messages[index] = elided_message
+                estimates[index] = elided_estimate
+
+        # Then drop the oldest turns, the conversation has to start with a user message
+        start = 0
+        while start < len(messages) - 1 and (total > budget or messages[start]["role"] != "user"):
+            total -= estimates[start]
+            start += 1
+
+        if total > budget:
+            raise ContextWindowExceededError(
+                f"The message is too large for {model_config.description}: it needs about {total} "
+                f"input tokens and the limit is {budget}. Try a shorter message or fewer attachments."
+            )
+
+        logger.info(f"Sending {len(messages) - start} of {len(messages)} messages, about {total} input tokens")
+        return messages[start:]
+
+    def _elide_attachments(self, message):
+        """Returns a copy of the message with its attachments replaced by short notes, or None if it has none."""
+        text_block, *attachment_blocks = message["content"]
+        if not attachment_blocks:
+            return None
+
+        notes = []
+        for block in attachment_blocks:
+            if "document" in block:
+                notes.append(f"[Document {block['document']['name']} omitted]")
+            elif "image" in block:
+                notes.append("[Image omitted]")
+            elif "video" in block:
+                notes.append("[Video omitted]")
+            else:
+                match = DOCUMENT_NAME_PATTERN.match(block.get("text", ""))
+                notes.append(f"[Document {match.group(1)} omitted]" if match else "[Attachment omitted]")
+
+        return {
+            "role": message["role"],
+            "content": [text_block, {"text": " ".join(notes)}]
+        }
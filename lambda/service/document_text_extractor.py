@@ -0,0 +1,171 @@
+import io
+import re
+from html.parser import HTMLParser
+from config import (
+    logger,
+    DOCUMENT_TEXT_CACHE_MAX_ENTRIES,
+    DOCUMENT_TEXT_CACHE_TTL_SECONDS,
+)
+from service.ttl_cache import TTLCache
+
+# Optional parsers, documents of these types are sent as raw blocks when missing
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+try:
+    import docx
+except ImportError:
+    docx = None
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+class _HTMLTextParser(HTMLParser):
+    """Collects the visible text of an HTML document."""
+    SKIPPED_TAGS = {"script", "style", "head", "noscript", "template"}
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "table"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+class DocumentTextExtractor:
+    """
+    Extracts normalized plain text from documents so they can be sent as text blocks.
+
+    Extracted text is cached per Slack file ID. None is returned whenever a document
+    cannot be extracted (unknown or legacy format, missing parser, no text layer),
+    so callers can fall back to sending the raw document.
+    """
+    # Shared by every extractor in the container
+    _cache = TTLCache(
+        maxsize=DOCUMENT_TEXT_CACHE_MAX_ENTRIES,
+        ttl_seconds=DOCUMENT_TEXT_CACHE_TTL_SECONDS
+    )
+
+    def __init__(self):
+        self._extractors = {
+            "txt": self._extract_plain_text,
+            "md": self._extract_plain_text,
+            "csv": self._extract_plain_text,
+            "html": self._extract_html,
+            "pdf": self._extract_pdf,
+            "docx": self._extract_docx,
+            "xlsx": self._extract_xlsx,
+        }
+
+    def get_cached_text(self, file_info):
+        """Get previously extracted text for a Slack file, or None."""
+        cache_key = self._cache_key(file_info)
+        return self._cache.get(cache_key) if cache_key else None
+
+    def extract(self, file_info, content, filetype):
+        """
+        Extract normalized text from a document.
+
+        Args:
+            file_info (dict): The Slack file object.
+            content (bytes): The document content.
+            filetype (str): The lowercase Slack file type.
+
+        Returns:
+            str: The extracted text, or None if the document could not be extracted.
+        """
+        cached = self.get_cached_text(file_info)
+        if cached is not None:
+            return cached
+
+        extractor = self._extractors.get(filetype)
+        if extractor is None:
+            return None
+
+        try:
+            text = extractor(content)
+        except Exception as e:
+            logger.warning(f"Error extracting text from {file_info.get('name')}: {e}")
+            return None
+
+        text = self._normalize(text) if text else ""
+        if not text:
+            logger.info(f"No text extracted from {file_info.get('name')}, sending the raw document")
+            return None
+
+        logger.info(f"Extracted {len(text)} characters from {len(content)} byte document {file_info.get('name')}")
+        cache_key = self._cache_key(file_info)
+        if cache_key:
+            self._cache.set(cache_key, text)
+        return text
+
+    def _cache_key(self, file_info):
+        file_id = file_info.get("id")
+        return (file_id, file_info.get("size")) if file_id else None
+
+    def _normalize(self, text):
+        # Indentation and aligned columns carry meaning in code, YAML and CSV, so leading and inner whitespace is kept
+        text = text.replace("\r\n", "\n").replace("\r", "\n").replace("\x00", "")
+        text = "\n".join(line.rstrip() for line in text.split("\n"))
+        text = re.sub(r"\n{3,}", "\n\n", text)
+        return text.strip("\n")
+
+    def _extract_plain_text(self, content):
+        try:
+            return content.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            return content.decode("latin-1")
+
+    def _extract_html(self, content):
+        parser = _HTMLTextParser()
+        parser.feed(self._extract_plain_text(content))
+        parser.close()
+        return "".join(parser.parts)
+
+    def _extract_pdf(self, content):
+        if PdfReader is None:
+            return None
+        reader = PdfReader(io.BytesIO(content))
+        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+    def _extract_docx(self, content):
+        if docx is None:
+            return None
+        document = docx.Document(io.BytesIO(content))
+        parts = [paragraph.text for paragraph in document.paragraphs]
+        for table in document.tables:
+            for row in table.rows:
+                parts.append("\t".join(cell.text for cell in row.cells))
+        return "\n".join(parts)
+
+    def _extract_xlsx(self, content):
+        if openpyxl is None:
+            return None
+        workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+        try:
+            sheets = []
+            for sheet in workbook.worksheets:
+                rows = [
+                    "\t".join("" if value is None else str(value) for value in row)
+                    for row in sheet.iter_rows(values_only=True)
+                ]
+                sheets.append(f"# {sheet.title}\n" + "\n".join(row for row in rows if row.strip()))
+            return "\n\n".join(sheets)
+        finally:
+            workbook.close()
@@ -0,0 +1,89 @@
+import time
+from botocore.exceptions import ClientError
+from config import (
+    logger,
+    IDEMPOTENCY_TABLE_NAME,
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_LOCAL_MAX_ENTRIES,
+)
+from service.ttl_cache import TTLCache
+from service.shared_clients import SharedClients
+
+class EventIdempotencyStore:
+    """
+    Claims Slack event IDs so that every event is processed only once.
+
+    Slack redelivers events whose acknowledgement was slow, and every delivery starts
+    its own lazy listener invocation. The first invocation to claim an event ID wins,
+    using a conditional write to DynamoDB when IDEMPOTENCY_TABLE_NAME is set. Claims
+    expire through the table's TTL. Claims are also remembered in the container, which
+    answers duplicates that land on the same container without a DynamoDB call.
+    """
+    # Shared by every store in the container
+    _local_claims = TTLCache(maxsize=IDEMPOTENCY_LOCAL_MAX_ENTRIES, ttl_seconds=IDEMPOTENCY_TTL_SECONDS)
+
+    def __init__(self, table_name=IDEMPOTENCY_TABLE_NAME):
+        self.table_name = table_name
+        self._table = None
+
+    @property
+    def table(self):
+        """Lazy initialization of DynamoDB table."""
+        if self._table is None:
+            self._table = SharedClients.dynamodb().Table(self.table_name)
+        return self._table
+
+    @classmethod
+    def clear(cls):
+        """Forget all claims remembered in the container."""
+        cls._local_claims.clear()
+
+    def claim(self, event_id):
+        """
+        Claim an event for processing.
+
+        Errors other than a lost claim are logged and the event is processed anyway, a
+        rare duplicate reply is better than a dropped message.
+
+        Args:
+            event_id (str): The Slack event ID.
+
+        Returns:
+            bool: True if the caller should process the event, False if it was already claimed.
+        """
+        if self._local_claims.get(event_id):
+            return False
+
+        if self.table_name:
+            now = int(time.time())
+            try:
+                self.table.put_item(
+                    Item={"event_id": event_id, "expires_at": now + IDEMPOTENCY_TTL_SECONDS},
+                    # Expired claims may not have been removed by the TTL process yet
+                    ConditionExpression="attribute_not_exists(event_id) OR expires_at < :now",
+                    ExpressionAttributeValues={":now": now}
+                )
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                    self._local_claims.set(event_id, True)
+                    return False
+                logger.error(f"Error claiming event {event_id}: {e}")
+            except Exception as e:
+                logger.error(f"Error claiming event {event_id}: {e}")
+
+        self._local_claims.set(event_id, True)
+        return True
+
+    def release(self, event_id):
+        """
+        Release a claim so that a retry of the event is processed again.
+
+        Args:
+            event_id (str): The Slack event ID.
+        """
+        self._local_claims.invalidate(event_id)
+        if self.table_name:
+            try:
+                self.table.delete_item(Key={"event_id": event_id})
+            except Exception as e:
+                logger.error(f"Error releasing event {event_id}: {e}")
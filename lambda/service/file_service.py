@@ -1,26 +1,90 @@
-import requests
-from config import logger
+import time
+from config import (
+    logger,
+    FILE_DOWNLOAD_CONNECT_TIMEOUT_SECONDS,
+    FILE_DOWNLOAD_READ_TIMEOUT_SECONDS,
+    FILE_DOWNLOAD_TOTAL_TIMEOUT_SECONDS,
+    FILE_DOWNLOAD_MAX_BYTES,
+    FILE_DOWNLOAD_CHUNK_BYTES,
+)
+from service.shared_clients import SharedClients
+from service.metrics import Metrics
+
+class FileTooLargeError(Exception):
+    """Raised when a file is larger than the download limit."""
+
+class FileDownloadTimeoutError(Exception):
+    """Raised when a download does not finish within the total download deadline."""
 
 class FileService:
-    def download_file(self, file_url, headers):
+    @classmethod
+    def get_session(cls):
+        """The keep-alive session shared by every FileService in the container."""
+        return SharedClients.http_session()
+
+    def download_file(self, file_url, headers, expected_size=None, max_bytes=FILE_DOWNLOAD_MAX_BYTES):
         """
         Downloads a file from Slack.
 
+        The response is streamed in chunks into a buffer preallocated from Content-Length.
+        Files that are known to be too large, from the Slack-reported size or from
+        Content-Length, are rejected before any of the body is read.
+
         Args:
             file_url (str): The URL to download the file from.
             headers (dict): Headers for the request, including authentication.
+            expected_size (int, optional): The file size reported by Slack. Defaults to None.
+            max_bytes (int, optional): The largest file that will be downloaded.
 
         Returns:
             bytes: The file content.
 
         Raises:
+            FileTooLargeError: If the file is larger than max_bytes.
+            FileDownloadTimeoutError: If the download takes longer than the total deadline.
             Exception: If there's an error downloading the file.
         """
         try:
-            logger.info(f"Downloading file from {file_url} with headers {headers}")
-            response = requests.get(file_url, headers=headers)
-            response.raise_for_status()
-            return response.content
+            if expected_size is not None and expected_size > max_bytes:
+                raise FileTooLargeError(f"File is {expected_size} bytes, the limit is {max_bytes} bytes")
+
+            logger.info(f"Downloading file from {file_url}")
+            deadline = time.monotonic() + FILE_DOWNLOAD_TOTAL_TIMEOUT_SECONDS
+            with Metrics.stage("file_download"), self.get_session().get(
+                file_url,
+                headers=headers,
+                stream=True,
+                timeout=(FILE_DOWNLOAD_CONNECT_TIMEOUT_SECONDS, FILE_DOWNLOAD_READ_TIMEOUT_SECONDS)
+            ) as response:
+                response.raise_for_status()
+                return self._read_body(response, max_bytes, deadline)
         except Exception as e:
             logger.error(f"Error downloading file: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    def _read_body(self, response, max_bytes, deadline):
+        """Reads a streamed response body into a preallocated buffer."""
+        content_length = response.headers.get("Content-Length")
+        content_length = int(content_length) if content_length and content_length.isdigit() else None
+        if content_length is not None and content_length > max_bytes:
+            raise FileTooLargeError(f"File is {content_length} bytes, the limit is {max_bytes} bytes")
+
+        buffer = bytearray(content_length or 0)
+        received = 0
+        for chunk in response.iter_content(chunk_size=FILE_DOWNLOAD_CHUNK_BYTES):
+            if time.monotonic() > deadline:
+                raise FileDownloadTimeoutError(
+                    f"Download did not finish within {FILE_DOWNLOAD_TOTAL_TIMEOUT_SECONDS} seconds"
+                )
+            end = received + len(chunk)
+            if end > max_bytes:
+                raise FileTooLargeError(f"File is larger than the limit of {max_bytes} bytes")
+            if end <= len(buffer):
+                buffer[received:end] = chunk
+            else:
+                # Content-Length was missing or understated
+                del buffer[received:]
+                buffer.extend(chunk)
+            received = end
+
+        return bytes(buffer) if received == len(buffer) else bytes(buffer[:received])
@@ -0,0 +1,113 @@
+import hashlib
+import io
+from config import (
+    logger,
+    IMAGE_NORMALIZATION_ENABLED,
+    IMAGE_NORMALIZATION_CACHE_MAX_ENTRIES,
+    IMAGE_NORMALIZATION_CACHE_TTL_SECONDS,
+    IMAGE_JPEG_QUALITY,
+)
+from service.ttl_cache import TTLCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, images are sent as-is without it
+    Image = None
+    ImageOps = None
+
+# Image.info keys holding metadata that Pillow does not expose through getexif
+METADATA_INFO_KEYS = ("exif", "xmp", "XML:com.adobe.xmp")
+
+class ImageNormalizer:
+    """
+    Shrinks images before they are sent to Bedrock.
+
+    Images are rotated according to their EXIF orientation, downscaled so their long
+    edge fits the model's max_image_dimension, and re-encoded without metadata in the
+    model's image_output_format. The original bytes are only kept when the image
+    carries no EXIF or XMP metadata and normalization would not make it smaller.
+    Results are cached by content hash.
+    """
+    # Shared by every normalizer in the container
+    _cache = TTLCache(
+        maxsize=IMAGE_NORMALIZATION_CACHE_MAX_ENTRIES,
+        ttl_seconds=IMAGE_NORMALIZATION_CACHE_TTL_SECONDS
+    )
+
+    def normalize(self, content, format_type, model_config=None):
+        """
+        Normalize an image for a model.
+
+        Args:
+            content (bytes): The image content.
+            format_type (str): The Converse image format of the content (png, jpeg, gif, webp).
+            model_config (BedrockModelConfig, optional): The target model. Defaults to None.
+
+        Returns:
+            tuple: The (content, format_type) to send to the model.
+        """
+        if not IMAGE_NORMALIZATION_ENABLED or Image is None or model_config is None:
+            return content, format_type
+
+        max_dimension = model_config.max_image_dimension
+        output_format = model_config.image_output_format
+        if not max_dimension:
+            return content, format_type
+
+        cache_key = (hashlib.sha256(content).hexdigest(), max_dimension, output_format)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            result = self._normalize(content, format_type, max_dimension, output_format)
+        except Exception as e:
+            logger.warning(f"Error normalizing image, sending it unchanged: {e}")
+            return content, format_type
+
+        saved_bytes = len(content) - len(result[0])
+        logger.info(
+            f"Normalized image from {len(content)} to {len(result[0])} bytes "
+            f"({saved_bytes} bytes saved, format {format_type} -> {result[1]})"
+        )
+        self._cache.set(cache_key, result)
+        return result
+
+    def _normalize(self, content, format_type, max_dimension, output_format):
+        with Image.open(io.BytesIO(content)) as image:
+            # Animated images would lose their frames, leave them alone
+            if getattr(image, "is_animated", False):
+                return content, format_type
+
+            needs_resize = max(image.size) > max_dimension
+            # Metadata can hold GPS coordinates and an orientation the original bytes ignore
+            has_metadata = bool(image.getexif()) or any(key in image.info for key in METADATA_INFO_KEYS)
+            image = ImageOps.exif_transpose(image)
+            if needs_resize:
+                image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+            # JPEG has no alpha channel, keep PNG for images that actually use transparency
+            if output_format == "jpeg" and self._has_transparency(image):
+                output_format = "png"
+
+            if output_format == "jpeg":
+                image = image.convert("RGB")
+                save_options = {"quality": IMAGE_JPEG_QUALITY, "optimize": True}
+            elif output_format == "webp":
+                save_options = {"quality": IMAGE_JPEG_QUALITY, "method": 4}
+            else:
+                save_options = {"optimize": True}
+
+            # Saving without exif/icc arguments drops the source metadata
+            output = io.BytesIO()
+            image.save(output, format=output_format.upper(), **save_options)
+            normalized = output.getvalue()
+
+        if not needs_resize and not has_metadata and len(normalized) >= len(content):
+            return content, format_type
+        return normalized, output_format
+
+    def _has_transparency(self, image):
+        if image.mode in ("RGBA", "LA"):
+            return image.getchannel("A").getextrema()[0] < 255
+        return image.mode == "P" and "transparency" in image.info
@@ -0,0 +1,217 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from config import (
+    logger,
+    JOB_QUEUE_URL,
+    REASONING_JOB_QUEUE_URL,
+    JOB_QUEUE_MAX_ATTEMPTS,
+    JOB_QUEUE_VISIBILITY_TIMEOUT_SECONDS,
+    DEFAULT_BEDROCK_MODEL_ID,
+    MODEL_REGISTRY,
+)
+from service.shared_clients import SharedClients
+
+# Execution lanes. Reasoning jobs can run for minutes and have their own queue and
+# workers, standard jobs are quick chat replies. Interactive UI actions are never
+# queued, they run in the Slack request itself.
+LANE_REASONING = "reasoning"
+LANE_STANDARD = "standard"
+
+def lane_for_model(model_id):
+    """Get the execution lane for requests to a model."""
+    model_config = MODEL_REGISTRY.get(model_id or DEFAULT_BEDROCK_MODEL_ID)
+    if model_config and model_config.isReasoningModel:
+        return LANE_REASONING
+    return LANE_STANDARD
+
+@dataclass
+class Job:
+    """
+    A Slack message event waiting to be processed by a worker.
+
+    Jobs in the same group, which is the Slack thread the message belongs to, are
+    delivered in the order they were enqueued.
+    """
+    job_id: str
+    group_id: str
+    body: dict
+    # Queue-specific handle used to acknowledge the job (SQS message ID, SQLite row ID)
+    receipt: Optional[str] = None
+    attempts: int = 0
+    lane: str = LANE_STANDARD
+
+    @classmethod
+    def from_event_body(cls, body, lane=LANE_STANDARD):
+        """Builds a job from the body of a Slack event callback, to run in the given lane."""
+        event = body["event"]
+        thread_ts = event.get("thread_ts") or event["ts"]
+        return cls(
+            job_id=body.get("event_id") or f"{event.get('channel')}:{event['ts']}",
+            group_id=f"{event.get('channel')}:{thread_ts}",
+            body={"event_id": body.get("event_id"), "event": event},
+            lane=lane,
+        )
+
+    @property
+    def is_thread_reply(self):
+        """Whether this is a reply in an existing thread that does not mention anyone."""
+        event = self.body["event"]
+        return "thread_ts" in event and "<@" not in event.get("text", "")
+
+    def to_json(self):
+        return json.dumps({"job_id": self.job_id, "group_id": self.group_id, "body": self.body, "lane": self.lane})
+
+    @classmethod
+    def from_json(cls, data, receipt=None, attempts=0):
+        payload = json.loads(data)
+        return cls(
+            job_id=payload["job_id"],
+            group_id=payload["group_id"],
+            body=payload["body"],
+            receipt=receipt,
+            attempts=attempts,
+            lane=payload.get("lane", LANE_STANDARD),
+        )
+
+class SQSJobQueue:
+    """
+    Enqueues jobs on SQS FIFO queues, one per execution lane.
+
+    The thread is used as the message group, so SQS delivers jobs for a thread in order,
+    and the Slack event ID as the deduplication ID. Jobs are received through the
+    Lambda SQS event sources, each limited to the concurrency of its lane, and failed
+    jobs are moved to the dead-letter queue by the queue's redrive policy. Jobs of a
+    lane without a queue of its own go to the standard queue.
+    """
+
+    def __init__(self, queue_url=JOB_QUEUE_URL, reasoning_queue_url=REASONING_JOB_QUEUE_URL):
+        self.queue_url = queue_url
+        self.lane_queue_urls = {LANE_STANDARD: queue_url}
+        if reasoning_queue_url:
+            self.lane_queue_urls[LANE_REASONING] = reasoning_queue_url
+        self._sqs = None
+
+    @property
+    def sqs(self):
+        """Lazy initialization of the SQS client."""
+        if self._sqs is None:
+            self._sqs = SharedClients.sqs()
+        return self._sqs
+
+    def enqueue(self, job):
+        self.sqs.send_message(
+            QueueUrl=self.lane_queue_urls.get(job.lane, self.queue_url),
+            MessageBody=job.to_json(),
+            MessageGroupId=job.group_id,
+            MessageDeduplicationId=job.job_id
+        )
+
+class SQLiteJobQueue:
+    """
+    A FIFO job queue with message groups, retries and a dead-letter state, backed by SQLite.
+
+    It mirrors the SQS FIFO behavior the workers rely on, for local runs and tests. The
+    default path keeps the queue in memory.
+    """
+
+    def __init__(self, path=":memory:", max_attempts=JOB_QUEUE_MAX_ATTEMPTS,
+                 visibility_timeout=JOB_QUEUE_VISIBILITY_TIMEOUT_SECONDS):
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL UNIQUE,
+                group_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL DEFAULT 'ready',
+                visible_at REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._connection.commit()
+
+    def enqueue(self, job):
+        """Adds a job. A job whose ID is already queued is ignored, like SQS deduplication."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, group_id, payload) VALUES (?, ?, ?)",
+                (job.job_id, job.group_id, job.to_json())
+            )
+            self._connection.commit()
+
+    def receive(self, max_jobs):
+        """
+        Receives up to max_jobs jobs, oldest first.
+
+        Like an SQS FIFO queue, no job is returned from a group that still has a job in
+        flight, so jobs for a thread are never processed out of order.
+
+        Returns:
+            list: The received jobs.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, group_id, payload, attempts, state, visible_at FROM jobs "
+                "WHERE state != 'dead' ORDER BY id"
+            ).fetchall()
+
+            blocked_groups = set()
+            jobs = []
+            for row_id, group_id, payload, attempts, state, visible_at in rows:
+                if len(jobs) >= max_jobs:
+                    break
+                if group_id in blocked_groups:
+                    continue
+                if visible_at > now:
+                    # In flight, or waiting to be retried; later jobs in its group wait too
+                    blocked_groups.add(group_id)
+                    continue
+                jobs.append(Job.from_json(payload, receipt=str(row_id), attempts=attempts + 1))
+
+            for job in jobs:
+                self._connection.execute(
+                    "UPDATE jobs SET state = 'inflight', attempts = attempts + 1, visible_at = ? WHERE id = ?",
+                    (now + self.visibility_timeout, int(job.receipt))
+                )
+            self._connection.commit()
+        return jobs
+
+    def ack(self, job):
+        """Removes a successfully processed job."""
+        with self._lock:
+            self._connection.execute("DELETE FROM jobs WHERE id = ?", (int(job.receipt),))
+            self._connection.commit()
+
+    def fail(self, job):
+        """Makes a failed job available again, or moves it to the dead letters after max_attempts."""
+        with self._lock:
+            if job.attempts >= self.max_attempts:
+                logger.error(f"Job {job.job_id} failed {job.attempts} times, moving it to the dead letters")
+                self._connection.execute("UPDATE jobs SET state = 'dead' WHERE id = ?", (int(job.receipt),))
+            else:
+                self._connection.execute(
+                    "UPDATE jobs SET state = 'ready', visible_at = 0 WHERE id = ?", (int(job.receipt),)
+                )
+            self._connection.commit()
+
+    def dead_letters(self):
+        """Get the jobs that exhausted their attempts."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, payload, attempts FROM jobs WHERE state = 'dead' ORDER BY id"
+            ).fetchall()
+        return [Job.from_json(payload, receipt=str(row_id), attempts=attempts) for row_id, payload, attempts in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM jobs WHERE state != 'dead'").fetchone()[0]
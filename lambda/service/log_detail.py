@@ -0,0 +1,122 @@
+import contextvars
+import logging
+import random
+import re
+from contextlib import contextmanager
+from dataclasses import dataclass
+from config import (
+    logger,
+    LOG_FIELD_MAX_CHARS,
+    LOG_DETAIL_SAMPLE_RATE,
+    LOG_DEBUG_USER_IDS,
+)
+
+# Slack tokens, bearer credentials and AWS access key IDs
+SECRET_PATTERNS = (
+    re.compile(r"xox[abpors]-[A-Za-z0-9-]+"),
+    re.compile(r"xapp-[A-Za-z0-9-]+"),
+    re.compile(r"(?i)(bearer\s+)[A-Za-z0-9._~+/=-]+"),
+    re.compile(r"\b(?:AKIA|ASIA)[A-Z0-9]{16}\b"),
+)
+REDACTED = "[REDACTED]"
+
+@dataclass(frozen=True)
+class _RequestLogDetail:
+    debug: bool
+    sampled: bool
+
+_current_request = contextvars.ContextVar("log_detail_request", default=None)
+
+class LogDetail:
+    """
+    Decides how much of large or sensitive values is logged.
+
+    Payloads such as prompts, model responses and Slack request bodies are only
+    logged for a sampled fraction of requests, capped at LOG_FIELD_MAX_CHARS, and with
+    secrets redacted. Debug logging is enabled per user: requests from users in
+    LOG_DEBUG_USER_IDS are always logged in full, secrets are still redacted.
+    """
+
+    @classmethod
+    @contextmanager
+    def request(cls, user_id=None):
+        """
+        Decide the log detail of one request, for everything logged in the enclosed block.
+
+        Args:
+            user_id (str, optional): The Slack user ID the request is for.
+        """
+        debug = user_id is not None and user_id in LOG_DEBUG_USER_IDS
+        sampled = debug or random.random() < LOG_DETAIL_SAMPLE_RATE
+        token = _current_request.set(_RequestLogDetail(debug=debug, sampled=sampled))
+        try:
+            yield
+        finally:
+            _current_request.reset(token)
+
+    @classmethod
+    def is_debug(cls):
+        """Whether the current request is logged in full."""
+        request = _current_request.get()
+        return request is not None and request.debug
+
+    @classmethod
+    def sampled(cls):
+        """Whether payloads should be logged, decided once per request."""
+        request = _current_request.get()
+        if request is not None:
+            return request.sampled
+        return random.random() < LOG_DETAIL_SAMPLE_RATE
+
+    @classmethod
+    def field(cls, value, max_chars=LOG_FIELD_MAX_CHARS):
+        """
+        Render a value for a log message, redacted and capped unless in debug mode.
+
+        Args:
+            value: The value to render.
+            max_chars (int, optional): The most characters to keep.
+
+        Returns:
+            str: The rendered value.
+        """
+        text = redact(str(value))
+        if cls.is_debug() or len(text) <= max_chars:
+            return text
+        return f"{text[:max_chars]}... [{len(text) - max_chars} more characters]"
+
+def redact(text):
+    """Replace secrets in a string."""
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub(lambda match: (match.group(1) if match.groups() else "") + REDACTED, text)
+    return text
+
+class RedactingFilter(logging.Filter):
+    """Redacts secrets from every record, in case a secret reaches a log message."""
+
+    def filter(self, record):
+        try:
+            message = record.getMessage()
+        except Exception:
+            return True
+        redacted = redact(message)
+        if redacted != message:
+            record.msg = redacted
+            record.args = None
+        return True
+
+def install_redacting_filter():
+    """
+    Attach a RedactingFilter to the root logger and every handler it has.
+
+    A logger's filters only see the records logged through that logger, while records
+    propagated from other loggers, such as slack_bolt's or botocore's, only pass through
+    the filters of the handlers. The Lambda runtime adds its handler to the root logger
+    before the function's code is imported.
+    """
+    for target in [logger, *logger.handlers]:
+        if not any(isinstance(existing, RedactingFilter) for existing in target.filters):
+            target.addFilter(RedactingFilter())
+
+# Installed on import, every module that logs payloads imports this one
+install_redacting_filter()
@@ -1,16 +1,42 @@
-from config import logger
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import (
+    logger,
+    FILE_DOWNLOAD_POOL_SIZE,
+    FILE_DOWNLOAD_MAX_CONCURRENCY_PER_MESSAGE,
+    DEFAULT_BEDROCK_MODEL_ID,
+    DOCUMENT_TEXT_EXTRACTION_ENABLED,
+    MODEL_REGISTRY,
+)
 from service.file_service import FileService
+from service.attachment_cache import AttachmentCache
+from service.image_normalizer import ImageNormalizer
+from service.document_text_extractor import DocumentTextExtractor
+from service.metrics import Metrics
 
 class MessagePreparationHelper:
     # Supported file types
     SUPPORTED_IMAGE_TYPES = ["png", "jpg", "jpeg", "gif", "webp"]
     SUPPORTED_VIDEO_TYPES = ["mov", "mkv", "mp4", "webm", "flv", "mpeg", "mpg", "wmv", "three_gp"]
     SUPPORTED_DOCUMENT_TYPES = ["pdf", "csv", "doc", "docx", "xls", "xlsx", "html", "txt", "md"]
+    FILE_TYPE_MODALITIES = {
+        **{filetype: "image" for filetype in SUPPORTED_IMAGE_TYPES},
+        **{filetype: "video" for filetype in SUPPORTED_VIDEO_TYPES},
+        **{filetype: "document" for filetype in SUPPORTED_DOCUMENT_TYPES},
+    }
+
+    # Shared by every helper so the number of downloads in flight in the container stays bounded
+    _download_executor = ThreadPoolExecutor(
+        max_workers=FILE_DOWNLOAD_POOL_SIZE,
+        thread_name_prefix="file-download"
+    )
 
     def __init__(self):
         self.file_service = FileService()
+        self.attachment_cache = AttachmentCache()
+        self.image_normalizer = ImageNormalizer()
+        self.document_text_extractor = DocumentTextExtractor()
 
-    def prepare_message(self, text, files, app_client):
+    def prepare_message(self, text, files, app_client, model_id=None):
         """
         Prepares a message with text and any attached files.
 
@@ -18,6 +44,8 @@ class MessagePreparationHelper:
             text (str): The message text.
             files (list): List of file attachments from Slack.
             app_client: The Slack app client for authentication.
+            model_id (str, optional): The model the message will be sent to, used to
+                tailor attachments to it. Defaults to the default Bedrock model.
 
         Returns:
             dict: A formatted message for the model.
@@ -39,13 +67,24 @@ class MessagePreparationHelper:
             "Authorization": f"Bearer {app_client.token}"
         }
 
+        # Reject unsupported file types before spending time on any download
+        model_config = MODEL_REGISTRY.get(model_id or DEFAULT_BEDROCK_MODEL_ID)
         for file in files:
+            self._validate_file_type(file, model_config)
+
+        extract_documents = DOCUMENT_TEXT_EXTRACTION_ENABLED and not (
+            model_config and model_config.prefers_document_layout
+        )
+        download_results = self._download_files(files, headers, extract_documents)
+
+        # Assemble content in the original attachment order
+        for file, (file_content, download_error) in zip(files, download_results):
             try:
-                file_content = self.file_service.download_file(
-                    file["url_private_download"],
-                    headers
+                if download_error is not None:
+                    raise download_error
+                file_message = self._prepare_message_with_file(
+                    text, file_content, file, model_config, extract_documents
                 )
-                file_message = self._prepare_message_with_file(text, file_content, file)
                 # Append the file content to the existing message
                 message["content"].extend(file_message["content"][1:])
             except ValueError:
@@ -57,15 +96,125 @@ class MessagePreparationHelper:
                 message["content"][0]["text"] += f" (Note: Failed to process attached file: {file['name']})"
 
         return message
+
+    def prefetch_files(self, files, app_client):
+        """
+        Downloads supported files into the attachment cache ahead of prepare_message.
+
+        Args:
+            files (list): List of file attachments from Slack.
+            app_client: The Slack app client for authentication.
+
+        Returns:
+            int: The number of files that are now cached.
+        """
+        files = [file for file in files if file.get("filetype", "").lower() in self.FILE_TYPE_MODALITIES]
+        if not files:
+            return 0
+
+        headers = {
+            "Authorization": f"Bearer {app_client.token}"
+        }
+        download_results = self._download_files(files, headers)
+        return sum(1 for _, download_error in download_results if download_error is None)
+
+    def _download_files(self, files, headers, extract_documents=False):
+        """
+        Downloads files concurrently on the shared download pool.
+
+        At most FILE_DOWNLOAD_MAX_CONCURRENCY_PER_MESSAGE downloads for a single message
+        are in flight at once, so one message with many attachments cannot occupy the
+        whole pool.
+
+        Args:
+            files (list): List of file attachments from Slack.
+            headers (dict): Headers for the requests, including authentication.
+            extract_documents (bool, optional): Whether documents with previously extracted
+                text can skip the download. Defaults to False.
+
+        Returns:
+            list: A (content, error) tuple for each file, in the same order as files.
+                Content is a str holding the extracted text when the download was skipped.
+        """
+        results = [None] * len(files)
+        pending = {}
+        remaining = iter(enumerate(files))
+
+        def submit_next():
+            for index, file in remaining:
+                future = self._download_executor.submit(
+                    Metrics.bind(self._fetch_file), file, headers, extract_documents
+                )
+                pending[future] = index
+                return
+
+        for _ in range(FILE_DOWNLOAD_MAX_CONCURRENCY_PER_MESSAGE):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    results[index] = (future.result(), None)
+                except Exception as e:
+                    results[index] = (None, e)
+                submit_next()
+
+        return results
+
+    def _fetch_file(self, file_info, headers, extract_documents=False):
+        """Returns a file's content from the attachment cache, downloading it from Slack on a miss."""
+        if extract_documents and file_info["filetype"].lower() in self.SUPPORTED_DOCUMENT_TYPES:
+            extracted_text = self.document_text_extractor.get_cached_text(file_info)
+            if extracted_text is not None:
+                return extracted_text
+
+        file_content = self.attachment_cache.get(file_info)
+        if file_content is not None:
+            return file_content
+
+        file_content = self.file_service.download_file(
+            file_info["url_private_download"],
+            headers,
+            expected_size=file_info.get("size")
+        )
+        self.attachment_cache.put(file_info, file_content)
+        return file_content
+
+    def _validate_file_type(self, file_info, model_config=None):
+        """
+        Checks that a file type is supported, and accepted by the target model if known.
+
+        Raises:
+            ValueError: If the file type is not supported.
+        """
+        filetype = file_info["filetype"].lower()
+        modality = self.FILE_TYPE_MODALITIES.get(filetype)
+        if modality is None:
+            raise self._unsupported_file_type_error(filetype)
+        if model_config and modality not in model_config.modalities:
+            raise ValueError(f"{model_config.description} does not accept {modality} files: {file_info['name']}")
+
+    def _unsupported_file_type_error(self, filetype):
+        return ValueError(
+            f"Unsupported file type: {filetype}. Supported types are: "
+            f"images ({', '.join(self.SUPPORTED_IMAGE_TYPES)}), "
+            f"videos ({', '.join(self.SUPPORTED_VIDEO_TYPES)}), and "
+            f"documents ({', '.join(self.SUPPORTED_DOCUMENT_TYPES)})"
+        )
             
-    def _prepare_message_with_file(self, text, file_content, file_info):
+    def _prepare_message_with_file(self, text, file_content, file_info, model_config=None, extract_documents=False):
         """
         Prepares a message with file content for the model.
 
         Args:
             text (str): The text message.
-            file_content (bytes): The file content.
+            file_content (bytes | str): The file content, or already extracted document text.
             file_info (dict): Information about the file including type and format.
+            model_config (BedrockModelConfig, optional): The target model. Defaults to None.
+            extract_documents (bool, optional): Whether documents should be sent as extracted
+                text when possible. Defaults to False.
 
         Returns:
             dict: A formatted message for the model.
@@ -77,13 +226,14 @@ class MessagePreparationHelper:
             "role": "user",
             "content": [{"text": text}]
         }
-        logger.info(f"Preparing message with file info: {file_info}")
+        logger.info(f"Preparing message with file {file_info.get('id')} ({file_info['filetype']})")
 
         filetype = file_info["filetype"].lower()
 
         if filetype in self.SUPPORTED_IMAGE_TYPES:
             # Convert jpg to jpeg for model compatibility
             format_type = "jpeg" if filetype == "jpg" else filetype
+            file_content, format_type = self.image_normalizer.normalize(file_content, format_type, model_config)
             message["content"].append({
                 "image": {
                     "format": format_type,
@@ -102,6 +252,18 @@ class MessagePreparationHelper:
                 }
             })
         elif filetype in self.SUPPORTED_DOCUMENT_TYPES:
+            extracted_text = None
+            if isinstance(file_content, str):
+                extracted_text = file_content
+            elif extract_documents:
+                extracted_text = self.document_text_extractor.extract(file_info, file_content, filetype)
+
+            if extracted_text is not None:
+                message["content"].append({
+                    "text": f"<document name=\"{file_info['name']}\">\n{extracted_text}\n</document>"
+                })
+                return message
+
             message["content"].append({
                 "document": {
                     "name": "".join(c if c.isalnum() else "_" for c in file_info["name"]),
@@ -112,11 +274,6 @@ class MessagePreparationHelper:
                 }
             })
         else:
-            raise ValueError(
-                f"Unsupported file type: {filetype}. Supported types are: "
-                f"images ({', '.join(self.SUPPORTED_IMAGE_TYPES)}), "
-                f"videos ({', '.join(self.SUPPORTED_VIDEO_TYPES)}), and "
-                f"documents ({', '.join(self.SUPPORTED_DOCUMENT_TYPES)})"
-            )
+            raise self._unsupported_file_type_error(filetype)
 
         return message 
\ No newline at end of file
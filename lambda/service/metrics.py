@@ -0,0 +1,171 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from config import logger, METRICS_EMF_ENABLED, METRICS_NAMESPACE
+
+# CloudWatch accepts at most this many values for one metric in one document
+EMF_MAX_VALUES_PER_METRIC = 100
+DIMENSION_NAMES = ("Model", "ChannelType", "ColdStart")
+
+_current_request = contextvars.ContextVar("metrics_request", default=None)
+
+class RequestMetrics:
+    """The dimensions and metric values collected while handling one request."""
+
+    def __init__(self, dimensions):
+        self.dimensions = dict(dimensions)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def set_dimension(self, name, value):
+        with self._lock:
+            self.dimensions[name] = value
+
+    def add(self, name, value, unit):
+        with self._lock:
+            self.values.setdefault(name, (unit, []))[1].append(value)
+
+    def to_emf(self, namespace, timestamp=None):
+        """Builds a CloudWatch Embedded Metric Format document of the collected values."""
+        with self._lock:
+            document = {
+                "_aws": {
+                    "Timestamp": int((timestamp or time.time()) * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": namespace,
+                        "Dimensions": [list(DIMENSION_NAMES)],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _) in sorted(self.values.items())],
+                    }],
+                },
+            }
+            for name in DIMENSION_NAMES:
+                value = self.dimensions.get(name)
+                document[name] = str(value) if value is not None else "none"
+            for name, (_, values) in self.values.items():
+                values = values[:EMF_MAX_VALUES_PER_METRIC]
+                document[name] = values[0] if len(values) == 1 else values
+            return document
+
+class Metrics:
+    """
+    Times the stages of a request.
+
+    Every recorded timing is passed to the registered sinks, callables that take the
+    stage name and its duration in seconds. Sinks are shared by the whole container
+    and are called on the thread that ran the stage, so they must be thread-safe.
+
+    Inside a request() block, timings and counts are also collected for the request
+    and written as one CloudWatch Embedded Metric Format document when it ends, with
+    model, channel type and cold start dimensions. Work handed to other threads is
+    attributed to the request when it is wrapped with bind().
+    """
+    _sinks = []
+    _lock = threading.Lock()
+    _cold_start = True
+
+    @classmethod
+    def add_sink(cls, sink):
+        """Start passing timings to a sink."""
+        with cls._lock:
+            cls._sinks = cls._sinks + [sink]
+
+    @classmethod
+    def remove_sink(cls, sink):
+        """Stop passing timings to a sink."""
+        with cls._lock:
+            cls._sinks = [registered for registered in cls._sinks if registered is not sink]
+
+    @classmethod
+    @contextmanager
+    def request(cls, **dimensions):
+        """
+        Collect the metrics recorded in the enclosed block as one request.
+
+        The first request in the container has the ColdStart dimension set to true.
+
+        Args:
+            **dimensions: Initial dimension values, such as ChannelType.
+
+        Yields:
+            RequestMetrics: The metrics of the request.
+        """
+        with cls._lock:
+            cold_start, cls._cold_start = cls._cold_start, False
+        request_metrics = RequestMetrics({"ColdStart": "true" if cold_start else "false", **dimensions})
+        token = _current_request.set(request_metrics)
+        try:
+            yield request_metrics
+        finally:
+            _current_request.reset(token)
+            if METRICS_EMF_ENABLED and request_metrics.values:
+                cls._emit(request_metrics)
+
+    @classmethod
+    def set_dimension(cls, name, value):
+        """Set a dimension of the current request, if there is one."""
+        request_metrics = _current_request.get()
+        if request_metrics is not None:
+            request_metrics.set_dimension(name, value)
+
+    @classmethod
+    def bind(cls, function):
+        """Wraps a function to run in a copy of the current context, so a pool thread records into the current request."""
+        context = contextvars.copy_context()
+        return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+    @classmethod
+    @contextmanager
+    def stage(cls, name):
+        """
+        Time the enclosed block as a stage, whether or not it raises.
+
+        Args:
+            name (str): The stage name.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.record(name, time.perf_counter() - started_at)
+
+    @classmethod
+    def record(cls, name, seconds):
+        """
+        Record a stage timing for the current request and pass it to every sink.
+        Sink errors are logged and swallowed.
+
+        Args:
+            name (str): The stage name.
+            seconds (float): How long the stage took.
+        """
+        request_metrics = _current_request.get()
+        if request_metrics is not None:
+            request_metrics.add(name, round(seconds * 1000, 3), "Milliseconds")
+        for sink in cls._sinks:
+            try:
+                sink(name, seconds)
+            except Exception as e:
+                logger.warning(f"Error recording timing of {name}: {e}")
+
+    @classmethod
+    def count(cls, name, value):
+        """
+        Record a count, such as a number of tokens, for the current request.
+
+        Args:
+            name (str): The metric name.
+            value (int): The count.
+        """
+        request_metrics = _current_request.get()
+        if request_metrics is not None:
+            request_metrics.add(name, value, "Count")
+
+    @classmethod
+    def _emit(cls, request_metrics):
+        # EMF documents must be written as a whole line without a log prefix
+        try:
+            print(json.dumps(request_metrics.to_emf(METRICS_NAMESPACE), separators=(",", ":")), flush=True)
+        except Exception as e:
+            logger.warning(f"Error writing request metrics: {e}")
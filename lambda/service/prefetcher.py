@@ -0,0 +1,96 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from config import logger, PREFETCH_POOL_SIZE
+from service.metrics import Metrics
+
+class PrefetchTimeoutError(Exception):
+    """Raised when a prefetched dependency does not finish within its timeout."""
+
+class Prefetcher:
+    """
+    Loads the dependencies of a single request concurrently.
+
+    Each dependency is a named loader that may depend on other dependencies. A loader
+    is only submitted to the pool once all of its dependencies have finished, and it
+    receives their results as positional arguments, so pool threads never block waiting
+    on each other. If a dependency fails, every loader that depends on it fails with the
+    same exception. Results are joined with get(), each with its own timeout.
+    """
+    # Shared by every prefetcher so the number of loaders running in the container stays bounded
+    _executor = ThreadPoolExecutor(
+        max_workers=PREFETCH_POOL_SIZE,
+        thread_name_prefix="prefetch"
+    )
+
+    def __init__(self):
+        self._futures = {}
+
+    def start(self, name, loader, depends_on=()):
+        """
+        Start loading a dependency.
+
+        Args:
+            name (str): The name the result is retrieved by.
+            loader (callable): Loads the dependency, called with the results of depends_on.
+            depends_on (tuple, optional): Names of previously started dependencies.
+                Defaults to no dependencies.
+        """
+        dependencies = [self._futures[dependency] for dependency in depends_on]
+        future = Future()
+        self._futures[name] = future
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            started_at = time.monotonic()
+            try:
+                result = loader(*[dependency.result() for dependency in dependencies])
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            logger.info(f"Prefetched {name} in {time.monotonic() - started_at:.3f} seconds")
+
+        # Loaders record their metrics into the request that started them
+        run = Metrics.bind(run)
+        if not dependencies:
+            self._executor.submit(run)
+            return
+
+        remaining = [len(dependencies)]
+        lock = threading.Lock()
+
+        def on_dependency_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                self._executor.submit(run)
+
+        for dependency in dependencies:
+            dependency.add_done_callback(on_dependency_done)
+
+    def started(self, name):
+        """Check whether a dependency has been started."""
+        return name in self._futures
+
+    def get(self, name, timeout=None):
+        """
+        Wait for a dependency and return its result.
+
+        Args:
+            name (str): The name the dependency was started with.
+            timeout (float, optional): Seconds to wait. Defaults to waiting indefinitely.
+
+        Returns:
+            The result of the dependency's loader.
+
+        Raises:
+            PrefetchTimeoutError: If the dependency does not finish within the timeout.
+            Exception: Whatever the loader, or one of its dependencies, raised.
+        """
+        try:
+            return self._futures[name].result(timeout=timeout)
+        except FuturesTimeoutError:
+            raise PrefetchTimeoutError(f"Loading {name} did not finish within {timeout} seconds")
@@ -0,0 +1,150 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import boto3
+from botocore.config import Config
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    logger,
+    DYNAMODB_TABLE_NAME,
+    FILE_DOWNLOAD_POOL_SIZE,
+    CLIENT_PREWARM_TIMEOUT_SECONDS,
+    BEDROCK_CONNECT_TIMEOUT_SECONDS,
+    BEDROCK_READ_TIMEOUT_SECONDS,
+    BEDROCK_MAX_POOL_CONNECTIONS,
+)
+
+# Host that Slack file downloads are served from
+SLACK_FILES_URL = "https://files.slack.com"
+
+class SharedClients:
+    """
+    AWS clients and the HTTP session shared by every service in the container.
+
+    Each client is created once, on first use, and kept for the lifetime of the
+    container so its connection pool, and the TLS sessions in it, are reused across
+    invocations. Creation is serialized because boto3's default session is not
+    thread-safe.
+    """
+    _clients = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def bedrock_runtime(cls):
+        """
+        The Bedrock runtime client.
+
+        Adaptive retry mode rate limits sending on the client once Bedrock throttles.
+        The client makes a single attempt, retries are made by BedrockInvoker so they
+        can be measured.
+        """
+        return cls._get("bedrock-runtime", lambda: boto3.client(
+            "bedrock-runtime",
+            config=Config(
+                retries={"mode": "adaptive", "max_attempts": 1},
+                connect_timeout=BEDROCK_CONNECT_TIMEOUT_SECONDS,
+                read_timeout=BEDROCK_READ_TIMEOUT_SECONDS,
+                max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+            )
+        ))
+
+    @classmethod
+    def dynamodb(cls):
+        """The DynamoDB service resource."""
+        return cls._get("dynamodb", lambda: boto3.resource("dynamodb"))
+
+    @classmethod
+    def s3(cls):
+        """The S3 client."""
+        return cls._get("s3", lambda: boto3.client("s3"))
+
+    @classmethod
+    def sqs(cls):
+        """The SQS client."""
+        return cls._get("sqs", lambda: boto3.client("sqs"))
+
+    @classmethod
+    def http_session(cls):
+        """The pooled keep-alive HTTP session used for Slack file downloads."""
+        return cls._get("http", cls._create_http_session)
+
+    @classmethod
+    def set_client(cls, name, client):
+        """Replace a client, for stand-ins used by benchmarks."""
+        with cls._lock:
+            cls._clients[name] = client
+
+    @classmethod
+    def clear(cls):
+        """Forget all clients, they are created again on next use."""
+        with cls._lock:
+            cls._clients.clear()
+
+    @classmethod
+    def prewarm(cls, timeout=CLIENT_PREWARM_TIMEOUT_SECONDS):
+        """
+        Opens connections to Bedrock, DynamoDB and Slack files concurrently.
+
+        Meant to run during the Lambda init phase, so the first invocation does not pay
+        for DNS resolution and TLS handshakes. Each connection is opened with a cheap
+        read-only request whose outcome is ignored, an authorization error still leaves
+        a warm connection in the pool. Gives up waiting after timeout seconds.
+
+        Args:
+            timeout (float, optional): Seconds to wait for all connections.
+
+        Returns:
+            dict: Seconds taken by each connection that finished, keyed by name.
+        """
+        requests_by_name = {
+            "bedrock-runtime": lambda: cls.bedrock_runtime().list_async_invokes(maxResults=1),
+            "http": lambda: cls.http_session().head(SLACK_FILES_URL, timeout=timeout),
+        }
+        if DYNAMODB_TABLE_NAME:
+            requests_by_name["dynamodb"] = lambda: cls.dynamodb().meta.client.describe_table(
+                TableName=DYNAMODB_TABLE_NAME
+            )
+
+        timings = {}
+
+        def open_connection(name, request):
+            started_at = time.monotonic()
+            try:
+                request()
+            except Exception as e:
+                logger.info(f"Prewarm request to {name} failed, the connection may still be reused: {e}")
+            timings[name] = time.monotonic() - started_at
+
+        executor = ThreadPoolExecutor(max_workers=len(requests_by_name), thread_name_prefix="prewarm")
+        futures = [executor.submit(open_connection, name, request) for name, request in requests_by_name.items()]
+        wait(futures, timeout=timeout)
+        executor.shutdown(wait=False)
+
+        # Requests still in flight after the timeout keep running in the background
+        finished = dict(timings)
+        logger.info(f"Prewarmed connections: {', '.join(f'{name} {seconds:.3f}s' for name, seconds in finished.items())}")
+        return finished
+
+    @classmethod
+    def _get(cls, name, factory):
+        client = cls._clients.get(name)
+        if client is None:
+            with cls._lock:
+                client = cls._clients.get(name)
+                if client is None:
+                    client = factory()
+                    cls._clients[name] = client
+        return client
+
+    @staticmethod
+    def _create_http_session():
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=FILE_DOWNLOAD_POOL_SIZE,
+            pool_maxsize=FILE_DOWNLOAD_POOL_SIZE
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
@@ -0,0 +1,113 @@
+import time
+from config import logger, STREAMING_UPDATE_INTERVAL_SECONDS, STREAMING_UPDATE_MIN_CHARS
+
+class SlackMessageStreamer:
+    """
+    Posts a placeholder message to Slack and progressively edits it with chat_update
+    as model output streams in.
+
+    Edits are batched: after the first visible token, the message is only updated once
+    at least STREAMING_UPDATE_INTERVAL_SECONDS have passed and STREAMING_UPDATE_MIN_CHARS
+    new characters have arrived, which keeps us well under Slack's chat.update rate limit.
+    """
+    PLACEHOLDER_TEXT = ":hourglass_flowing_sand: Thinking..."
+    # Slack truncates message text beyond 40,000 characters, so longer output
+    # continues in follow-up messages in the same thread.
+    MAX_MESSAGE_CHARS = 39000
+
+    def __init__(self, app_client, channel, thread_ts,
+                 update_interval=STREAMING_UPDATE_INTERVAL_SECONDS,
+                 min_chars=STREAMING_UPDATE_MIN_CHARS):
+        self.app_client = app_client
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.update_interval = update_interval
+        self.min_chars = min_chars
+        self._message_ts = []
+        self._published = []
+        self._last_update_at = 0.0
+        self._last_update_len = 0
+        self._started_at = None
+        self._first_visible_at = None
+
+    def start(self):
+        """Posts the placeholder message that will be edited as tokens arrive."""
+        self._started_at = time.monotonic()
+        response = self.app_client.chat_postMessage(
+            channel=self.channel,
+            thread_ts=self.thread_ts,
+            text=self.PLACEHOLDER_TEXT
+        )
+        self._message_ts = [response["ts"]]
+        self._published = [self.PLACEHOLDER_TEXT]
+
+    def update(self, render_text):
+        """
+        Records that new output is available and edits the message if the batching
+        cadence allows it.
+
+        Args:
+            render_text (callable): Zero-argument function returning the full output so far.
+        """
+        now = time.monotonic()
+        if self._first_visible_at is not None and now - self._last_update_at < self.update_interval:
+            return
+
+        text = render_text()
+        if self._first_visible_at is not None and len(text) - self._last_update_len < self.min_chars:
+            return
+
+        try:
+            self._publish(text)
+        except Exception as e:
+            # A failed intermediate edit (e.g. rate limited) is not fatal, the final
+            # edit in finish() will bring the message up to date.
+            logger.warning(f"Error updating streamed message: {e}")
+            return
+
+        self._last_update_at = now
+        self._last_update_len = len(text)
+        if self._first_visible_at is None:
+            self._first_visible_at = now
+            logger.info(f"Time to first visible token: {now - self._started_at:.3f}s")
+
+    def finish(self, text):
+        """Publishes the complete output, replacing the placeholder."""
+        self._publish(text or " ")
+
+    def fail(self, error_text):
+        """Replaces the placeholder (or appends to partial output) with an error message."""
+        if self._first_visible_at is None:
+            self._publish(error_text)
+        else:
+            self.app_client.chat_postMessage(
+                channel=self.channel,
+                thread_ts=self.thread_ts,
+                text=error_text
+            )
+
+    def _publish(self, text):
+        """Edits the streamed messages so that together they display the given text."""
+        chunks = [
+            text[i:i + self.MAX_MESSAGE_CHARS]
+            for i in range(0, len(text), self.MAX_MESSAGE_CHARS)
+        ] or [text]
+
+        for index, chunk in enumerate(chunks):
+            if index < len(self._message_ts):
+                if self._published[index] == chunk:
+                    continue
+                self.app_client.chat_update(
+                    channel=self.channel,
+                    ts=self._message_ts[index],
+                    text=chunk
+                )
+                self._published[index] = chunk
+            else:
+                response = self.app_client.chat_postMessage(
+                    channel=self.channel,
+                    thread_ts=self.thread_ts,
+                    text=chunk
+                )
+                self._message_ts.append(response["ts"])
+                self._published.append(chunk)
@@ -0,0 +1,48 @@
+from config import (
+    logger,
+    SLACK_IDENTITY_CACHE_TTL_SECONDS,
+)
+from service.ttl_cache import TTLCache
+
+class SlackMetadataCache:
+    """
+    Read-through cache for rarely-changing Slack metadata.
+
+    The underlying caches are class attributes, so every handler that creates a
+    SlackMetadataCache shares the same entries for the lifetime of the container.
+    """
+    _identity_cache = TTLCache(maxsize=16, ttl_seconds=SLACK_IDENTITY_CACHE_TTL_SECONDS)
+
+    def get_bot_identity(self, app_client):
+        """
+        Get the auth_test response for the client's token.
+
+        Args:
+            app_client: The Slack app client.
+
+        Returns:
+            dict: The bot identity, including user_id, bot_id and team_id.
+        """
+        def load():
+            logger.info("Bot identity cache miss, calling auth_test")
+            response = app_client.auth_test()
+            return {
+                "user_id": response["user_id"],
+                "bot_id": response.get("bot_id"),
+                "team_id": response.get("team_id"),
+            }
+
+        return self._identity_cache.get_or_load(app_client.token, load)
+
+    def get_bot_user_id(self, app_client):
+        """Get the bot's Slack user ID."""
+        return self.get_bot_identity(app_client)["user_id"]
+
+    def invalidate_bot_identity(self, app_client):
+        """Forget the cached identity for the client's token, e.g. after a token rotation."""
+        self._identity_cache.invalidate(app_client.token)
+
+    @classmethod
+    def clear(cls):
+        """Forget all cached Slack metadata."""
+        cls._identity_cache.clear()
@@ -0,0 +1,261 @@
+import json
+import threading
+import time
+import uuid
+import zlib
+from decimal import Decimal
+from dataclasses import dataclass, field
+from typing import Optional
+from boto3.dynamodb.conditions import Key
+from config import (
+    logger,
+    THREAD_STORE_TABLE_NAME,
+    THREAD_STORE_TTL_SECONDS,
+    THREAD_STORE_CHUNK_BYTES,
+)
+from service.shared_clients import SharedClients
+
+# Only the file fields needed to prepare a turn again are persisted
+STORED_FILE_FIELDS = ("id", "name", "filetype", "url_private_download", "size")
+
+@dataclass
+class ThreadState:
+    """
+    The conversation in a Slack thread, grouped into alternating user and assistant turns.
+
+    Each turn is a dict with a role, the combined text of its Slack messages, and
+    references to the files attached to them. The cursor is the ts of the newest Slack
+    message that has been folded into the turns, so only newer messages need fetching.
+    When rolling summarization is enabled, turns that were compacted into the summary
+    are removed from the turns.
+
+    The bot's latest reply may still be streaming into its placeholder, so it and every
+    message after it are kept in pending_turns, which are never stored and are rebuilt
+    from Slack on every read. Only the messages before the latest reply move the cursor.
+    Edits and deletions of those older messages are not picked up once they are stored,
+    which keeps each read down to the last reply and the messages after it.
+    """
+    channel: str
+    thread_ts: str
+    turns: list = field(default_factory=list)
+    cursor: Optional[str] = None
+    bot_responded: bool = False
+    summary: Optional[str] = None
+    pending_turns: list = field(default_factory=list, compare=False)
+
+    def append_messages(self, messages, bot_user_id):
+        """
+        Fold new Slack messages into the turns, skipping any at or before the cursor.
+
+        Consecutive messages from the same side of the conversation are merged into
+        one turn, exactly like grouping the whole thread from scratch would. The bot's
+        latest reply and the messages after it replace the pending turns.
+
+        Args:
+            messages (list): Slack messages in chronological order.
+            bot_user_id (str): The bot's Slack user ID.
+
+        Returns:
+            int: The number of messages that were appended.
+        """
+        new_messages = [
+            message for message in messages
+            if message.get("user") is not None
+            and (self.cursor is None or Decimal(message["ts"]) > Decimal(self.cursor))
+        ]
+        replies = [index for index, message in enumerate(new_messages) if message["user"] == bot_user_id]
+        settled_count = replies[-1] if replies else 0
+        if replies:
+            self.bot_responded = True
+
+        for message in new_messages[:settled_count]:
+            self._fold(self.turns, message, bot_user_id)
+            self.cursor = message["ts"]
+
+        self.pending_turns = []
+        for message in new_messages[settled_count:]:
+            self._fold(self.pending_turns, message, bot_user_id)
+        return len(new_messages)
+
+    def all_turns(self):
+        """
+        Get the stored turns followed by the pending ones.
+
+        Returns:
+            list: The turns of the whole conversation, still alternating between roles.
+        """
+        turns = [dict(turn, files=list(turn["files"])) for turn in self.turns]
+        for turn in self.pending_turns:
+            if turns and turns[-1]["role"] == turn["role"]:
+                turns[-1]["text"] += " " + turn["text"]
+                turns[-1]["files"].extend(turn["files"])
+            else:
+                turns.append(dict(turn, files=list(turn["files"])))
+        return turns
+
+    @staticmethod
+    def _fold(turns, message, bot_user_id):
+        role = "assistant" if message["user"] == bot_user_id else "user"
+        files = [
+            {key: file[key] for key in STORED_FILE_FIELDS if key in file}
+            for file in message.get("files") or []
+        ]
+        if turns and turns[-1]["role"] == role:
+            # Concatenate text from all messages in the group
+            turns[-1]["text"] += " " + message.get("text", "")
+            turns[-1]["files"].extend(files)
+        else:
+            turns.append({"role": role, "text": message.get("text", ""), "files": files})
+
+    def to_dict(self):
+        return {
+            "turns": self.turns,
+            "cursor": self.cursor,
+            "bot_responded": self.bot_responded,
+            "summary": self.summary,
+        }
+
+    @classmethod
+    def from_dict(cls, channel, thread_ts, data):
+        return cls(
+            channel=channel,
+            thread_ts=thread_ts,
+            turns=data.get("turns", []),
+            cursor=data.get("cursor"),
+            bot_responded=data.get("bot_responded", False),
+            summary=data.get("summary"),
+        )
+
+class InMemoryThreadStoreBackend:
+    """Keeps thread state in the container's memory, used when no table is configured and in tests."""
+    _states = {}
+    _lock = threading.Lock()
+
+    def load(self, thread_key):
+        with self._lock:
+            data = self._states.get(thread_key)
+        return json.loads(data) if data else None
+
+    def save(self, thread_key, data):
+        with self._lock:
+            self._states[thread_key] = json.dumps(data)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._states.clear()
+
+class DynamoDBThreadStoreBackend:
+    """
+    Keeps thread state in DynamoDB.
+
+    The state is serialized as zlib-compressed JSON. If it is larger than
+    THREAD_STORE_CHUNK_BYTES it is split over several items that share the thread_key
+    partition key and are ordered by the chunk sort key, so long threads stay under
+    DynamoDB's 400 KB item size limit. Every write uses a new version, and the header
+    item (chunk 0) is written last, so readers never mix chunks from different writes.
+    """
+
+    def __init__(self, table_name=THREAD_STORE_TABLE_NAME):
+        self.table_name = table_name
+        self._table = None
+
+    @property
+    def table(self):
+        """Lazy initialization of DynamoDB table."""
+        if self._table is None:
+            self._table = SharedClients.dynamodb().Table(self.table_name)
+        return self._table
+
+    def load(self, thread_key):
+        response = self.table.query(
+            KeyConditionExpression=Key("thread_key").eq(thread_key),
+            ConsistentRead=True
+        )
+        items = {int(item["chunk"]): item for item in response.get("Items", [])}
+        header = items.get(0)
+        if header is None:
+            return None
+
+        chunks = []
+        for index in range(int(header["chunk_count"])):
+            item = items.get(index)
+            if item is None or item["version"] != header["version"]:
+                logger.warning(f"Thread state for {thread_key} is incomplete, rebuilding it")
+                return None
+            chunks.append(bytes(item["data"]))
+        return json.loads(zlib.decompress(b"".join(chunks)))
+
+    def save(self, thread_key, data):
+        payload = zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+        chunks = [
+            payload[i:i + THREAD_STORE_CHUNK_BYTES]
+            for i in range(0, len(payload), THREAD_STORE_CHUNK_BYTES)
+        ] or [b""]
+        version = uuid.uuid4().hex
+        expires_at = int(time.time()) + THREAD_STORE_TTL_SECONDS
+
+        # Write the continuation chunks before the header that makes them visible
+        for index in list(range(1, len(chunks))) + [0]:
+            item = {
+                "thread_key": thread_key,
+                "chunk": index,
+                "version": version,
+                "data": chunks[index],
+                "expires_at": expires_at,
+            }
+            if index == 0:
+                item["chunk_count"] = len(chunks)
+            self.table.put_item(Item=item)
+
+        # Remove chunks left over from a previous, longer state
+        response = self.table.query(
+            KeyConditionExpression=Key("thread_key").eq(thread_key) & Key("chunk").gte(len(chunks)),
+            ProjectionExpression="#chunk",
+            ExpressionAttributeNames={"#chunk": "chunk"}
+        )
+        for item in response.get("Items", []):
+            self.table.delete_item(Key={"thread_key": thread_key, "chunk": item["chunk"]})
+
+class ThreadConversationStore:
+    """Loads and saves ThreadState for Slack threads keyed by channel and thread_ts."""
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = DynamoDBThreadStoreBackend() if THREAD_STORE_TABLE_NAME else InMemoryThreadStoreBackend()
+        self.backend = backend
+
+    def load(self, channel, thread_ts):
+        """
+        Load the stored state of a thread.
+
+        Args:
+            channel (str): The Slack channel ID.
+            thread_ts (str): The ts of the thread's parent message.
+
+        Returns:
+            ThreadState: The stored state, or an empty state if none is stored or it
+                could not be read.
+        """
+        try:
+            data = self.backend.load(self._thread_key(channel, thread_ts))
+            if data is not None:
+                return ThreadState.from_dict(channel, thread_ts, data)
+        except Exception as e:
+            logger.error(f"Error loading thread state: {e}")
+        return ThreadState(channel=channel, thread_ts=thread_ts)
+
+    def save(self, state):
+        """
+        Save the state of a thread. Failures are logged, the next reply rebuilds the state.
+
+        Args:
+            state (ThreadState): The state to save.
+        """
+        try:
+            self.backend.save(self._thread_key(state.channel, state.thread_ts), state.to_dict())
+        except Exception as e:
+            logger.error(f"Error saving thread state: {e}")
+
+    def _thread_key(self, channel, thread_ts):
+        return f"{channel}#{thread_ts}"
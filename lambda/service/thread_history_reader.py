@@ -0,0 +1,96 @@
+from collections import deque
+from decimal import Decimal
+from config import (
+    logger,
+    THREAD_HISTORY_PAGE_SIZE,
+)
+from service.token_estimator import TokenEstimator
+
+class ThreadHistoryReader:
+    """
+    Reads the messages of a Slack thread page by page.
+
+    Pages are requested lazily by following response_metadata.next_cursor, so a caller
+    that stops iterating early never causes another conversations.replies call. With a
+    message or token budget, reading does not stop at the budget: conversations.replies
+    only pages forward from the oldest message, so every message after oldest is
+    fetched, and the budget only limits which of the newest ones are kept. The stored
+    cursor keeps this range down to the messages posted since the last reply.
+    """
+
+    def __init__(self, page_size=THREAD_HISTORY_PAGE_SIZE):
+        self.page_size = page_size
+        self.token_estimator = TokenEstimator()
+
+    def iter_messages(self, app_client, channel, thread_ts, oldest=None, max_messages=None, max_tokens=None):
+        """
+        Yield the messages of a thread in chronological order.
+
+        When the messages exceed the message or token budget, the oldest ones are dropped
+        after the whole range has been fetched. The newest message, usually the one being
+        replied to, is always yielded.
+
+        Args:
+            app_client: The Slack app client.
+            channel (str): The Slack channel ID.
+            thread_ts (str): The ts of the thread's parent message.
+            oldest (str, optional): Only yield messages newer than this ts. Defaults to None.
+            max_messages (int, optional): The most messages to yield. Defaults to None.
+            max_tokens (int, optional): The most estimated text tokens to yield. Defaults to None.
+
+        Yields:
+            dict: Slack message objects.
+        """
+        messages = self._iter_pages(app_client, channel, thread_ts, oldest)
+        if max_messages is None and max_tokens is None:
+            yield from messages
+            return
+
+        tail = deque()
+        token_count = 0
+        dropped_count = 0
+        for message in messages:
+            message_tokens = self.token_estimator.estimate_text(message.get("text"))
+            tail.append((message, message_tokens))
+            token_count += message_tokens
+            while len(tail) > 1 and (
+                (max_messages is not None and len(tail) > max_messages)
+                or (max_tokens is not None and token_count > max_tokens)
+            ):
+                _, dropped_tokens = tail.popleft()
+                token_count -= dropped_tokens
+                dropped_count += 1
+
+        if dropped_count:
+            logger.warning(
+                f"Thread {thread_ts} history dropped its {dropped_count} oldest messages to stay within "
+                f"{max_messages} messages and {max_tokens} tokens"
+            )
+        for message, _ in tail:
+            yield message
+
+    def _iter_pages(self, app_client, channel, thread_ts, oldest):
+        message_count = 0
+        page_count = 0
+        cursor = None
+
+        while True:
+            request_params = {"channel": channel, "ts": thread_ts, "limit": self.page_size}
+            if oldest:
+                request_params["oldest"] = oldest
+            if cursor:
+                request_params["cursor"] = cursor
+            response = app_client.conversations_replies(**request_params)
+            page_count += 1
+
+            for message in response.get("messages", []):
+                # The parent message is returned on every page request, even with oldest set
+                if oldest and Decimal(message["ts"]) <= Decimal(oldest):
+                    continue
+                message_count += 1
+                yield message
+
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                logger.info(f"Read {message_count} messages from {page_count} pages of thread {thread_ts}")
+                return
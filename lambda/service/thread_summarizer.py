@@ -0,0 +1,120 @@
+from config import (
+    logger,
+    THREAD_SUMMARY_ENABLED,
+    THREAD_SUMMARY_TRIGGER_TURNS,
+    THREAD_SUMMARY_KEEP_RECENT_TURNS,
+    THREAD_SUMMARY_MODEL_ID,
+)
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a Slack thread between users and an AI assistant. "
+    "Update the existing summary with the new messages. Keep facts, decisions, open questions, "
+    "instructions the users gave, and the names of attached files. "
+    "Write compact prose and reply with the updated summary only."
+)
+SUMMARY_ACKNOWLEDGEMENT = "Understood, I'll continue the conversation from this summary."
+
+class ThreadSummarizer:
+    """
+    Compacts the older turns of long threads into a rolling summary.
+
+    Once a thread has more than THREAD_SUMMARY_TRIGGER_TURNS turns, everything except the
+    most recent THREAD_SUMMARY_KEEP_RECENT_TURNS turns is folded into the summary stored
+    on the ThreadState and removed from its turns. Each update only sends the previous
+    summary and the newly compacted turns, so its cost does not grow with the thread.
+    """
+
+    def __init__(self, bedrock_service, enabled=THREAD_SUMMARY_ENABLED, model_id=THREAD_SUMMARY_MODEL_ID,
+                 trigger_turns=THREAD_SUMMARY_TRIGGER_TURNS, keep_recent_turns=THREAD_SUMMARY_KEEP_RECENT_TURNS):
+        self.bedrock_service = bedrock_service
+        self.enabled = enabled
+        self.model_id = model_id
+        self.trigger_turns = trigger_turns
+        self.keep_recent_turns = keep_recent_turns
+
+    def summary_messages(self, thread_state):
+        """
+        Get the Converse messages that stand in for the summarized part of a thread.
+
+        Args:
+            thread_state (ThreadState): The thread state.
+
+        Returns:
+            list: A user message with the summary and an assistant acknowledgement, or an
+                empty list if the thread has no summary.
+        """
+        if not thread_state.summary:
+            return []
+        return [
+            {
+                "role": "user",
+                "content": [{"text": f"<conversation_summary>\n{thread_state.summary}\n</conversation_summary>"}]
+            },
+            {
+                "role": "assistant",
+                "content": [{"text": SUMMARY_ACKNOWLEDGEMENT}]
+            }
+        ]
+
+    def update(self, thread_state, user_id=None):
+        """
+        Fold older turns into the thread's summary when the thread has grown past the trigger.
+
+        Failures are logged and leave the state unchanged, the next reply tries again.
+
+        Args:
+            thread_state (ThreadState): The thread state, updated in place.
+            user_id (str, optional): The Slack user whose reply triggered the update, the
+                summary's tokens are charged to them. Defaults to None.
+
+        Returns:
+            bool: True if the summary was updated and the state needs saving.
+        """
+        if not self.enabled or len(thread_state.turns) <= self.trigger_turns:
+            return False
+
+        # The verbatim turns have to start with a user turn to follow the summary messages
+        boundary = len(thread_state.turns) - self.keep_recent_turns
+        while boundary < len(thread_state.turns) and thread_state.turns[boundary]["role"] != "user":
+            boundary += 1
+        compacted_turns = thread_state.turns[:boundary]
+        if not compacted_turns:
+            return False
+
+        try:
+            summary = self.bedrock_service.invoke_model(
+                messages=[{"role": "user", "content": [{"text": self._build_prompt(thread_state.summary, compacted_turns)}]}],
+                model_id=self.model_id,
+                user_id=user_id,
+                system_prompt=SUMMARY_SYSTEM_PROMPT
+            ).strip()
+        except Exception as e:
+            logger.error(f"Error summarizing thread {thread_state.thread_ts}: {e}")
+            return False
+
+        if not summary:
+            return False
+
+        thread_state.summary = summary
+        thread_state.turns = thread_state.turns[boundary:]
+        logger.info(
+            f"Summarized {len(compacted_turns)} turns of thread {thread_state.thread_ts}, "
+            f"{len(thread_state.turns)} turns kept verbatim"
+        )
+        return True
+
+    def _build_prompt(self, previous_summary, turns):
+        lines = []
+        for turn in turns:
+            speaker = "Assistant" if turn["role"] == "assistant" else "User"
+            text = turn["text"]
+            file_names = [file.get("name", "file") for file in turn["files"]]
+            if file_names:
+                text += f" [Attached: {', '.join(file_names)}]"
+            lines.append(f"{speaker}: {text}")
+
+        new_messages = "\n".join(lines)
+        return (
+            f"<summary>\n{previous_summary or ''}\n</summary>\n\n"
+            f"<new_messages>\n{new_messages}\n</new_messages>"
+        )
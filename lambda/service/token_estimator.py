@@ -0,0 +1,85 @@
+import hashlib
+import io
+from config import (
+    TOKEN_ESTIMATE_CACHE_MAX_ENTRIES,
+    TOKEN_ESTIMATE_CACHE_TTL_SECONDS,
+)
+from service.ttl_cache import TTLCache
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, images get a fixed estimate without it
+    Image = None
+
+# Rough number of characters per token of English text
+CHARS_PER_TOKEN = 4
+# Images are billed at about width * height / 750 tokens after the model downscales them
+IMAGE_PIXELS_PER_TOKEN = 750
+MAX_IMAGE_TOKENS = 1600
+# Compressed document formats hold more bytes per token than plain text
+BINARY_DOCUMENT_BYTES_PER_TOKEN = 16
+BINARY_DOCUMENT_TYPES = {"pdf", "doc", "docx", "xls", "xlsx"}
+VIDEO_TOKENS = 10000
+
+class TokenEstimator:
+    """
+    Estimates how many input tokens Converse messages will use.
+
+    The estimates are deliberately rough; they only need to be good enough to keep a
+    request inside the model's context window. Estimates for image and document blocks
+    are cached by content digest, since the same attachments are sent again on every
+    reply in a thread.
+    """
+    # Shared by every estimator in the container
+    _cache = TTLCache(
+        maxsize=TOKEN_ESTIMATE_CACHE_MAX_ENTRIES,
+        ttl_seconds=TOKEN_ESTIMATE_CACHE_TTL_SECONDS
+    )
+
+    def estimate_text(self, text):
+        """Estimate the tokens of a string."""
+        return len(text or "") // CHARS_PER_TOKEN + 1
+
+    def estimate_message(self, message):
+        """Estimate the tokens of a Converse message."""
+        return sum(self.estimate_block(block) for block in message["content"])
+
+    def estimate_block(self, block):
+        """Estimate the tokens of a Converse content block."""
+        if "text" in block:
+            return self.estimate_text(block["text"])
+        for block_type in ("image", "document", "video"):
+            if block_type in block:
+                content = block[block_type]["source"]["bytes"]
+                format_type = block[block_type]["format"]
+                cache_key = (block_type, format_type, hashlib.blake2b(content, digest_size=16).digest())
+                return self._cache.get_or_load(
+                    cache_key,
+                    lambda: self._estimate_binary(block_type, format_type, content)
+                )
+        return 0
+
+    def _estimate_binary(self, block_type, format_type, content):
+        if block_type == "image":
+            return self._estimate_image(content)
+        if block_type == "video":
+            return VIDEO_TOKENS
+        if format_type in BINARY_DOCUMENT_TYPES:
+            return len(content) // BINARY_DOCUMENT_BYTES_PER_TOKEN + 1
+        return len(content) // CHARS_PER_TOKEN + 1
+
+    def _estimate_image(self, content):
+        if Image is None:
+            return MAX_IMAGE_TOKENS
+        try:
+            # Opening only parses the header, the pixels are not decoded
+            with Image.open(io.BytesIO(content)) as image:
+                width, height = image.size
+        except Exception:
+            return MAX_IMAGE_TOKENS
+        return min(width * height // IMAGE_PIXELS_PER_TOKEN + 1, MAX_IMAGE_TOKENS)
+
+    @classmethod
+    def clear_cache(cls):
+        """Clear the shared estimate cache."""
+        cls._cache.clear()
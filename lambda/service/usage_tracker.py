@@ -0,0 +1,244 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from decimal import Decimal
+from botocore.exceptions import ClientError
+from config import (
+    logger,
+    USAGE_TABLE_NAME,
+    USAGE_COUNTER_SHARDS,
+    USAGE_WINDOW_SECONDS,
+    USAGE_TTL_SECONDS,
+    USAGE_RECORD_POOL_SIZE,
+    USAGE_RECORD_WAIT_SECONDS,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_CAPACITY_TOKENS,
+    RATE_LIMIT_REFILL_TOKENS_PER_SECOND,
+)
+from service.shared_clients import SharedClients
+
+@dataclass(frozen=True)
+class UsageAllowance:
+    """Whether a user may start a request, and if not, when to try again."""
+    allowed: bool
+    retry_after_seconds: float = 0.0
+
+class UsageTracker:
+    """
+    Persists token usage per user and time window, and limits it with a token bucket.
+
+    Usage counters are updated with atomic ADD expressions. Each window of a user is
+    split over USAGE_COUNTER_SHARDS items, and every update picks a shard at random,
+    so one busy user does not turn a single item into a hot key. Reading the usage of
+    a window sums its shards.
+
+    The token bucket of a user holds up to RATE_LIMIT_CAPACITY_TOKENS and refills at
+    RATE_LIMIT_REFILL_TOKENS_PER_SECOND. Its item stores the tokens consumed since
+    refilled_at, and the tokens a reply used are added with an atomic ADD after it
+    finishes, so concurrent replies never overwrite each other. The refill is computed
+    when the bucket is checked, and credited back against the consumed tokens with a
+    relative update, conditional on refilled_at, so it is only credited once. The bucket
+    can go negative, and the user is refused until it has refilled above zero.
+    DynamoDB errors never block a request.
+    """
+    # Usage is written on these threads, so recording it never delays the reply
+    _executor = ThreadPoolExecutor(
+        max_workers=USAGE_RECORD_POOL_SIZE,
+        thread_name_prefix="usage"
+    )
+    _pending = set()
+    _pending_lock = threading.Lock()
+
+    def __init__(self, table_name=USAGE_TABLE_NAME):
+        self.table_name = table_name
+        self._table = None
+
+    @property
+    def table(self):
+        """Lazy initialization of DynamoDB table."""
+        if self._table is None:
+            self._table = SharedClients.dynamodb().Table(self.table_name)
+        return self._table
+
+    @classmethod
+    def wait_for_pending(cls, timeout=USAGE_RECORD_WAIT_SECONDS):
+        """
+        Wait for usage that is being recorded in the background.
+
+        Called once a reply has been delivered, so the invocation does not end, and
+        the container freeze, while usage is still being written.
+
+        Args:
+            timeout (float, optional): The most seconds to wait.
+        """
+        with cls._pending_lock:
+            pending = list(cls._pending)
+        if not pending:
+            return
+        _, not_done = wait(pending, timeout=timeout)
+        if not_done:
+            logger.warning(f"{len(not_done)} usage updates did not finish within {timeout} seconds")
+
+    def check(self, user_id):
+        """
+        Check whether a user has tokens left in their bucket.
+
+        Args:
+            user_id (str): The Slack user ID.
+
+        Returns:
+            UsageAllowance: Whether the request may proceed.
+        """
+        if not (RATE_LIMIT_ENABLED and self.table_name and user_id):
+            return UsageAllowance(allowed=True)
+
+        try:
+            item = self.table.get_item(Key={"usage_key": self._bucket_key(user_id)}).get("Item")
+        except Exception as e:
+            logger.error(f"Error reading usage bucket: {e}")
+            return UsageAllowance(allowed=True)
+        # Buckets are created by the first debit, items written before debits were atomic have no refilled_at
+        if item is None or "refilled_at" not in item:
+            return UsageAllowance(allowed=True)
+
+        now = time.time()
+        consumed = float(item.get("consumed", 0))
+        refill = max(0.0, now - float(item["refilled_at"])) * RATE_LIMIT_REFILL_TOKENS_PER_SECOND
+        self._credit_refill(user_id, item["refilled_at"], min(refill, consumed), now)
+
+        level = RATE_LIMIT_CAPACITY_TOKENS - max(0.0, consumed - refill)
+        if level > 0:
+            return UsageAllowance(allowed=True)
+        return UsageAllowance(allowed=False, retry_after_seconds=-level / RATE_LIMIT_REFILL_TOKENS_PER_SECOND)
+
+    def record(self, user_id, usage):
+        """
+        Add the token usage of a model response to the user's counters and bucket.
+
+        Args:
+            user_id (str): The Slack user ID.
+            usage (dict): The usage of a Converse response, with inputTokens,
+                outputTokens and totalTokens.
+        """
+        if not (self.table_name and user_id):
+            return
+
+        now = time.time()
+        window_start = self._window_start(now)
+        shard = random.randrange(USAGE_COUNTER_SHARDS)
+        try:
+            self.table.update_item(
+                Key={"usage_key": self._counter_key(user_id, window_start, shard)},
+                UpdateExpression=(
+                    "ADD input_tokens :input, output_tokens :output, total_tokens :total, requests :one "
+                    "SET user_id = :user, window_start = :window, expires_at = :expires"
+                ),
+                ExpressionAttributeValues={
+                    ":input": usage.get("inputTokens", 0),
+                    ":output": usage.get("outputTokens", 0),
+                    ":total": usage.get("totalTokens", 0),
+                    ":one": 1,
+                    ":user": user_id,
+                    ":window": window_start,
+                    ":expires": int(now) + USAGE_TTL_SECONDS,
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error recording token usage: {e}")
+
+        if RATE_LIMIT_ENABLED:
+            self._consume(user_id, usage.get("totalTokens", 0), now)
+
+    def record_in_background(self, user_id, usage):
+        """
+        Record usage like record(), on a background thread.
+
+        Args:
+            user_id (str): The Slack user ID.
+            usage (dict): The usage of a Converse response.
+        """
+        if not (self.table_name and user_id):
+            return
+        future = self._executor.submit(self.record, user_id, usage)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._forget)
+
+    @classmethod
+    def _forget(cls, future):
+        with cls._pending_lock:
+            cls._pending.discard(future)
+
+    def get_usage(self, user_id, window_start=None):
+        """
+        Get a user's token usage in a window, summed over its shards.
+
+        Args:
+            user_id (str): The Slack user ID.
+            window_start (int, optional): The start of the window in epoch seconds.
+                Defaults to the current window.
+
+        Returns:
+            dict: The input_tokens, output_tokens, total_tokens and requests of the window.
+        """
+        if window_start is None:
+            window_start = self._window_start(time.time())
+        keys = [
+            {"usage_key": self._counter_key(user_id, window_start, shard)}
+            for shard in range(USAGE_COUNTER_SHARDS)
+        ]
+        response = SharedClients.dynamodb().batch_get_item(RequestItems={self.table_name: {"Keys": keys}})
+
+        totals = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "requests": 0}
+        for item in response.get("Responses", {}).get(self.table_name, []):
+            for name in totals:
+                totals[name] += int(item.get(name, 0))
+        return totals
+
+    def _consume(self, user_id, tokens, now):
+        try:
+            self.table.update_item(
+                Key={"usage_key": self._bucket_key(user_id)},
+                UpdateExpression=(
+                    "ADD consumed :tokens "
+                    "SET refilled_at = if_not_exists(refilled_at, :now), expires_at = :expires"
+                ),
+                ExpressionAttributeValues={
+                    ":tokens": tokens,
+                    ":now": Decimal(str(round(now, 3))),
+                    ":expires": int(now) + USAGE_TTL_SECONDS,
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error updating usage bucket: {e}")
+
+    def _credit_refill(self, user_id, refilled_at, tokens, now):
+        # Tokens consumed concurrently are kept, since the update is relative to the stored value
+        try:
+            self.table.update_item(
+                Key={"usage_key": self._bucket_key(user_id)},
+                UpdateExpression="SET consumed = consumed - :refill, refilled_at = :now",
+                ConditionExpression="refilled_at = :previous",
+                ExpressionAttributeValues={
+                    ":refill": Decimal(str(round(tokens, 3))),
+                    ":now": Decimal(str(round(now, 3))),
+                    ":previous": refilled_at,
+                }
+            )
+        except ClientError as e:
+            # Another check credited the refill first
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                logger.error(f"Error refilling usage bucket: {e}")
+        except Exception as e:
+            logger.error(f"Error refilling usage bucket: {e}")
+
+    def _window_start(self, now):
+        return int(now // USAGE_WINDOW_SECONDS * USAGE_WINDOW_SECONDS)
+
+    def _counter_key(self, user_id, window_start, shard):
+        return f"{user_id}#{window_start}#{shard}"
+
+    def _bucket_key(self, user_id):
+        return f"{user_id}#bucket"
@@ -1,7 +1,55 @@
-import boto3
-from config import logger, DYNAMODB_TABLE_NAME, BEDROCK_MODELS, BedrockModelConfig
+from dataclasses import dataclass, field
+from typing import Optional
+from config import (
+    logger,
+    DYNAMODB_TABLE_NAME,
+    MODEL_REGISTRY,
+    USER_PREFERENCES_CACHE_TTL_SECONDS,
+    USER_PREFERENCES_CACHE_MAX_ENTRIES,
+)
+from service.ttl_cache import TTLCache
+from service.shared_clients import SharedClients
+
+@dataclass(frozen=True)
+class UserPreferences:
+    """A point-in-time snapshot of a user's preferences item."""
+    user_id: str
+    model_id: Optional[str] = None
+    system_prompts: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_item(cls, user_id, item):
+        """Builds a snapshot from a DynamoDB item."""
+        return cls(
+            user_id=user_id,
+            model_id=item.get("model_id"),
+            system_prompts=dict(item.get("system_prompts", {})),
+        )
+
+    def get_system_prompt(self, model_id):
+        """
+        Get the user's system prompt for a specific model, or None if not set.
+
+        Prompts are saved under the model's key, also when model_id is a legacy ARN.
+        Prompts saved before models had keys are stored under the model's ARN, and are
+        used for every model with that ARN until a prompt is saved under its key.
+        """
+        model = MODEL_REGISTRY.get(model_id)
+        if model is None:
+            return self.system_prompts.get(model_id)
+        prompt = self.system_prompts.get(model.key)
+        if prompt is None:
+            prompt = self.system_prompts.get(model.arn)
+        return prompt
 
 class UserPreferencesAccessor:
+    # Shared by every accessor in the container so that a single message only
+    # reads the user's item once, however many components ask for it.
+    _preferences_cache = TTLCache(
+        maxsize=USER_PREFERENCES_CACHE_MAX_ENTRIES,
+        ttl_seconds=USER_PREFERENCES_CACHE_TTL_SECONDS
+    )
+
     def __init__(self):
         self._dynamodb = None
         self._table = None
@@ -10,26 +58,51 @@ class UserPreferencesAccessor:
     def table(self):
         """Lazy initialization of DynamoDB table."""
         if self._table is None:
-            self._dynamodb = boto3.resource("dynamodb")
+            self._dynamodb = SharedClients.dynamodb()
             self._table = self._dynamodb.Table(DYNAMODB_TABLE_NAME)
         return self._table
 
-    def get_user_model(self, user_id):
+    @classmethod
+    def clear_cache(cls):
+        """Forget all cached user preferences."""
+        cls._preferences_cache.clear()
+
+    def get_user_preferences(self, user_id):
         """
-        Get the user's preferred model ID.
+        Get a snapshot of the user's preferences, reading through the shared cache.
 
         Args:
             user_id (str): The Slack user ID.
 
         Returns:
-            str: The user's preferred model ID or None if not set.
+            UserPreferences: The user's preferences. Empty if not set or on error.
         """
+        preferences = self._preferences_cache.get(user_id)
+        if preferences is not None:
+            return preferences
+
         try:
             response = self.table.get_item(Key = {"user_id": user_id})
-            return response.get("Item", {}).get("model_id")
         except Exception as e:
             logger.error(f"Error fetching user preferences: {e}")
-            return None
+            # Errors are not cached so the next request retries the read
+            return UserPreferences(user_id=user_id)
+
+        preferences = UserPreferences.from_item(user_id, response.get("Item", {}))
+        self._preferences_cache.set(user_id, preferences)
+        return preferences
+
+    def get_user_model(self, user_id):
+        """
+        Get the user's preferred model ID.
+
+        Args:
+            user_id (str): The Slack user ID.
+
+        Returns:
+            str: The user's preferred model ID or None if not set.
+        """
+        return self.get_user_preferences(user_id).model_id
 
     def set_user_model(self, user_id, model_id):
         """
@@ -50,23 +123,23 @@ class UserPreferencesAccessor:
             # Update model_id while preserving other attributes
             item["model_id"] = model_id
             
-            # Save back to DynamoDB
+            # Save back to DynamoDB and write through to the cache
             self.table.put_item(Item=item)
+            self._preferences_cache.set(user_id, UserPreferences.from_item(user_id, item))
             return True
         except Exception as e:
             logger.error(f"Error updating user preferences: {e}")
+            self._preferences_cache.invalidate(user_id)
             return False
 
     def get_model_display_name(self, model_id: str) -> str:
         """Get the display name for a given model ID."""
-        for model in BEDROCK_MODELS:
-            if model.arn == model_id:
-                return model.description
-        return model_id
+        model = MODEL_REGISTRY.get(model_id)
+        return model.description if model else model_id
 
     def get_available_models(self) -> list[dict]:
         """Get a list of available models with their IDs and display names."""
-        return [{"id": model.arn, "name": model.description} for model in BEDROCK_MODELS]
+        return [{"id": model.key, "name": model.description} for model in MODEL_REGISTRY.all()]
 
     def get_model_options(self) -> list[dict]:
         """Get a list of model options formatted for Slack's static_select component."""
@@ -76,9 +149,9 @@ class UserPreferencesAccessor:
                     "type": "plain_text",
                     "text": model.description
                 },
-                "value": model.arn
+                "value": model.key
             }
-            for model in BEDROCK_MODELS
+            for model in MODEL_REGISTRY.all()
         ]
 
     def get_user_system_prompt(self, user_id, model_id):
@@ -92,13 +165,7 @@ class UserPreferencesAccessor:
         Returns:
             str: The user's system prompt for the model or None if not set.
         """
-        try:
-            response = self.table.get_item(Key={"user_id": user_id})
-            system_prompts = response.get("Item", {}).get("system_prompts", {})
-            return system_prompts.get(model_id)
-        except Exception as e:
-            logger.error(f"Error fetching user system prompt: {e}")
-            return None
+        return self.get_user_preferences(user_id).get_system_prompt(model_id)
 
     def set_user_system_prompt(self, user_id, model_id, system_prompt):
         """
@@ -118,13 +185,16 @@ class UserPreferencesAccessor:
             item = response.get("Item", {"user_id": user_id})
             system_prompts = item.get("system_prompts", {})
             
-            # Update the system prompt for this model
-            system_prompts[model_id] = system_prompt
+            # Prompts are saved under the model key, even if the preferences still hold an ARN
+            model = MODEL_REGISTRY.get(model_id)
+            system_prompts[model.key if model else model_id] = system_prompt
             item["system_prompts"] = system_prompts
             
-            # Save back to DynamoDB
+            # Save back to DynamoDB and write through to the cache
             self.table.put_item(Item=item)
+            self._preferences_cache.set(user_id, UserPreferences.from_item(user_id, item))
             return True
         except Exception as e:
             logger.error(f"Error updating user system prompt: {e}")
+            self._preferences_cache.invalidate(user_id)
             return False 
\ No newline at end of file
@@ -1,12 +1,27 @@
+import time
+_init_started_at = time.perf_counter()
+
 from slack_bolt import App
 from slack_bolt.adapter.aws_lambda import SlackRequestHandler
 
-from config import logger, SLACK_BOT_TOKEN, SLACK_SIGNING_SECRET
+from config import (
+    logger,
+    SLACK_BOT_TOKEN,
+    SLACK_SIGNING_SECRET,
+    EXECUTION_MODE,
+    CLIENT_PREWARM_ENABLED,
+    REASONING_JOB_QUEUE_URL,
+)
 from handlers.message_handler import MessageHandler
 from handlers.debug_handler import DebugHandler
+from handlers.queue_worker import QueueWorker
 from views.home_tab import HomeTab
 from service.user_preferences_accessor import UserPreferencesAccessor
-from service.bedrock_service import BedrockService
+from service.shared_clients import SharedClients
+from service.log_detail import LogDetail
+from service.job_queue import Job, SQSJobQueue, LANE_REASONING, LANE_STANDARD, lane_for_model
+
+_imports_finished_at = time.perf_counter()
 
 # Initialize the Slack app
 app = App(
@@ -19,19 +34,59 @@ app = App(
 message_handler = MessageHandler()
 home_tab = HomeTab()
 user_preferences = UserPreferencesAccessor()
-bedrock_service = BedrockService()
+job_queue = SQSJobQueue()
+queue_worker = QueueWorker(message_handler, app.client)
 
 def send_ack_to_slack(body, ack):
     """Acknowledge the request within 3 seconds, this is required by Slack."""
     ack()
-    logger.debug(body)
+    if LogDetail.sampled():
+        logger.debug(LogDetail.field(body))
 
 # Message event handlers
 def handle_message(body, say, client):
     message_handler.handle_message(body, say, client)
 
-# Handle message events lazily so we can send an ack to Slack within 3 seconds
-app.event("message")(ack=send_ack_to_slack, lazy=[handle_message])
+def may_need_reply(body):
+    """
+    Whether the bot may reply to a message, decided from the event alone.
+
+    Mentions, DMs and thread replies may need a reply. Whether the bot took part in a
+    thread is only known once its stored state or history is read, after the ack.
+    """
+    event = body["event"]
+    if not event.get("user"):
+        return False
+    if event.get("channel_type") == "im" or event.get("thread_ts"):
+        return True
+    bot_user_ids = [authorization.get("user_id") for authorization in body.get("authorizations") or []]
+    if not bot_user_ids:
+        return "<@" in event.get("text", "")
+    return any(f"<@{bot_user_id}>" in event.get("text", "") for bot_user_id in bot_user_ids)
+
+def message_lane(body):
+    """The execution lane of a message, decided by the model its sender has selected."""
+    return lane_for_model(user_preferences.get_user_model(body["event"]["user"]))
+
+def is_reasoning_message(body):
+    # Preferences are only read for messages the bot may reply to
+    return may_need_reply(body) and message_lane(body) == LANE_REASONING
+
+def enqueue_message(body, ack):
+    """Queue the message for the workers of its lane, Slack retries the event if it cannot be queued."""
+    job_queue.enqueue(Job.from_event_body(body, lane=message_lane(body)))
+    ack()
+
+if EXECUTION_MODE == "queue":
+    # Queue message events the bot may reply to, workers fed by the queue process them in batches
+    app.event("message", matchers=[may_need_reply])(enqueue_message)
+    app.event("message")(send_ack_to_slack)
+else:
+    if REASONING_JOB_QUEUE_URL:
+        # Reasoning requests wait in their own queue, quick replies keep the lazy path
+        app.event("message", matchers=[is_reasoning_message])(enqueue_message)
+    # Handle message events lazily so we can send an ack to Slack within 3 seconds
+    app.event("message")(ack=send_ack_to_slack, lazy=[handle_message])
 
 @app.message(":bug:")
 def handle_debug_message(message, say):
@@ -94,8 +149,24 @@ def handle_save_system_prompt(ack, body, client):
 @app.error
 def custom_error_handler(error, body):
     logger.exception(f"Error: {error}")
-    logger.info(f"Request body: {body}")
+    logger.info(f"Request body: {LogDetail.field(body)}")
+
+# Reused by every invocation in the container
+slack_handler = SlackRequestHandler(app=app)
+
+# Open connections while the init phase runs, before the first event arrives
+if CLIENT_PREWARM_ENABLED:
+    SharedClients.prewarm()
+
+_init_finished_at = time.perf_counter()
+logger.info(
+    f"Cold start: imports took {(_imports_finished_at - _init_started_at) * 1000:.1f} ms, "
+    f"initialization took {(_init_finished_at - _init_started_at) * 1000:.1f} ms in total"
+)
 
 def lambda_handler(event, context):
-    slack_handler = SlackRequestHandler(app=app)
+    # Batches from the job queue arrive through the SQS event source
+    if event.get("Records") and event["Records"][0].get("eventSource") == "aws:sqs":
+        return queue_worker.handle_sqs_event(event)
+
     return slack_handler.handle(event, context)
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+from botocore.exceptions import ClientError
+from service.attachment_cache import AttachmentCache
+
+class TestAttachmentCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = AttachmentCache(cache_dir=self.cache_dir, max_bytes=1024, bucket=None)
+        self.file_info = {"id": "F123", "name": "test.pdf", "size": 7}
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_get_miss(self):
+        self.assertIsNone(self.cache.get(self.file_info))
+
+    def test_put_then_get_from_local_tier(self):
+        # Execute
+        self.cache.put(self.file_info, b"content")
+
+        # Assert
+        self.assertEqual(self.cache.get(self.file_info), b"content")
+        self.assertTrue(os.path.exists(
+            os.path.join(self.cache_dir, "blobs", hashlib.sha256(b"content").hexdigest())
+        ))
+
+    def test_files_without_id_are_not_cached(self):
+        # Execute
+        self.cache.put({"name": "test.pdf"}, b"content")
+
+        # Assert
+        self.assertIsNone(self.cache.get({"name": "test.pdf"}))
+
+    def test_size_mismatch_is_a_miss(self):
+        # Setup
+        self.cache.put(self.file_info, b"content")
+
+        # Execute and Assert
+        self.assertIsNone(self.cache.get({"id": "F123", "size": 100}))
+
+    def test_least_recently_used_blobs_are_evicted_over_budget(self):
+        # Setup
+        first = {"id": "F1"}
+        second = {"id": "F2"}
+        third = {"id": "F3"}
+        self.cache.put(first, b"a" * 400)
+        self.cache.put(second, b"b" * 400)
+        os.utime(os.path.join(self.cache_dir, "blobs", hashlib.sha256(b"a" * 400).hexdigest()), (0, 0))
+
+        # Execute
+        self.cache.put(third, b"c" * 400)
+
+        # Assert
+        self.assertIsNone(self.cache.get(first))
+        self.assertEqual(self.cache.get(second), b"b" * 400)
+        self.assertEqual(self.cache.get(third), b"c" * 400)
+
+    def test_shared_tier_write_and_read_through(self):
+        # Setup
+        mock_s3 = Mock()
+        cache = AttachmentCache(cache_dir=self.cache_dir, max_bytes=1024, bucket="test-bucket")
+        cache._s3 = mock_s3
+        digest = hashlib.sha256(b"content").hexdigest()
+
+        # Execute - put writes to S3
+        cache.put(self.file_info, b"content")
+
+        # Assert
+        mock_s3.put_object.assert_called_once_with(
+            Bucket="test-bucket",
+            Key="attachments/F123",
+            Body=b"content",
+            Metadata={"sha256": digest}
+        )
+
+        # Setup - a cold container with an empty local tier
+        shutil.rmtree(self.cache_dir)
+        body = Mock()
+        body.read.return_value = b"content"
+        mock_s3.get_object.return_value = {"Body": body, "Metadata": {"sha256": digest}}
+
+        # Execute and Assert
+        self.assertEqual(cache.get(self.file_info), b"content")
+        mock_s3.get_object.reset_mock()
+        self.assertEqual(cache.get(self.file_info), b"content")
+        mock_s3.get_object.assert_not_called()
+
+    def test_shared_tier_miss(self):
+        # Setup
+        mock_s3 = Mock()
+        mock_s3.get_object.side_effect = ClientError(
+            error_response={"Error": {"Code": "NoSuchKey"}},
+            operation_name="GetObject"
+        )
+        cache = AttachmentCache(cache_dir=self.cache_dir, max_bytes=1024, bucket="test-bucket")
+        cache._s3 = mock_s3
+
+        # Execute and Assert
+        self.assertIsNone(cache.get(self.file_info))
+
+if __name__ == '__main__':
+    unittest.main()
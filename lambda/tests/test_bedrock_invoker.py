@@ -0,0 +1,115 @@
+import unittest
+from unittest.mock import Mock, patch
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+from service.bedrock_invoker import BedrockInvoker, CircuitBreaker, ModelUnavailableError
+from service.metrics import Metrics
+
+def bedrock_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "Converse")
+
+@patch('service.bedrock_invoker.time.sleep')
+class TestBedrockInvoker(unittest.TestCase):
+    def setUp(self):
+        CircuitBreaker.clear()
+        self.invoker = BedrockInvoker(max_attempts=3, base_delay=0.5, max_delay=8)
+        self.operation = Mock()
+
+    def test_throttling_is_retried_with_jittered_backoff(self, mock_sleep):
+        # Setup
+        self.operation.side_effect = [bedrock_error("ThrottlingException"), EndpointConnectionError(endpoint_url="https://bedrock"), "response"]
+
+        # Execute
+        with patch('service.bedrock_invoker.random.uniform', side_effect=lambda low, high: high) as mock_uniform:
+            result = self.invoker.call(self.operation, modelId="model-a")
+
+        # Assert
+        self.assertEqual(result, "response")
+        self.assertEqual(self.operation.call_count, 3)
+        self.assertEqual([call.args for call in mock_uniform.call_args_list], [(0, 0.5), (0, 1.0)])
+        self.assertEqual([call.args[0] for call in mock_sleep.call_args_list], [0.5, 1.0])
+
+    def test_client_errors_are_not_retried(self, mock_sleep):
+        # Setup
+        self.operation.side_effect = bedrock_error("ValidationException")
+
+        # Execute and Assert
+        with self.assertRaises(ClientError):
+            self.invoker.call(self.operation, modelId="model-a")
+        self.assertEqual(self.operation.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    def test_read_timeouts_are_not_retried(self, mock_sleep):
+        # Setup
+        self.operation.side_effect = ReadTimeoutError(endpoint_url="https://bedrock")
+
+        # Execute and Assert
+        with self.assertRaises(ReadTimeoutError):
+            self.invoker.call(self.operation, modelId="model-a")
+        self.assertEqual(self.operation.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    def test_gives_up_after_max_attempts(self, mock_sleep):
+        # Setup
+        self.operation.side_effect = bedrock_error("ServiceUnavailableException")
+
+        # Execute and Assert
+        with self.assertRaises(ClientError):
+            self.invoker.call(self.operation, modelId="model-a")
+        self.assertEqual(self.operation.call_count, 3)
+
+    def test_backoff_is_recorded(self, mock_sleep):
+        # Setup
+        recorded = []
+        sink = lambda name, seconds: recorded.append((name, seconds))
+        Metrics.add_sink(sink)
+        self.operation.side_effect = [bedrock_error("ThrottlingException"), "response"]
+
+        # Execute
+        try:
+            with patch('service.bedrock_invoker.random.uniform', return_value=0.25):
+                self.invoker.call(self.operation, modelId="model-a")
+        finally:
+            Metrics.remove_sink(sink)
+
+        # Assert
+        self.assertEqual(recorded, [("bedrock_backoff", 0.25)])
+
+    def test_open_circuit_fails_fast_until_reset(self, mock_sleep):
+        # Setup
+        invoker = BedrockInvoker(max_attempts=1)
+        self.operation.side_effect = bedrock_error("ServiceUnavailableException")
+        breaker = CircuitBreaker(model_id="model-a", failure_threshold=2, reset_seconds=30)
+        CircuitBreaker._breakers["model-a"] = breaker
+        for _ in range(2):
+            with self.assertRaises(ClientError):
+                invoker.call(self.operation, modelId="model-a")
+        self.operation.reset_mock()
+
+        # Execute and Assert
+        with self.assertRaises(ModelUnavailableError):
+            invoker.call(self.operation, modelId="model-a")
+        self.operation.assert_not_called()
+
+        # Other models are not affected
+        self.operation.side_effect = None
+        self.operation.return_value = "response"
+        self.assertEqual(invoker.call(self.operation, modelId="model-b"), "response")
+
+    def test_successful_trial_call_closes_circuit(self, mock_sleep):
+        # Setup
+        breaker = CircuitBreaker(model_id="model-a", failure_threshold=1, reset_seconds=30)
+        CircuitBreaker._breakers["model-a"] = breaker
+        with patch('service.bedrock_invoker.time.monotonic', return_value=100.0):
+            breaker.record_failure()
+
+        # Execute
+        with patch('service.bedrock_invoker.time.monotonic', return_value=131.0):
+            self.operation.return_value = "response"
+            result = self.invoker.call(self.operation, modelId="model-a")
+
+        # Assert
+        self.assertEqual(result, "response")
+        self.assertEqual(breaker.allow(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
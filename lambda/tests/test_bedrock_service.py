@@ -1,22 +1,26 @@
+import threading
 import unittest
 from unittest.mock import Mock, patch
 from botocore.exceptions import ClientError
 from service.bedrock_service import BedrockService
-from config import BedrockModelConfig
+from service.bedrock_invoker import CircuitBreaker
+from config import BedrockModelConfig, ModelRegistry
+from service.user_preferences_accessor import UserPreferences
+from service.context_window_manager import ContextWindowExceededError
 
 TEST_MODEL_ID = "test.model.id"
 ALTERNATE_MODEL_ID = "alternate.model.id"
 SONNET_REASONING_MODEL_ID = "arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.anthropic.claude-3-7-sonnet-20250219-v1:0"
 
 class TestBedrockService(unittest.TestCase):
-    @patch('boto3.client')
     @patch('service.bedrock_service.UserPreferencesAccessor')
-    def setUp(self, mock_prefs, mock_boto3_client):
+    def setUp(self, mock_prefs):
         self.mock_client = Mock()
-        mock_boto3_client.return_value = self.mock_client
         self.mock_prefs = mock_prefs
         self.mock_prefs_instance = mock_prefs.return_value
         self.service = BedrockService()
+        self.service._client = self.mock_client
+        CircuitBreaker.clear()
         self.test_messages = [
             {
                 "role": "user", 
@@ -38,13 +42,13 @@ class TestBedrockService(unittest.TestCase):
         }
 
     @patch('service.bedrock_service.DEFAULT_BEDROCK_MODEL_ID', TEST_MODEL_ID)
-    @patch('service.bedrock_service.BEDROCK_MODELS', [
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
         BedrockModelConfig(
             arn=TEST_MODEL_ID,
             description="Test Model",
             default_system_prompt="You are Test Model. The current time is {datetime}."
         )
-    ])
+    ]))
     def test_should_use_model_specific_system_prompt(self):
         # Setup
         self.mock_client.converse = Mock(return_value=self.mock_response)
@@ -71,13 +75,13 @@ class TestBedrockService(unittest.TestCase):
         self.assertIn("UTC", call_args.kwargs['system'][0]['text'])
 
     @patch('service.bedrock_service.DEFAULT_BEDROCK_MODEL_ID', TEST_MODEL_ID)
-    @patch('service.bedrock_service.BEDROCK_MODELS', [
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
         BedrockModelConfig(
             arn=TEST_MODEL_ID,
             description="Test Model",
             default_system_prompt=""  # Empty default prompt
         )
-    ])
+    ]))
     def test_should_use_fallback_system_prompt_when_no_model_default(self):
         # Setup
         self.mock_client.converse = Mock(return_value=self.mock_response)
@@ -130,6 +134,129 @@ class TestBedrockService(unittest.TestCase):
         self.assertNotIn("{datetime}", system_prompt)
 
     @patch('service.bedrock_service.DEFAULT_BEDROCK_MODEL_ID', TEST_MODEL_ID)
+    def test_should_use_system_prompt_from_preferences_snapshot(self):
+        # Setup
+        self.mock_client.converse = Mock(return_value=self.mock_response)
+        preferences = UserPreferences(
+            user_id="test_user",
+            model_id=TEST_MODEL_ID,
+            system_prompts={TEST_MODEL_ID: "Snapshot prompt"}
+        )
+
+        # Execute
+        self.service.invoke_model(self.test_messages, user_id="test_user", preferences=preferences)
+
+        # Assert
+        call_args = self.mock_client.converse.call_args
+        self.assertEqual(call_args.kwargs['system'][0]['text'], "Snapshot prompt")
+        self.mock_prefs_instance.get_user_system_prompt.assert_not_called()
+
+    @patch('service.bedrock_service.DEFAULT_BEDROCK_MODEL_ID', TEST_MODEL_ID)
+    def test_should_prefer_explicit_system_prompt(self):
+        # Setup
+        self.mock_client.converse = Mock(return_value=self.mock_response)
+        preferences = UserPreferences(user_id="U123", system_prompts={TEST_MODEL_ID: "Custom prompt"})
+
+        # Execute
+        self.service.invoke_model(
+            self.test_messages,
+            model_id=TEST_MODEL_ID,
+            preferences=preferences,
+            system_prompt="Summarize"
+        )
+
+        # Assert
+        call_args = self.mock_client.converse.call_args
+        self.assertEqual(call_args.kwargs["system"], [{"text": "Summarize"}])
+
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
+        BedrockModelConfig(
+            arn=TEST_MODEL_ID,
+            description="Test Model",
+            default_system_prompt="The current date is {datetime}.",
+            supports_prompt_caching=True
+        )
+    ]))
+    def test_should_add_cache_points_for_caching_models(self):
+        # Setup
+        self.mock_client.converse = Mock(return_value=self.mock_response)
+        messages = [
+            {"role": "user", "content": [{"text": "Question"}]},
+            {"role": "assistant", "content": [{"text": "Answer"}]},
+            {"role": "user", "content": [{"text": "Follow up"}]}
+        ]
+
+        # Execute
+        self.service.invoke_model(messages, model_id=TEST_MODEL_ID)
+
+        # Assert
+        call_args = self.mock_client.converse.call_args
+        system = call_args.kwargs["system"]
+        self.assertEqual(system[1], {"cachePoint": {"type": "default"}})
+        self.assertRegex(system[0]["text"], r"^The current date is \d{4}-\d{2}-\d{2} UTC\.$")
+        sent_messages = call_args.kwargs["messages"]
+        self.assertEqual(sent_messages[1]["content"][-1], {"cachePoint": {"type": "default"}})
+        self.assertEqual(sent_messages[2], messages[2])
+        # The caller's messages are not modified
+        self.assertEqual(len(messages[1]["content"]), 1)
+
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
+        BedrockModelConfig(arn=TEST_MODEL_ID, description="Test Model")
+    ]))
+    def test_should_not_add_cache_points_for_other_models(self):
+        # Setup
+        self.mock_client.converse = Mock(return_value=self.mock_response)
+
+        # Execute
+        self.service.invoke_model(self.test_messages, model_id=TEST_MODEL_ID)
+
+        # Assert
+        call_args = self.mock_client.converse.call_args
+        self.assertEqual(len(call_args.kwargs["system"]), 1)
+
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
+        BedrockModelConfig(arn=SONNET_REASONING_MODEL_ID, description="Standard", key="standard"),
+        BedrockModelConfig(
+            arn=SONNET_REASONING_MODEL_ID,
+            description="Reasoning",
+            key="reasoning",
+            isReasoningModel=True,
+            max_output_tokens=64000,
+            thinking_budget_tokens=48000
+        )
+    ]))
+    def test_should_resolve_model_keys_sharing_an_arn(self):
+        # Setup
+        self.mock_client.converse = Mock(return_value=self.mock_response)
+
+        # Execute
+        self.service.invoke_model(self.test_messages, model_id="standard")
+        standard_call = self.mock_client.converse.call_args.kwargs
+        self.service.invoke_model(self.test_messages, model_id="reasoning")
+        reasoning_call = self.mock_client.converse.call_args.kwargs
+
+        # Assert
+        self.assertEqual(standard_call["modelId"], SONNET_REASONING_MODEL_ID)
+        self.assertNotIn("additionalModelRequestFields", standard_call)
+        self.assertEqual(reasoning_call["modelId"], SONNET_REASONING_MODEL_ID)
+        self.assertEqual(reasoning_call["additionalModelRequestFields"]["thinking"]["budget_tokens"], 48000)
+
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
+        BedrockModelConfig(arn=TEST_MODEL_ID, description="Test Model", supports_streaming=False)
+    ]))
+    def test_invoke_model_stream_should_fall_back_for_models_without_streaming(self):
+        # Setup
+        self.mock_client.converse = Mock(return_value=self.mock_response)
+        on_text = Mock()
+
+        # Execute
+        result = self.service.invoke_model_stream(self.test_messages, model_id=TEST_MODEL_ID, on_text=on_text)
+
+        # Assert
+        self.assertEqual(result, "Hello there!")
+        self.mock_client.converse_stream.assert_not_called()
+        on_text.assert_not_called()
+
     def test_should_handle_client_error_appropriately(self):
         # Setup
         self.mock_client.converse.side_effect = ClientError(
@@ -141,6 +268,26 @@ class TestBedrockService(unittest.TestCase):
         with self.assertRaises(ClientError):
             self.service.invoke_model(self.test_messages)
 
+    @patch('service.bedrock_service.DEFAULT_BEDROCK_MODEL_ID', TEST_MODEL_ID)
+    @patch('service.bedrock_invoker.time.sleep')
+    def test_should_retry_throttled_requests(self, mock_sleep):
+        # Setup
+        self.mock_client.converse.side_effect = [
+            ClientError(
+                error_response={"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}},
+                operation_name="converse"
+            ),
+            self.mock_response
+        ]
+
+        # Execute
+        result = self.service.invoke_model(self.test_messages)
+
+        # Assert
+        self.assertEqual(result, "Hello there!")
+        self.assertEqual(self.mock_client.converse.call_count, 2)
+        mock_sleep.assert_called_once()
+
     @patch('service.bedrock_service.DEFAULT_BEDROCK_MODEL_ID', TEST_MODEL_ID)
     def test_should_handle_unexpected_errors_appropriately(self):
         # Setup
@@ -177,17 +324,18 @@ class TestBedrockService(unittest.TestCase):
         # Assert
         self.assertEqual(result, "Hello World!")
 
-    @patch('service.bedrock_service.BEDROCK_MODELS', [
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
         BedrockModelConfig(
             arn=SONNET_REASONING_MODEL_ID,
             description="Test Reasoning Model",
-            isReasoningModel=True
+            isReasoningModel=True,
+            max_output_tokens=64000
         ),
         BedrockModelConfig(
             arn="arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0",
             description="Test Non-Reasoning Model"
         )
-    ])
+    ]))
     def test_is_reasoning_model_should_identify_correctly(self):
         # Test with a reasoning model
         self.assertTrue(self.service._is_reasoning_model(SONNET_REASONING_MODEL_ID))
@@ -226,17 +374,18 @@ class TestBedrockService(unittest.TestCase):
         expected_output = "> First thinking paragraph.\n> With multiple lines.\n\n> Second thinking paragraph.\n\nFinal answer"
         self.assertEqual(result, expected_output)
 
-    @patch('service.bedrock_service.BEDROCK_MODELS', [
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
         BedrockModelConfig(
             arn=SONNET_REASONING_MODEL_ID,
             description="Test Reasoning Model",
-            isReasoningModel=True
+            isReasoningModel=True,
+            max_output_tokens=64000
         ),
         BedrockModelConfig(
             arn="arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0",
             description="Test Non-Reasoning Model"
         )
-    ])
+    ]))
     def test_invoke_model_should_add_thinking_config_for_sonnet_reasoning(self):
         # Setup
         self.mock_client.converse = Mock(return_value={
@@ -267,7 +416,7 @@ class TestBedrockService(unittest.TestCase):
         call_args = self.mock_client.converse.call_args
         
         # Check that thinking configuration was added
-        self.assertIn('inferenceConfig', call_args.kwargs)
+        self.assertEqual(call_args.kwargs['inferenceConfig'], {"maxTokens": 64000})
         
         self.assertIn('additionalModelRequestFields', call_args.kwargs)
         self.assertIn('thinking', call_args.kwargs['additionalModelRequestFields'])
@@ -281,12 +430,12 @@ class TestBedrockService(unittest.TestCase):
         # Check that the response was processed correctly
         self.assertEqual(result, "> Thinking process\n\nFinal answer")
 
-    @patch('service.bedrock_service.BEDROCK_MODELS', [
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
         BedrockModelConfig(
             arn="arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0",
             description="Test Non-Reasoning Model"
         )
-    ])
+    ]))
     def test_invoke_model_should_not_add_thinking_config_for_non_reasoning_models(self):
         # Setup
         self.mock_client.converse = Mock(return_value=self.mock_response)
@@ -305,5 +454,229 @@ class TestBedrockService(unittest.TestCase):
         # Check that the response was processed correctly
         self.assertEqual(result, "Hello there!")
 
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
+        BedrockModelConfig(
+            arn=TEST_MODEL_ID,
+            description="Test Model",
+            context_window_tokens=2000,
+            max_output_tokens=500
+        )
+    ]))
+    def test_invoke_model_should_trim_history_to_context_window(self):
+        # Setup
+        self.mock_client.converse = Mock(return_value=self.mock_response)
+        messages = [
+            {"role": "user", "content": [{"text": "old question " * 500}]},
+            {"role": "assistant", "content": [{"text": "old answer"}]},
+            {"role": "user", "content": [{"text": "Hello"}]}
+        ]
+
+        # Execute
+        self.service.invoke_model(messages, model_id=TEST_MODEL_ID)
+
+        # Assert
+        sent_messages = self.mock_client.converse.call_args.kwargs["messages"]
+        self.assertEqual(sent_messages, [messages[-1]])
+
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
+        BedrockModelConfig(
+            arn=TEST_MODEL_ID,
+            description="Test Model",
+            context_window_tokens=2000,
+            max_output_tokens=500
+        )
+    ]))
+    def test_invoke_model_should_reject_oversized_message_before_calling_bedrock(self):
+        # Setup
+        self.mock_client.converse = Mock(return_value=self.mock_response)
+        messages = [{"role": "user", "content": [{"text": "too long " * 1000}]}]
+
+        # Execute and Assert
+        with self.assertRaises(ContextWindowExceededError):
+            self.service.invoke_model(messages, model_id=TEST_MODEL_ID)
+        self.mock_client.converse.assert_not_called()
+
+    @patch('service.bedrock_service.DEFAULT_BEDROCK_MODEL_ID', TEST_MODEL_ID)
+    def test_invoke_model_stream_should_report_partial_output(self):
+        # Setup
+        self.mock_client.converse_stream = Mock(return_value={
+            "stream": [
+                {"messageStart": {"role": "assistant"}},
+                {"contentBlockDelta": {"delta": {"text": "Hello"}, "contentBlockIndex": 0}},
+                {"contentBlockDelta": {"delta": {"text": " there!"}, "contentBlockIndex": 0}},
+                {"contentBlockStop": {"contentBlockIndex": 0}},
+                {"messageStop": {"stopReason": "end_turn"}},
+                {"metadata": {"usage": {"inputTokens": 10, "outputTokens": 20, "totalTokens": 30}}}
+            ]
+        })
+        partial_outputs = []
+
+        # Execute
+        result = self.service.invoke_model_stream(
+            self.test_messages,
+            on_text=lambda render: partial_outputs.append(render())
+        )
+
+        # Assert
+        self.assertEqual(result, "Hello there!")
+        self.assertEqual(partial_outputs, ["Hello", "Hello there!"])
+        call_args = self.mock_client.converse_stream.call_args
+        self.assertEqual(call_args.kwargs['messages'], self.test_messages)
+        self.assertEqual(call_args.kwargs['modelId'], TEST_MODEL_ID)
+
+    @patch('service.bedrock_service.MODEL_REGISTRY', ModelRegistry([
+        BedrockModelConfig(
+            arn=SONNET_REASONING_MODEL_ID,
+            description="Test Reasoning Model",
+            isReasoningModel=True
+        )
+    ]))
+    def test_invoke_model_stream_should_format_reasoning_deltas(self):
+        # Setup
+        self.mock_client.converse_stream = Mock(return_value={
+            "stream": [
+                {"contentBlockDelta": {"delta": {"reasoningContent": {"text": "Thinking "}}, "contentBlockIndex": 0}},
+                {"contentBlockDelta": {"delta": {"reasoningContent": {"text": "process"}}, "contentBlockIndex": 0}},
+                {"contentBlockDelta": {"delta": {"reasoningContent": {"signature": "abc"}}, "contentBlockIndex": 0}},
+                {"contentBlockDelta": {"delta": {"text": "Final answer"}, "contentBlockIndex": 1}},
+                {"messageStop": {"stopReason": "end_turn"}}
+            ]
+        })
+
+        # Execute
+        result = self.service.invoke_model_stream(self.test_messages, model_id=SONNET_REASONING_MODEL_ID)
+
+        # Assert
+        self.assertEqual(result, "> Thinking process\n\nFinal answer")
+        call_args = self.mock_client.converse_stream.call_args
+        self.assertIn('additionalModelRequestFields', call_args.kwargs)
+
+    @patch('service.bedrock_service.DEFAULT_BEDROCK_MODEL_ID', TEST_MODEL_ID)
+    def test_invoke_model_stream_should_handle_client_error_appropriately(self):
+        # Setup
+        self.mock_client.converse_stream.side_effect = ClientError(
+            error_response={"Error": {"Message": "Model not found"}},
+            operation_name="converse_stream"
+        )
+
+        # Execute and Assert
+        with self.assertRaises(ClientError):
+            self.service.invoke_model_stream(self.test_messages)
+
+HEDGED_REGISTRY = ModelRegistry([
+    BedrockModelConfig(arn=TEST_MODEL_ID, description="Primary Model", key="primary", fallback_model="fallback"),
+    BedrockModelConfig(arn=ALTERNATE_MODEL_ID, description="Fallback Model", key="fallback"),
+])
+
+class BlockingStream:
+    """A stream that produces nothing until it is closed."""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        self.closed.wait(timeout=5)
+        raise ConnectionError("Stream closed")
+
+    def close(self):
+        self.closed.set()
+
+def text_stream(text):
+    return {"stream": [
+        {"contentBlockDelta": {"delta": {"text": text}, "contentBlockIndex": 0}},
+        {"messageStop": {"stopReason": "end_turn"}},
+        {"metadata": {"usage": {"inputTokens": 10, "outputTokens": 20, "totalTokens": 30}}}
+    ]}
+
+@patch('service.bedrock_service.MODEL_REGISTRY', HEDGED_REGISTRY)
+@patch('service.bedrock_service.HEDGING_ENABLED', True)
+@patch('service.bedrock_service.HEDGE_FIRST_TOKEN_TIMEOUT_SECONDS', 0.05)
+class TestBedrockServiceHedging(unittest.TestCase):
+    @patch('service.bedrock_service.UserPreferencesAccessor')
+    def setUp(self, mock_prefs):
+        CircuitBreaker.clear()
+        self.mock_client = Mock()
+        self.service = BedrockService()
+        self.service._client = self.mock_client
+        self.messages = [{"role": "user", "content": [{"text": "Hello"}]}]
+
+    def test_fast_primary_model_is_not_hedged(self):
+        # Setup
+        self.mock_client.converse_stream.return_value = text_stream("Primary answer")
+
+        # Execute
+        result = self.service.invoke_model(self.messages, model_id="primary")
+
+        # Assert
+        self.assertEqual(result, "Primary answer")
+        self.mock_client.converse_stream.assert_called_once()
+
+    def test_slow_primary_model_is_cancelled_when_fallback_answers(self):
+        # Setup
+        slow_stream = BlockingStream()
+        self.mock_client.converse_stream.side_effect = lambda **params: (
+            {"stream": slow_stream} if params["modelId"] == TEST_MODEL_ID else text_stream("Fallback answer")
+        )
+        partial_outputs = []
+
+        # Execute
+        result = self.service.invoke_model_stream(
+            self.messages,
+            model_id="primary",
+            on_text=lambda render: partial_outputs.append(render())
+        )
+
+        # Assert
+        self.assertEqual(
+            result,
+            "Fallback answer\n\n_Answered by Fallback Model because Primary Model was slow to respond._"
+        )
+        self.assertEqual(partial_outputs, ["Fallback answer"])
+        self.assertTrue(slow_stream.closed.wait(timeout=1))
+
+    def test_failed_primary_model_is_hedged_without_waiting(self):
+        # Setup
+        def converse_stream(**params):
+            if params["modelId"] == TEST_MODEL_ID:
+                raise ClientError({"Error": {"Code": "ValidationException", "Message": "Bad"}}, "ConverseStream")
+            return text_stream("Fallback answer")
+        self.mock_client.converse_stream.side_effect = converse_stream
+
+        # Execute
+        with patch('service.bedrock_service.HEDGE_FIRST_TOKEN_TIMEOUT_SECONDS', 5):
+            result = self.service.invoke_model(self.messages, model_id="primary")
+
+        # Assert
+        self.assertEqual(
+            result,
+            "Fallback answer\n\n_Answered by Fallback Model because Primary Model failed._"
+        )
+
+    def test_primary_error_is_raised_when_every_model_fails(self):
+        # Setup
+        def converse_stream(**params):
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": params["modelId"]}}, "ConverseStream")
+        self.mock_client.converse_stream.side_effect = converse_stream
+
+        # Execute and Assert
+        with self.assertRaises(ClientError) as context:
+            self.service.invoke_model(self.messages, model_id="primary")
+        self.assertIn(TEST_MODEL_ID, str(context.exception))
+
+    def test_internal_requests_are_not_hedged(self):
+        # Setup
+        self.mock_client.converse.return_value = {
+            "output": {"message": {"content": [{"text": "Summary"}]}},
+            "usage": {"inputTokens": 10, "outputTokens": 20, "totalTokens": 30},
+            "stopReason": "end_turn"
+        }
+
+        # Execute
+        result = self.service.invoke_model(self.messages, model_id="primary", system_prompt="Summarize")
+
+        # Assert
+        self.assertEqual(result, "Summary")
+        self.mock_client.converse_stream.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from config import BedrockModelConfig, ModelRegistry, MODEL_REGISTRY, BEDROCK_MODELS
+
+SHARED_ARN = "arn:aws:bedrock:us-east-1:123456789012:inference-profile/test.model:0"
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.standard = BedrockModelConfig(arn=SHARED_ARN, description="Standard", key="standard")
+        self.reasoning = BedrockModelConfig(
+            arn=SHARED_ARN,
+            description="Reasoning",
+            key="reasoning",
+            isReasoningModel=True
+        )
+        self.registry = ModelRegistry([self.standard, self.reasoning])
+
+    def test_models_sharing_an_arn_are_told_apart_by_key(self):
+        # Execute and Assert
+        self.assertIs(self.registry.get("standard"), self.standard)
+        self.assertIs(self.registry.get("reasoning"), self.reasoning)
+
+    def test_shared_arn_lookup_returns_reasoning_model(self):
+        # Setup - the reasoning variant is configured after the standard one
+        registry = ModelRegistry([self.reasoning, self.standard])
+
+        # Execute and Assert
+        self.assertIs(self.registry.get(SHARED_ARN), self.reasoning)
+        self.assertIs(registry.get(SHARED_ARN), self.reasoning)
+
+    def test_arn_lookup_returns_first_configured_model(self):
+        # Setup
+        other = BedrockModelConfig(arn=SHARED_ARN, description="Other", key="other")
+        registry = ModelRegistry([self.standard, other])
+
+        # Execute and Assert
+        self.assertIs(registry.get(SHARED_ARN), self.standard)
+
+    def test_unknown_model_returns_none(self):
+        # Execute and Assert
+        self.assertIsNone(self.registry.get("unknown"))
+        self.assertIsNone(self.registry.get(None))
+
+    def test_duplicate_keys_are_rejected(self):
+        # Execute and Assert
+        with self.assertRaises(ValueError):
+            ModelRegistry([self.standard, BedrockModelConfig(arn="other", description="Other", key="standard")])
+
+    def test_unknown_fallback_models_are_rejected(self):
+        # Execute and Assert
+        with self.assertRaises(ValueError):
+            ModelRegistry([BedrockModelConfig(arn="other", description="Other", key="other", fallback_model="missing")])
+
+    def test_key_defaults_to_arn(self):
+        # Execute
+        model = BedrockModelConfig(arn="arn:test", description="Test")
+
+        # Assert
+        self.assertEqual(model.key, "arn:test")
+
+    def test_configured_models_have_unique_keys_and_valid_thinking_budgets(self):
+        # Assert
+        self.assertEqual(len(MODEL_REGISTRY.all()), len(BEDROCK_MODELS))
+        for model in MODEL_REGISTRY.all():
+            self.assertLess(model.thinking_budget_tokens, model.max_output_tokens)
+            if model.isReasoningModel:
+                self.assertGreater(model.thinking_budget_tokens, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import io
+import unittest
+from PIL import Image
+from config import BedrockModelConfig
+from service.context_window_manager import ContextWindowManager, ContextWindowExceededError
+from service.token_estimator import TokenEstimator
+
+def make_png(width, height):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height)).save(output, format="PNG")
+    return output.getvalue()
+
+class TestTokenEstimator(unittest.TestCase):
+    def setUp(self):
+        TokenEstimator.clear_cache()
+        self.estimator = TokenEstimator()
+
+    def test_estimate_text(self):
+        # Execute and Assert
+        self.assertEqual(self.estimator.estimate_text("a" * 400), 101)
+        self.assertEqual(self.estimator.estimate_text(None), 1)
+
+    def test_estimate_image_uses_dimensions(self):
+        # Setup
+        block = {"image": {"format": "png", "source": {"bytes": make_png(300, 250)}}}
+
+        # Execute and Assert
+        self.assertEqual(self.estimator.estimate_block(block), 101)
+
+    def test_estimate_large_image_is_capped(self):
+        # Setup
+        block = {"image": {"format": "png", "source": {"bytes": make_png(4000, 3000)}}}
+
+        # Execute and Assert
+        self.assertEqual(self.estimator.estimate_block(block), 1600)
+
+    def test_binary_documents_hold_more_bytes_per_token(self):
+        # Setup
+        pdf_block = {"document": {"name": "a", "format": "pdf", "source": {"bytes": b"x" * 1600}}}
+        txt_block = {"document": {"name": "a", "format": "txt", "source": {"bytes": b"x" * 1600}}}
+
+        # Execute and Assert
+        self.assertEqual(self.estimator.estimate_block(pdf_block), 101)
+        self.assertEqual(self.estimator.estimate_block(txt_block), 401)
+
+class TestContextWindowManager(unittest.TestCase):
+    def setUp(self):
+        TokenEstimator.clear_cache()
+        self.manager = ContextWindowManager()
+        # A budget of 900 message tokens with the default 10% safety margin
+        self.model_config = BedrockModelConfig(
+            arn="test.model.id",
+            description="Test Model",
+            context_window_tokens=1500,
+            max_output_tokens=500
+        )
+
+    def test_messages_that_fit_are_returned_unchanged(self):
+        # Setup
+        messages = [{"role": "user", "content": [{"text": "Hello"}]}]
+
+        # Execute
+        result = self.manager.fit(messages, self.model_config)
+
+        # Assert
+        self.assertIs(result, messages)
+
+    def test_system_prompt_counts_against_budget(self):
+        # Execute
+        budget = self.manager.input_budget(self.model_config, "a" * 400)
+
+        # Assert
+        self.assertEqual(budget, 900 - 101)
+
+    def test_attachments_of_old_messages_are_elided_first(self):
+        # Setup
+        document_text = "<document name=\"notes.txt\">\n" + "x" * 4000 + "\n</document>"
+        messages = [
+            {"role": "user", "content": [
+                {"text": "Please read"},
+                {"text": document_text},
+                {"image": {"format": "png", "source": {"bytes": make_png(10, 10)}}}
+            ]},
+            {"role": "assistant", "content": [{"text": "Done"}]},
+            {"role": "user", "content": [{"text": "Summarize it"}]}
+        ]
+
+        # Execute
+        result = self.manager.fit(messages, self.model_config)
+
+        # Assert
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[0]["content"], [
+            {"text": "Please read"},
+            {"text": "[Document notes.txt omitted] [Image omitted]"}
+        ])
+        self.assertEqual(len(messages[0]["content"]), 3)
+
+    def test_oldest_turns_are_dropped_and_history_starts_with_user(self):
+        # Setup
+        messages = [
+            {"role": "user", "content": [{"text": "x" * 2000}]},
+            {"role": "assistant", "content": [{"text": "y" * 2000}]},
+            {"role": "user", "content": [{"text": "Question"}]},
+            {"role": "assistant", "content": [{"text": "Answer"}]},
+            {"role": "user", "content": [{"text": "Follow up"}]}
+        ]
+
+        # Execute
+        result = self.manager.fit(messages, self.model_config)
+
+        # Assert
+        self.assertEqual(result, messages[2:])
+
+    def test_latest_message_that_does_not_fit_is_rejected(self):
+        # Setup
+        messages = [
+            {"role": "user", "content": [{"text": "Earlier"}]},
+            {"role": "assistant", "content": [{"text": "Reply"}]},
+            {"role": "user", "content": [{"text": "x" * 4000}]}
+        ]
+
+        # Execute and Assert
+        with self.assertRaises(ContextWindowExceededError):
+            self.manager.fit(messages, self.model_config)
+
+if __name__ == '__main__':
+    unittest.main()
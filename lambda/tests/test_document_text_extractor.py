@@ -0,0 +1,85 @@
+import io
+import unittest
+import docx
+import openpyxl
+from service.document_text_extractor import DocumentTextExtractor
+
+class TestDocumentTextExtractor(unittest.TestCase):
+    def setUp(self):
+        DocumentTextExtractor._cache.clear()
+        self.extractor = DocumentTextExtractor()
+        self.file_info = {"id": "F123", "name": "test", "size": 10}
+
+    def test_extract_plain_text_is_normalized(self):
+        # Execute
+        result = self.extractor.extract(self.file_info, b"Hello   world \r\n\r\n\r\n\r\nBye\t", "txt")
+
+        # Assert
+        self.assertEqual(result, "Hello   world\n\nBye")
+
+    def test_extract_keeps_indentation(self):
+        # Setup
+        content = b"# Example\n\n```python\ndef f():\n    return {\n        'a':  1,\n    }\n```\n"
+
+        # Execute
+        result = self.extractor.extract(self.file_info, content, "md")
+
+        # Assert
+        self.assertEqual(result, "# Example\n\n```python\ndef f():\n    return {\n        'a':  1,\n    }\n```")
+
+    def test_extract_html_skips_markup_and_scripts(self):
+        # Setup
+        content = b"<html><head><title>T</title><script>var x;</script></head><body><h1>Title</h1><p>Some <b>bold</b> text</p></body></html>"
+
+        # Execute
+        result = self.extractor.extract(self.file_info, content, "html")
+
+        # Assert
+        self.assertEqual(result, "Title\n\nSome bold text")
+
+    def test_extract_docx(self):
+        # Setup
+        document = docx.Document()
+        document.add_paragraph("First paragraph")
+        document.add_paragraph("Second paragraph")
+        output = io.BytesIO()
+        document.save(output)
+
+        # Execute
+        result = self.extractor.extract(self.file_info, output.getvalue(), "docx")
+
+        # Assert
+        self.assertEqual(result, "First paragraph\nSecond paragraph")
+
+    def test_extract_xlsx(self):
+        # Setup
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = "Data"
+        sheet.append(["name", "value"])
+        sheet.append(["a", 1])
+        output = io.BytesIO()
+        workbook.save(output)
+
+        # Execute
+        result = self.extractor.extract(self.file_info, output.getvalue(), "xlsx")
+
+        # Assert
+        self.assertEqual(result, "# Data\nname\tvalue\na\t1")
+
+    def test_unsupported_or_broken_documents_return_none(self):
+        self.assertIsNone(self.extractor.extract(self.file_info, b"binary", "doc"))
+        self.assertIsNone(self.extractor.extract(self.file_info, b"not a pdf", "pdf"))
+        self.assertIsNone(self.extractor.extract(self.file_info, b"   \n ", "txt"))
+
+    def test_extracted_text_is_cached_per_file_id(self):
+        # Setup
+        self.extractor.extract(self.file_info, b"Cached text", "txt")
+
+        # Execute and Assert
+        self.assertEqual(DocumentTextExtractor().get_cached_text(self.file_info), "Cached text")
+        self.assertEqual(self.extractor.extract(self.file_info, b"Other text", "txt"), "Cached text")
+        self.assertIsNone(self.extractor.get_cached_text({"id": "F456"}))
+
+if __name__ == '__main__':
+    unittest.main()
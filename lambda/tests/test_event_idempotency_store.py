@@ -0,0 +1,66 @@
+import unittest
+from unittest.mock import Mock
+from botocore.exceptions import ClientError
+from service.event_idempotency_store import EventIdempotencyStore
+
+class TestEventIdempotencyStore(unittest.TestCase):
+    def setUp(self):
+        EventIdempotencyStore.clear()
+        self.store = EventIdempotencyStore(table_name="test-table")
+        self.mock_table = Mock()
+        self.store._table = self.mock_table
+
+    def test_first_claim_wins(self):
+        # Execute
+        result = self.store.claim("Ev123")
+
+        # Assert
+        self.assertTrue(result)
+        call_kwargs = self.mock_table.put_item.call_args.kwargs
+        self.assertEqual(call_kwargs["Item"]["event_id"], "Ev123")
+        self.assertIn("expires_at", call_kwargs["Item"])
+        self.assertIn("attribute_not_exists(event_id)", call_kwargs["ConditionExpression"])
+
+    def test_claim_lost_to_another_invocation(self):
+        # Setup
+        self.mock_table.put_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}},
+            "PutItem"
+        )
+
+        # Execute and Assert
+        self.assertFalse(self.store.claim("Ev123"))
+
+    def test_duplicate_in_same_container_skips_dynamodb(self):
+        # Setup
+        self.store.claim("Ev123")
+        self.mock_table.put_item.reset_mock()
+
+        # Execute
+        result = EventIdempotencyStore(table_name="test-table").claim("Ev123")
+
+        # Assert
+        self.assertFalse(result)
+        self.mock_table.put_item.assert_not_called()
+
+    def test_table_errors_fail_open(self):
+        # Setup
+        self.mock_table.put_item.side_effect = ClientError(
+            {"Error": {"Code": "ProvisionedThroughputExceededException", "Message": "Slow down"}},
+            "PutItem"
+        )
+
+        # Execute and Assert
+        self.assertTrue(self.store.claim("Ev123"))
+
+    def test_claims_without_table_are_kept_in_container(self):
+        # Setup
+        store = EventIdempotencyStore(table_name=None)
+
+        # Execute and Assert
+        self.assertTrue(store.claim("Ev123"))
+        self.assertFalse(store.claim("Ev123"))
+        self.assertTrue(store.claim("Ev456"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,20 @@
 import unittest
 from unittest.mock import Mock, patch
-from service.file_service import FileService
+from service.file_service import FileService, FileTooLargeError, FileDownloadTimeoutError
 
 class TestFileService(unittest.TestCase):
     def setUp(self):
         self.service = FileService()
         self.mock_response = Mock()
-        self.mock_response.content = b"test_content"
+        self.mock_response.headers = {"Content-Length": "12"}
+        self.mock_response.iter_content.return_value = [b"test_", b"content"]
+        self.mock_response.__enter__ = Mock(return_value=self.mock_response)
+        self.mock_response.__exit__ = Mock(return_value=False)
 
-    @patch('requests.get')
-    def test_download_file_success(self, mock_get):
+    @patch.object(FileService, 'get_session')
+    def test_download_file_success(self, mock_get_session):
         # Setup
+        mock_get = mock_get_session.return_value.get
         mock_get.return_value = self.mock_response
 
         # Execute
@@ -23,13 +27,27 @@ class TestFileService(unittest.TestCase):
         self.assertEqual(result, b"test_content")
         mock_get.assert_called_once_with(
             "some_url",
-            headers={"Authorization": "Bearer test-token"}
+            headers={"Authorization": "Bearer test-token"},
+            stream=True,
+            timeout=(3.0, 10.0)
         )
 
-    @patch('requests.get')
-    def test_download_file_error(self, mock_get):
+    @patch.object(FileService, 'get_session')
+    def test_download_file_without_content_length(self, mock_get_session):
         # Setup
-        mock_get.side_effect = Exception("Download failed")
+        self.mock_response.headers = {}
+        mock_get_session.return_value.get.return_value = self.mock_response
+
+        # Execute
+        result = self.service.download_file("some_url", {})
+
+        # Assert
+        self.assertEqual(result, b"test_content")
+
+    @patch.object(FileService, 'get_session')
+    def test_download_file_error(self, mock_get_session):
+        # Setup
+        mock_get_session.return_value.get.side_effect = Exception("Download failed")
 
         # Execute and Assert
         with self.assertRaises(Exception):
@@ -38,5 +56,49 @@ class TestFileService(unittest.TestCase):
                 {"Authorization": "Bearer test-token"}
             )
 
+    @patch.object(FileService, 'get_session')
+    def test_download_file_rejects_expected_size_before_request(self, mock_get_session):
+        # Execute and Assert
+        with self.assertRaises(FileTooLargeError):
+            self.service.download_file("some_url", {}, expected_size=100, max_bytes=10)
+        mock_get_session.return_value.get.assert_not_called()
+
+    @patch.object(FileService, 'get_session')
+    def test_download_file_rejects_content_length_before_reading(self, mock_get_session):
+        # Setup
+        self.mock_response.headers = {"Content-Length": "100"}
+        mock_get_session.return_value.get.return_value = self.mock_response
+
+        # Execute and Assert
+        with self.assertRaises(FileTooLargeError):
+            self.service.download_file("some_url", {}, max_bytes=10)
+        self.mock_response.iter_content.assert_not_called()
+
+    @patch.object(FileService, 'get_session')
+    def test_download_file_stops_when_body_exceeds_limit(self, mock_get_session):
+        # Setup
+        self.mock_response.headers = {}
+        self.mock_response.iter_content.return_value = [b"12345", b"67890", b"abcde"]
+        mock_get_session.return_value.get.return_value = self.mock_response
+
+        # Execute and Assert
+        with self.assertRaises(FileTooLargeError):
+            self.service.download_file("some_url", {}, max_bytes=10)
+
+    @patch('service.file_service.FILE_DOWNLOAD_TOTAL_TIMEOUT_SECONDS', 0)
+    @patch('service.file_service.time.monotonic')
+    @patch.object(FileService, 'get_session')
+    def test_download_file_enforces_total_deadline(self, mock_get_session, mock_monotonic):
+        # Setup
+        mock_monotonic.side_effect = [0.0, 1.0]
+        mock_get_session.return_value.get.return_value = self.mock_response
+
+        # Execute and Assert
+        with self.assertRaises(FileDownloadTimeoutError):
+            self.service.download_file("some_url", {})
+
+    def test_session_is_shared(self):
+        self.assertIs(FileService.get_session(), FileService().get_session())
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,123 @@
+import io
+import unittest
+from unittest.mock import patch
+from PIL import Image
+from config import BedrockModelConfig
+from service.image_normalizer import ImageNormalizer
+
+def make_image(size, mode="RGB", format_type="PNG", color=(200, 100, 50), exif=None):
+    image = Image.new(mode, size, color)
+    output = io.BytesIO()
+    if exif is not None:
+        image.save(output, format=format_type, exif=exif)
+    else:
+        image.save(output, format=format_type)
+    return output.getvalue()
+
+class TestImageNormalizer(unittest.TestCase):
+    def setUp(self):
+        ImageNormalizer._cache.clear()
+        self.normalizer = ImageNormalizer()
+        self.model_config = BedrockModelConfig(
+            arn="test.model.id",
+            description="Test Model",
+            max_image_dimension=100,
+            image_output_format="jpeg"
+        )
+
+    def test_large_image_is_downscaled_and_reencoded(self):
+        # Setup
+        content = make_image((400, 200))
+
+        # Execute
+        result, format_type = self.normalizer.normalize(content, "png", self.model_config)
+
+        # Assert
+        self.assertEqual(format_type, "jpeg")
+        with Image.open(io.BytesIO(result)) as image:
+            self.assertEqual(image.size, (100, 50))
+            self.assertEqual(image.format, "JPEG")
+
+    def test_metadata_is_stripped(self):
+        # Setup
+        exif = Image.Exif()
+        exif[0x010F] = "Test Camera"
+        content = make_image((400, 200), format_type="JPEG", exif=exif.tobytes())
+
+        # Execute
+        result, _ = self.normalizer.normalize(content, "jpeg", self.model_config)
+
+        # Assert
+        with Image.open(io.BytesIO(result)) as image:
+            self.assertNotIn(0x010F, image.getexif())
+
+    def test_transparent_image_stays_png(self):
+        # Setup
+        content = make_image((400, 200), mode="RGBA", color=(200, 100, 50, 0))
+
+        # Execute
+        result, format_type = self.normalizer.normalize(content, "png", self.model_config)
+
+        # Assert
+        self.assertEqual(format_type, "png")
+        with Image.open(io.BytesIO(result)) as image:
+            self.assertEqual(image.size, (100, 50))
+
+    def test_small_image_is_kept_when_reencoding_does_not_help(self):
+        # Setup
+        content = make_image((10, 10))
+
+        # Execute
+        result, format_type = self.normalizer.normalize(content, "png", self.model_config)
+
+        # Assert
+        self.assertEqual(result, content)
+        self.assertEqual(format_type, "png")
+
+    def test_small_image_with_metadata_is_always_reencoded(self):
+        # Setup
+        exif = Image.Exif()
+        exif[0x8825] = {0x0001: "N", 0x0002: (52.0, 22.0, 0.0)}
+        exif[0x0112] = 6
+        content = make_image((20, 10), format_type="JPEG", exif=exif.tobytes())
+
+        # Execute
+        result, format_type = self.normalizer.normalize(content, "jpeg", self.model_config)
+
+        # Assert
+        self.assertEqual(format_type, "jpeg")
+        with Image.open(io.BytesIO(result)) as image:
+            self.assertEqual(len(image.getexif()), 0)
+            # Rotated according to the orientation tag
+            self.assertEqual(image.size, (10, 20))
+
+    def test_invalid_image_is_sent_unchanged(self):
+        # Execute
+        result = self.normalizer.normalize(b"not an image", "png", self.model_config)
+
+        # Assert
+        self.assertEqual(result, (b"not an image", "png"))
+
+    def test_disabled_for_model(self):
+        # Setup
+        self.model_config.max_image_dimension = 0
+        content = make_image((400, 200))
+
+        # Execute and Assert
+        self.assertEqual(self.normalizer.normalize(content, "png", self.model_config), (content, "png"))
+
+    def test_result_is_cached_by_content_hash(self):
+        # Setup
+        content = make_image((400, 200))
+        first = self.normalizer.normalize(content, "png", self.model_config)
+
+        # Execute
+        with patch.object(ImageNormalizer, '_normalize') as mock_normalize:
+            second = ImageNormalizer().normalize(content, "png", self.model_config)
+
+        # Assert
+        mock_normalize.assert_not_called()
+        self.assertEqual(first, second)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+from unittest.mock import Mock
+from service.job_queue import Job, SQLiteJobQueue, SQSJobQueue, LANE_REASONING, LANE_STANDARD
+
+def make_job(ts, thread_ts=None, text="Hello", channel="C123", lane=LANE_STANDARD):
+    event = {"user": "U1", "channel": channel, "ts": ts, "text": text}
+    if thread_ts:
+        event["thread_ts"] = thread_ts
+    return Job.from_event_body({"event_id": f"Ev{ts}", "event": event}, lane=lane)
+
+class TestJob(unittest.TestCase):
+    def test_from_event_body_groups_by_thread(self):
+        # Execute
+        parent = make_job("100.000")
+        reply = make_job("100.100", thread_ts="100.000")
+
+        # Assert
+        self.assertEqual(parent.job_id, "Ev100.000")
+        self.assertEqual(parent.group_id, "C123:100.000")
+        self.assertEqual(reply.group_id, "C123:100.000")
+        self.assertFalse(parent.is_thread_reply)
+        self.assertTrue(reply.is_thread_reply)
+        self.assertFalse(make_job("100.200", thread_ts="100.000", text="<@BOT> hi").is_thread_reply)
+
+    def test_json_round_trip(self):
+        # Setup
+        job = make_job("100.000", lane=LANE_REASONING)
+
+        # Execute
+        restored = Job.from_json(job.to_json(), receipt="r1", attempts=2)
+
+        # Assert
+        self.assertEqual((restored.job_id, restored.group_id, restored.body), (job.job_id, job.group_id, job.body))
+        self.assertEqual(restored.lane, LANE_REASONING)
+        self.assertEqual((restored.receipt, restored.attempts), ("r1", 2))
+
+class TestSQSJobQueue(unittest.TestCase):
+    def test_enqueue_uses_thread_as_message_group(self):
+        # Setup
+        queue = SQSJobQueue(queue_url="https://sqs/queue.fifo")
+        queue._sqs = Mock()
+        job = make_job("100.100", thread_ts="100.000")
+
+        # Execute
+        queue.enqueue(job)
+
+        # Assert
+        queue._sqs.send_message.assert_called_once_with(
+            QueueUrl="https://sqs/queue.fifo",
+            MessageBody=job.to_json(),
+            MessageGroupId="C123:100.000",
+            MessageDeduplicationId="Ev100.100"
+        )
+
+    def test_enqueue_routes_reasoning_jobs_to_their_queue(self):
+        # Setup
+        queue = SQSJobQueue(queue_url="https://sqs/queue.fifo", reasoning_queue_url="https://sqs/reasoning.fifo")
+        queue._sqs = Mock()
+
+        # Execute
+        queue.enqueue(make_job("100.000", lane=LANE_REASONING))
+        queue.enqueue(make_job("200.000"))
+
+        # Assert
+        queue_urls = [call.kwargs["QueueUrl"] for call in queue._sqs.send_message.call_args_list]
+        self.assertEqual(queue_urls, ["https://sqs/reasoning.fifo", "https://sqs/queue.fifo"])
+
+    def test_reasoning_jobs_use_standard_queue_without_their_own(self):
+        # Setup
+        queue = SQSJobQueue(queue_url="https://sqs/queue.fifo", reasoning_queue_url=None)
+        queue._sqs = Mock()
+
+        # Execute
+        queue.enqueue(make_job("100.000", lane=LANE_REASONING))
+
+        # Assert
+        self.assertEqual(queue._sqs.send_message.call_args.kwargs["QueueUrl"], "https://sqs/queue.fifo")
+
+class TestSQLiteJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = SQLiteJobQueue(max_attempts=2)
+
+    def test_duplicate_jobs_are_ignored(self):
+        # Execute
+        self.queue.enqueue(make_job("100.000"))
+        self.queue.enqueue(make_job("100.000"))
+
+        # Assert
+        self.assertEqual(len(self.queue), 1)
+
+    def test_groups_with_jobs_in_flight_are_blocked(self):
+        # Setup
+        self.queue.enqueue(make_job("100.000"))
+        self.queue.enqueue(make_job("200.000", channel="C456"))
+        self.queue.enqueue(make_job("100.100", thread_ts="100.000"))
+
+        # Execute
+        first = self.queue.receive(1)
+        second = self.queue.receive(10)
+
+        # Assert
+        self.assertEqual([job.job_id for job in first], ["Ev100.000"])
+        self.assertEqual([job.job_id for job in second], ["Ev200.000"])
+
+        self.queue.ack(first[0])
+        self.assertEqual([job.job_id for job in self.queue.receive(10)], ["Ev100.100"])
+
+    def test_batch_keeps_order_within_group(self):
+        # Setup
+        for ts in ("100.000", "100.100", "100.200"):
+            self.queue.enqueue(make_job(ts, thread_ts="100.000"))
+
+        # Execute
+        jobs = self.queue.receive(10)
+
+        # Assert
+        self.assertEqual([job.job_id for job in jobs], ["Ev100.000", "Ev100.100", "Ev100.200"])
+        self.assertEqual([job.attempts for job in jobs], [1, 1, 1])
+
+    def test_failed_jobs_are_retried_then_dead_lettered(self):
+        # Setup
+        self.queue.enqueue(make_job("100.000"))
+
+        # Execute
+        job = self.queue.receive(1)[0]
+        self.queue.fail(job)
+        retry = self.queue.receive(1)[0]
+        self.queue.fail(retry)
+
+        # Assert
+        self.assertEqual(retry.attempts, 2)
+        self.assertEqual(self.queue.receive(1), [])
+        self.assertEqual([job.job_id for job in self.queue.dead_letters()], ["Ev100.000"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,20 @@
 import unittest
 from unittest.mock import Mock, patch
 from handlers.message_handler import MessageHandler
+from service.slack_metadata_cache import SlackMetadataCache
+from service.user_preferences_accessor import UserPreferences
+from service.thread_conversation_store import InMemoryThreadStoreBackend, ThreadState
+from service.event_idempotency_store import EventIdempotencyStore
+from service.usage_tracker import UsageAllowance
 
 class TestMessageHandler(unittest.TestCase):
     @patch('handlers.message_handler.BedrockService')
     @patch('handlers.message_handler.MessagePreparationHelper')
     @patch('handlers.message_handler.UserPreferencesAccessor') 
     def setUp(self, mock_prefs, mock_message_prep, mock_bedrock):
+        SlackMetadataCache.clear()
+        InMemoryThreadStoreBackend.clear()
+        EventIdempotencyStore.clear()
         self.handler = MessageHandler()
         self.mock_say = Mock()
         self.mock_app_client = Mock()
@@ -20,7 +28,8 @@ class TestMessageHandler(unittest.TestCase):
         self.mock_message_prep_instance = mock_message_prep.return_value
         self.mock_prefs = mock_prefs
         self.mock_prefs_instance = mock_prefs.return_value
-        self.mock_prefs_instance.get_user_model.return_value = "model123"
+        self.preferences = UserPreferences(user_id="USER123", model_id="model123")
+        self.mock_prefs_instance.get_user_preferences.return_value = self.preferences
 
     def test_handle_mention(self):
         # Setup
@@ -46,7 +55,8 @@ class TestMessageHandler(unittest.TestCase):
         self.mock_message_prep_instance.prepare_message.assert_called_once_with(
             "Hello bot",
             [],
-            self.mock_app_client
+            self.mock_app_client,
+            model_id="model123"
         )
         self.mock_bedrock_instance.invoke_model.assert_called_once_with(
             messages=[{
@@ -54,10 +64,86 @@ class TestMessageHandler(unittest.TestCase):
                 "content": [{"text": "Hello bot"}]
             }],
             model_id="model123",
-            user_id="USER123"
+            user_id="USER123",
+            preferences=self.preferences
         )
         self.mock_say.assert_called_once_with("Bot response", thread_ts="123.456")
 
+    def test_redelivered_event_is_processed_once(self):
+        # Setup
+        self.mock_bedrock_instance.invoke_model.return_value = "Bot response"
+        self.mock_message_prep_instance.prepare_message.return_value = {
+            "role": "user",
+            "content": [{"text": "Hello bot"}]
+        }
+        body = {
+            "event_id": "Ev123",
+            "event": {
+                "text": "<@BOT123> Hello bot",
+                "user": "USER123",
+                "ts": "123.456",
+                "files": []
+            }
+        }
+
+        # Execute
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Assert
+        self.mock_message_prep_instance.prepare_message.assert_called_once()
+        self.mock_bedrock_instance.invoke_model.assert_called_once()
+        self.mock_say.assert_called_once()
+
+    def test_messages_the_bot_ignores_are_not_claimed(self):
+        # Setup
+        self.handler.event_idempotency_store = Mock()
+        self.mock_app_client.conversations_replies.return_value = {
+            "messages": [
+                {"user": "USER123", "ts": "123.000", "text": "Hello"},
+                {"user": "USER456", "ts": "123.456", "text": "Hi"}
+            ]
+        }
+        channel_message = {"event": {"text": "Hello all", "user": "USER123", "ts": "123.000", "channel": "C123", "channel_type": "channel"}}
+        thread_reply = {"event": {"text": "Hi", "user": "USER456", "ts": "123.456", "thread_ts": "123.000", "channel": "C123"}}
+
+        # Execute
+        self.handler.handle_message(channel_message, self.mock_say, self.mock_app_client)
+        self.handler.handle_message(thread_reply, self.mock_say, self.mock_app_client)
+
+        # Assert
+        self.handler.event_idempotency_store.claim.assert_not_called()
+        self.mock_say.assert_not_called()
+
+    def test_reply_dependencies_load_only_once_the_bot_replies(self):
+        # Setup
+        self.handler.usage_tracker = Mock()
+        self.handler.usage_tracker.check.return_value = UsageAllowance(allowed=True)
+        self.mock_bedrock_instance.invoke_model.return_value = "Bot response"
+        self.mock_message_prep_instance.prepare_message.return_value = {"role": "user", "content": [{"text": "x"}]}
+        self.mock_app_client.conversations_replies.return_value = {
+            "messages": [
+                {"user": "USER123", "ts": "123.000", "text": "Hello"},
+                {"user": "USER456", "ts": "123.456", "text": "Hi"}
+            ]
+        }
+        channel_message = {"event": {"text": "Hello all", "user": "USER123", "ts": "123.000", "channel": "C123", "channel_type": "channel"}}
+        thread_reply = {"event": {"text": "Hi", "user": "USER456", "ts": "123.456", "thread_ts": "123.000", "channel": "C123"}}
+        thread_mention = {"event": {"text": "<@BOT123> Hi", "user": "USER123", "ts": "123.500", "thread_ts": "123.000", "channel": "C123"}}
+
+        # Execute
+        self.handler.handle_message(channel_message, self.mock_say, self.mock_app_client)
+        self.handler.handle_message(thread_reply, self.mock_say, self.mock_app_client)
+        ignored_history_reads = self.mock_app_client.conversations_replies.call_count
+        self.handler.handle_message(thread_mention, self.mock_say, self.mock_app_client)
+
+        # Assert - only the mention loaded preferences and allowance, and it did not read the history
+        self.assertEqual(ignored_history_reads, 1)
+        self.assertEqual(self.mock_app_client.conversations_replies.call_count, 1)
+        self.mock_prefs_instance.get_user_preferences.assert_called_once_with("USER123")
+        self.handler.usage_tracker.check.assert_called_once_with("USER123")
+        self.mock_say.assert_called_once_with("Bot response", thread_ts="123.500")
+
     def test_handle_direct_message(self):
         # Setup
         self.mock_bedrock_instance.invoke_model.return_value = "Bot response"
@@ -83,7 +169,8 @@ class TestMessageHandler(unittest.TestCase):
         self.mock_message_prep_instance.prepare_message.assert_called_once_with(
             "Hello bot",
             [],
-            self.mock_app_client
+            self.mock_app_client,
+            model_id="model123"
         )
         self.mock_bedrock_instance.invoke_model.assert_called_once_with(
             messages=[{
@@ -91,10 +178,39 @@ class TestMessageHandler(unittest.TestCase):
                 "content": [{"text": "Hello bot"}]
             }],
             model_id="model123",
-            user_id="USER123"
+            user_id="USER123",
+            preferences=self.preferences
         )
         self.mock_say.assert_called_once_with("Bot response", thread_ts="123.456")
 
+    def test_user_over_budget_is_rejected_before_any_work(self):
+        # Setup
+        self.handler.usage_tracker = Mock()
+        self.handler.usage_tracker.check.return_value = UsageAllowance(allowed=False, retry_after_seconds=150)
+
+        body = {
+            "event": {
+                "text": "Hello bot",
+                "user": "USER123",
+                "ts": "123.456",
+                "channel_type": "im",
+                "files": [{"name": "report.pdf", "filetype": "pdf"}]
+            }
+        }
+
+        # Execute
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Assert
+        self.handler.usage_tracker.check.assert_called_once_with("USER123")
+        self.mock_message_prep_instance.prefetch_files.assert_not_called()
+        self.mock_message_prep_instance.prepare_message.assert_not_called()
+        self.mock_bedrock_instance.invoke_model.assert_not_called()
+        self.mock_say.assert_called_once_with(
+            text="You've used up your token budget for now. Please try again in about 3 minutes.",
+            thread_ts="123.456"
+        )
+
     def test_handle_thread_with_files(self):
         # Setup
         self.mock_bedrock_instance.invoke_model.return_value = "Bot response"
@@ -112,10 +228,10 @@ class TestMessageHandler(unittest.TestCase):
 
         self.mock_app_client.conversations_replies.return_value = {
             "messages": [
-                {"user": "USER123", "text": "Check these files", "files": [test_file1]},
-                {"user": "USER123", "text": "And this one too", "files": [test_file2]},
-                {"user": "BOT123", "text": "Looking at them", "files": []},
-                {"user": "USER123", "text": "Thanks!", "files": []}
+                {"user": "USER123", "ts": "123.000", "text": "Check these files", "files": [test_file1]},
+                {"user": "USER123", "ts": "123.100", "text": "And this one too", "files": [test_file2]},
+                {"user": "BOT123", "ts": "123.200", "text": "Looking at them", "files": []},
+                {"user": "USER123", "ts": "123.456", "text": "Thanks!", "files": []}
             ]
         }
 
@@ -145,5 +261,253 @@ class TestMessageHandler(unittest.TestCase):
         self.assertEqual(self.mock_message_prep_instance.prepare_message.call_count, 3)
         self.mock_say.assert_called_once_with("Bot response", thread_ts="123.000")
 
+    def test_handle_thread_prefetches_attachments_of_every_turn(self):
+        # Setup
+        self.mock_bedrock_instance.invoke_model.return_value = "Bot response"
+        self.mock_message_prep_instance.prepare_message.return_value = {"role": "user", "content": [{"text": "x"}]}
+        test_file = {"id": "F1", "name": "test1.txt", "filetype": "txt", "url_private_download": "https://files.slack.com/test1.txt"}
+        self.mock_app_client.conversations_replies.return_value = {
+            "messages": [
+                {"user": "USER123", "ts": "123.000", "text": "Check this file", "files": [test_file]},
+                {"user": "BOT123", "ts": "123.200", "text": "Looking at it"},
+                {"user": "USER123", "ts": "123.456", "text": "Thanks!"}
+            ]
+        }
+
+        body = {
+            "event": {
+                "text": "Thanks!",
+                "user": "USER123",
+                "ts": "123.456",
+                "thread_ts": "123.000",
+                "channel": "C123"
+            }
+        }
+
+        # Execute
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Assert
+        self.mock_message_prep_instance.prefetch_files.assert_called_once_with([test_file], self.mock_app_client)
+        self.mock_say.assert_called_once_with("Bot response", thread_ts="123.000")
+
+    def test_handle_thread_without_bot_reply_prefetches_nothing(self):
+        # Setup
+        self.mock_app_client.conversations_replies.return_value = {
+            "messages": [
+                {"user": "USER123", "ts": "123.000", "text": "Hello", "files": [{"id": "F1", "filetype": "txt"}]},
+                {"user": "USER456", "ts": "123.456", "text": "Hi"}
+            ]
+        }
+
+        body = {
+            "event": {
+                "text": "Hi",
+                "user": "USER456",
+                "ts": "123.456",
+                "thread_ts": "123.000",
+                "channel": "C123"
+            }
+        }
+
+        # Execute
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Assert
+        self.mock_message_prep_instance.prefetch_files.assert_not_called()
+        self.mock_bedrock_instance.invoke_model.assert_not_called()
+        self.mock_say.assert_not_called()
+
+    def test_handle_thread_fetches_only_new_messages_on_later_replies(self):
+        # Setup
+        self.mock_bedrock_instance.invoke_model.return_value = "Bot response"
+        self.mock_message_prep_instance.prepare_message.side_effect = lambda text, files, client, model_id=None: {
+            "role": "user",
+            "content": [{"text": text}]
+        }
+        self.mock_app_client.conversations_replies.return_value = {
+            "messages": [
+                {"user": "USER123", "ts": "123.000", "text": "Question"},
+                {"user": "BOT123", "ts": "123.100", "text": "Answer"},
+                {"user": "USER123", "ts": "123.200", "text": "Follow up"}
+            ]
+        }
+        body = {
+            "event": {
+                "text": "Follow up",
+                "user": "USER123",
+                "ts": "123.200",
+                "thread_ts": "123.000",
+                "channel": "C123"
+            }
+        }
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Execute - the next reply only returns the parent and the messages from the last answer on
+        self.mock_app_client.conversations_replies.return_value = {
+            "messages": [
+                {"user": "USER123", "ts": "123.000", "text": "Question"},
+                {"user": "BOT123", "ts": "123.100", "text": "Answer"},
+                {"user": "USER123", "ts": "123.200", "text": "Follow up"},
+                {"user": "BOT123", "ts": "123.300", "text": "Second answer"},
+                {"user": "USER123", "ts": "123.400", "text": "Thanks"}
+            ]
+        }
+        body["event"]["text"] = "Thanks"
+        body["event"]["ts"] = "123.400"
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Assert
+        self.mock_app_client.conversations_replies.assert_called_with(
+            channel="C123",
+            ts="123.000",
+            limit=200,
+            oldest="123.000"
+        )
+        messages = self.mock_bedrock_instance.invoke_model.call_args.kwargs["messages"]
+        self.assertEqual(
+            [(message["role"], message["content"][0]["text"]) for message in messages],
+            [
+                ("user", "Question"),
+                ("assistant", "Answer"),
+                ("user", "Follow up"),
+                ("assistant", "Second answer"),
+                ("user", "Thanks")
+            ]
+        )
+
+    def test_handle_thread_sends_stored_summary_before_recent_turns(self):
+        # Setup
+        self.mock_bedrock_instance.invoke_model.return_value = "Bot response"
+        self.mock_message_prep_instance.prepare_message.side_effect = lambda text, files, client, model_id=None: {
+            "role": "user",
+            "content": [{"text": text}]
+        }
+        self.handler.thread_store.save(ThreadState(
+            channel="C123",
+            thread_ts="123.000",
+            turns=[
+                {"role": "user", "text": "Recent question", "files": []},
+                {"role": "assistant", "text": "Latest answer", "files": []}
+            ],
+            cursor="123.500",
+            bot_responded=True,
+            summary="Earlier discussion"
+        ))
+        self.mock_app_client.conversations_replies.return_value = {
+            "messages": [{"user": "USER123", "ts": "123.600", "text": "Next question"}]
+        }
+        body = {
+            "event": {
+                "text": "Next question",
+                "user": "USER123",
+                "ts": "123.600",
+                "thread_ts": "123.000",
+                "channel": "C123"
+            }
+        }
+
+        # Execute
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Assert
+        messages = self.mock_bedrock_instance.invoke_model.call_args.kwargs["messages"]
+        self.assertEqual([message["role"] for message in messages], ["user", "assistant", "user", "assistant", "user"])
+        self.assertIn("Earlier discussion", messages[0]["content"][0]["text"])
+
+    def test_bot_identity_is_cached_across_messages(self):
+        # Setup
+        self.mock_bedrock_instance.invoke_model.return_value = "Bot response"
+        self.mock_message_prep_instance.prepare_message.return_value = {
+            "role": "user",
+            "content": [{"text": "Hello bot"}]
+        }
+        body = {
+            "event": {
+                "text": "Hello bot",
+                "user": "USER123",
+                "ts": "123.456",
+                "channel_type": "im",
+                "files": []
+            }
+        }
+
+        # Execute
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Assert
+        self.mock_app_client.auth_test.assert_called_once()
+
+    @patch('handlers.message_handler.SlackMessageStreamer')
+    @patch('handlers.message_handler.STREAMING_RESPONSES_ENABLED', True)
+    def test_handle_direct_message_streaming(self, mock_streamer):
+        # Setup
+        mock_streamer_instance = mock_streamer.return_value
+        self.mock_bedrock_instance.invoke_model_stream.return_value = "Bot response"
+        self.mock_message_prep_instance.prepare_message.return_value = {
+            "role": "user",
+            "content": [{"text": "Hello bot"}]
+        }
+
+        body = {
+            "event": {
+                "text": "Hello bot",
+                "user": "USER123",
+                "ts": "123.456",
+                "channel": "D123",
+                "channel_type": "im",
+                "files": []
+            }
+        }
+
+        # Execute
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Assert
+        mock_streamer.assert_called_once_with(self.mock_app_client, "D123", "123.456")
+        mock_streamer_instance.start.assert_called_once()
+        self.mock_bedrock_instance.invoke_model_stream.assert_called_once_with(
+            messages=[{
+                "role": "user",
+                "content": [{"text": "Hello bot"}]
+            }],
+            model_id="model123",
+            user_id="USER123",
+            preferences=self.preferences,
+            on_text=mock_streamer_instance.update
+        )
+        mock_streamer_instance.finish.assert_called_once_with("Bot response")
+        self.mock_say.assert_not_called()
+
+    @patch('handlers.message_handler.SlackMessageStreamer')
+    @patch('handlers.message_handler.STREAMING_RESPONSES_ENABLED', True)
+    def test_handle_direct_message_streaming_error(self, mock_streamer):
+        # Setup
+        mock_streamer_instance = mock_streamer.return_value
+        self.mock_bedrock_instance.invoke_model_stream.side_effect = Exception("Model failed")
+        self.mock_message_prep_instance.prepare_message.return_value = {
+            "role": "user",
+            "content": [{"text": "Hello bot"}]
+        }
+
+        body = {
+            "event": {
+                "text": "Hello bot",
+                "user": "USER123",
+                "ts": "123.456",
+                "channel": "D123",
+                "channel_type": "im",
+                "files": []
+            }
+        }
+
+        # Execute
+        self.handler.handle_message(body, self.mock_say, self.mock_app_client)
+
+        # Assert
+        mock_streamer_instance.fail.assert_called_once_with("Error: Model failed")
+        self.mock_say.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,126 @@
+import json
+import threading
+import unittest
+from unittest.mock import Mock, patch
+from service.metrics import Metrics
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.sink = Mock()
+        Metrics.add_sink(self.sink)
+
+    def tearDown(self):
+        Metrics.remove_sink(self.sink)
+
+    def test_stage_records_duration(self):
+        # Execute
+        with Metrics.stage("history_fetch"):
+            pass
+
+        # Assert
+        self.sink.assert_called_once()
+        name, seconds = self.sink.call_args.args
+        self.assertEqual(name, "history_fetch")
+        self.assertGreaterEqual(seconds, 0)
+
+    def test_stage_records_duration_when_block_raises(self):
+        # Execute
+        with self.assertRaises(RuntimeError):
+            with Metrics.stage("model_invocation"):
+                raise RuntimeError("Throttled")
+
+        # Assert
+        self.assertEqual(self.sink.call_args.args[0], "model_invocation")
+
+    def test_sink_errors_do_not_break_recording(self):
+        # Setup
+        failing_sink = Mock(side_effect=Exception("Sink failed"))
+        Metrics.add_sink(failing_sink)
+        self.addCleanup(Metrics.remove_sink, failing_sink)
+
+        # Execute
+        Metrics.record("file_download", 0.25)
+
+        # Assert
+        self.sink.assert_called_once_with("file_download", 0.25)
+        failing_sink.assert_called_once_with("file_download", 0.25)
+
+    def test_removed_sink_is_not_called(self):
+        # Setup
+        Metrics.remove_sink(self.sink)
+
+        # Execute
+        Metrics.record("request", 1.0)
+
+        # Assert
+        self.sink.assert_not_called()
+
+    @patch('service.metrics.METRICS_EMF_ENABLED', True)
+    @patch('builtins.print')
+    def test_request_writes_one_emf_document(self, mock_print):
+        # Setup
+        Metrics._cold_start = False
+
+        # Execute
+        with Metrics.request(ChannelType="im"):
+            Metrics.set_dimension("Model", "claude-3-5-haiku")
+            Metrics.record("file_download", 0.25)
+            Metrics.record("file_download", 0.5)
+            Metrics.count("output_tokens", 120)
+
+        # Assert
+        mock_print.assert_called_once()
+        document = json.loads(mock_print.call_args.args[0])
+        directive = document["_aws"]["CloudWatchMetrics"][0]
+        self.assertEqual(directive["Namespace"], "SlackLLM")
+        self.assertEqual(directive["Dimensions"], [["Model", "ChannelType", "ColdStart"]])
+        self.assertEqual(directive["Metrics"], [
+            {"Name": "file_download", "Unit": "Milliseconds"},
+            {"Name": "output_tokens", "Unit": "Count"},
+        ])
+        self.assertEqual(document["Model"], "claude-3-5-haiku")
+        self.assertEqual(document["ChannelType"], "im")
+        self.assertEqual(document["ColdStart"], "false")
+        self.assertEqual(document["file_download"], [250.0, 500.0])
+        self.assertEqual(document["output_tokens"], 120)
+
+    @patch('service.metrics.METRICS_EMF_ENABLED', True)
+    @patch('builtins.print')
+    def test_only_first_request_is_a_cold_start(self, mock_print):
+        # Setup
+        Metrics._cold_start = True
+
+        # Execute
+        for _ in range(2):
+            with Metrics.request():
+                Metrics.record("request", 1.0)
+
+        # Assert
+        cold_starts = [json.loads(call.args[0])["ColdStart"] for call in mock_print.call_args_list]
+        self.assertEqual(cold_starts, ["true", "false"])
+
+    def test_bound_functions_record_into_the_request_on_other_threads(self):
+        # Execute
+        with Metrics.request() as request_metrics:
+            thread = threading.Thread(target=Metrics.bind(lambda: Metrics.record("history_fetch", 0.1)))
+            thread.start()
+            thread.join()
+            unbound = threading.Thread(target=lambda: Metrics.record("identity_lookup", 0.1))
+            unbound.start()
+            unbound.join()
+
+        # Assert
+        self.assertEqual(set(request_metrics.values), {"history_fetch"})
+
+    @patch('service.metrics.METRICS_EMF_ENABLED', True)
+    @patch('builtins.print')
+    def test_request_without_metrics_writes_nothing(self, mock_print):
+        # Execute
+        with Metrics.request(ChannelType="channel"):
+            pass
+
+        # Assert
+        mock_print.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
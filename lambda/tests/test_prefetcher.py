@@ -0,0 +1,82 @@
+import threading
+import unittest
+from service.prefetcher import Prefetcher, PrefetchTimeoutError
+
+class TestPrefetcher(unittest.TestCase):
+    def test_independent_dependencies_run_concurrently(self):
+        # Setup
+        barrier = threading.Barrier(3, timeout=5)
+        prefetch = Prefetcher()
+
+        # Execute
+        for name in ("a", "b", "c"):
+            prefetch.start(name, lambda name=name: (barrier.wait(), name)[1])
+
+        # Assert
+        self.assertEqual([prefetch.get(name, 5) for name in ("a", "b", "c")], ["a", "b", "c"])
+
+    def test_loader_receives_results_of_its_dependencies(self):
+        # Setup
+        prefetch = Prefetcher()
+        prefetch.start("user", lambda: "USER123")
+        prefetch.start("thread", lambda: ["hello"])
+
+        # Execute
+        prefetch.start("history", lambda thread, user: thread + [user], depends_on=("thread", "user"))
+
+        # Assert
+        self.assertEqual(prefetch.get("history", 5), ["hello", "USER123"])
+        self.assertTrue(prefetch.started("history"))
+        self.assertFalse(prefetch.started("attachments"))
+
+    def test_dependent_loader_waits_for_its_dependency(self):
+        # Setup
+        release = threading.Event()
+        order = []
+        prefetch = Prefetcher()
+        prefetch.start("slow", lambda: (release.wait(5), order.append("slow"))[1])
+        prefetch.start("dependent", lambda _: order.append("dependent"), depends_on=("slow",))
+
+        # Execute
+        with self.assertRaises(PrefetchTimeoutError):
+            prefetch.get("dependent", 0.05)
+        release.set()
+        prefetch.get("dependent", 5)
+
+        # Assert
+        self.assertEqual(order, ["slow", "dependent"])
+
+    def test_failure_propagates_to_dependents(self):
+        # Setup
+        prefetch = Prefetcher()
+        dependent_loader_calls = []
+
+        def fail():
+            raise RuntimeError("Slack is down")
+
+        # Execute
+        prefetch.start("identity", fail)
+        prefetch.start("history", lambda identity: dependent_loader_calls.append(identity), depends_on=("identity",))
+
+        # Assert
+        with self.assertRaisesRegex(RuntimeError, "Slack is down"):
+            prefetch.get("identity", 5)
+        with self.assertRaisesRegex(RuntimeError, "Slack is down"):
+            prefetch.get("history", 5)
+        self.assertEqual(dependent_loader_calls, [])
+
+    def test_get_times_out_per_dependency(self):
+        # Setup
+        release = threading.Event()
+        prefetch = Prefetcher()
+        prefetch.start("slow", lambda: release.wait(5))
+        prefetch.start("fast", lambda: "done")
+
+        # Execute / Assert
+        self.assertEqual(prefetch.get("fast", 5), "done")
+        with self.assertRaisesRegex(PrefetchTimeoutError, "slow did not finish within 0.05 seconds"):
+            prefetch.get("slow", 0.05)
+        release.set()
+
+if __name__ == '__main__':
+    unittest.main()
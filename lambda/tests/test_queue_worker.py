@@ -0,0 +1,214 @@
+import threading
+import unittest
+from unittest.mock import Mock, patch
+from botocore.exceptions import ClientError, ReadTimeoutError
+from handlers.message_handler import MessageHandler
+from handlers.queue_worker import QueueWorker
+from service.event_idempotency_store import EventIdempotencyStore
+from service.job_queue import Job, SQLiteJobQueue, LANE_REASONING, LANE_STANDARD
+from service.slack_metadata_cache import SlackMetadataCache
+from service.user_preferences_accessor import UserPreferences
+
+def make_job(ts, thread_ts=None, text="Hello", channel="C123", lane=LANE_STANDARD):
+    event = {"user": "U1", "channel": channel, "ts": ts, "text": text}
+    if thread_ts:
+        event["thread_ts"] = thread_ts
+    return Job.from_event_body({"event_id": f"Ev{ts}", "event": event}, lane=lane)
+
+def fail_for(event_id):
+    """Builds a handle_message side effect that fails for a single event."""
+    def handle_message(body, say, client, raise_errors=False):
+        if body["event_id"] == event_id:
+            raise Exception("Slack error")
+    return handle_message
+
+class TestQueueWorker(unittest.TestCase):
+    def setUp(self):
+        self.message_handler = Mock()
+        self.app_client = Mock()
+        self.worker = QueueWorker(self.message_handler, self.app_client, concurrency=4)
+
+    def handled_event_ids(self):
+        return [call.args[0]["event_id"] for call in self.message_handler.handle_message.call_args_list]
+
+    def test_consecutive_thread_replies_are_coalesced(self):
+        # Setup
+        jobs = [
+            make_job("100.000"),
+            make_job("100.100", thread_ts="100.000"),
+            make_job("100.200", thread_ts="100.000"),
+            make_job("100.300", thread_ts="100.000")
+        ]
+
+        # Execute
+        failed = self.worker.process_batch(jobs)
+
+        # Assert
+        self.assertEqual(failed, [])
+        self.assertEqual(self.handled_event_ids(), ["Ev100.000", "Ev100.300"])
+
+    def test_failure_returns_rest_of_thread_and_releases_claim(self):
+        # Setup
+        jobs = [
+            make_job("100.000"),
+            make_job("100.100", thread_ts="100.000", text="<@BOT> one"),
+            make_job("200.000", channel="C456")
+        ]
+        self.message_handler.handle_message.side_effect = fail_for("Ev100.000")
+
+        # Execute
+        failed = self.worker.process_batch(jobs)
+
+        # Assert
+        self.assertEqual([job.job_id for job in failed], ["Ev100.000", "Ev100.100"])
+        self.assertIn("Ev200.000", self.handled_event_ids())
+        self.assertNotIn("Ev100.100", self.handled_event_ids())
+        self.message_handler.event_idempotency_store.release.assert_called_once_with("Ev100.000")
+
+    def test_threads_are_processed_concurrently(self):
+        # Setup
+        barrier = threading.Barrier(2, timeout=5)
+        self.message_handler.handle_message.side_effect = lambda body, say, client, raise_errors=False: barrier.wait()
+        jobs = [make_job("100.000"), make_job("200.000", channel="C456")]
+
+        # Execute
+        failed = self.worker.process_batch(jobs)
+
+        # Assert - both jobs reached the barrier together
+        self.assertEqual(failed, [])
+
+    def test_reasoning_jobs_do_not_hold_standard_workers(self):
+        # Setup
+        worker = QueueWorker(self.message_handler, self.app_client, concurrency=1, reasoning_concurrency=1)
+        standard_done = threading.Event()
+        running_reasoning = []
+        overlapping = []
+
+        def handle_message(body, say, client, raise_errors=False):
+            if body["event_id"] == "Ev300.000":
+                standard_done.set()
+                return
+            running_reasoning.append(body["event_id"])
+            overlapping.append(len(running_reasoning) > 1)
+            # Reasoning jobs only finish once the standard job got through
+            standard_done.wait(timeout=5)
+            running_reasoning.remove(body["event_id"])
+
+        self.message_handler.handle_message.side_effect = handle_message
+        jobs = [
+            make_job("100.000", lane=LANE_REASONING),
+            make_job("200.000", channel="C456", lane=LANE_REASONING),
+            make_job("300.000", channel="C789"),
+        ]
+
+        # Execute
+        failed = worker.process_batch(jobs)
+
+        # Assert
+        self.assertEqual(failed, [])
+        self.assertTrue(standard_done.is_set())
+        self.assertEqual(overlapping, [False, False])
+
+    def test_handle_sqs_event_reports_failed_items(self):
+        # Setup
+        job = make_job("100.000")
+        self.message_handler.handle_message.side_effect = Exception("Slack error")
+        event = {"Records": [{
+            "messageId": "m1",
+            "body": job.to_json(),
+            "eventSource": "aws:sqs",
+            "attributes": {"ApproximateReceiveCount": "2"}
+        }]}
+
+        # Execute
+        response = self.worker.handle_sqs_event(event)
+
+        # Assert
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m1"}]})
+
+    @patch('handlers.message_handler.BedrockService')
+    @patch('handlers.message_handler.MessagePreparationHelper')
+    @patch('handlers.message_handler.UserPreferencesAccessor')
+    def test_transient_handler_error_is_retried_until_last_attempt(self, mock_prefs, mock_message_prep, mock_bedrock):
+        # Setup - a real handler whose model is throttled
+        SlackMetadataCache.clear()
+        EventIdempotencyStore.clear()
+        mock_prefs.return_value.get_user_preferences.return_value = UserPreferences(user_id="U1", model_id="model123")
+        mock_message_prep.return_value.prepare_message.return_value = {"role": "user", "content": [{"text": "Hello"}]}
+        mock_bedrock.return_value.invoke_model.side_effect = ClientError(
+            {"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}}, "Converse"
+        )
+        self.app_client.auth_test.return_value = {"user_id": "BOT123"}
+        worker = QueueWorker(MessageHandler(), self.app_client, max_attempts=3)
+        job = make_job("100.000", text="<@BOT123> Hello")
+
+        def sqs_event(attempt):
+            return {"Records": [{
+                "messageId": f"m{attempt}",
+                "body": job.to_json(),
+                "eventSource": "aws:sqs",
+                "attributes": {"ApproximateReceiveCount": str(attempt)}
+            }]}
+
+        # Execute
+        with patch('handlers.queue_worker.Say') as mock_say_class:
+            first = worker.handle_sqs_event(sqs_event(1))
+            last = worker.handle_sqs_event(sqs_event(3))
+
+        # Assert - the retry was not treated as a duplicate, and the last attempt gave up
+        self.assertEqual(first, {"batchItemFailures": [{"itemIdentifier": "m1"}]})
+        self.assertEqual(last, {"batchItemFailures": []})
+        self.assertEqual(mock_bedrock.return_value.invoke_model.call_count, 2)
+        replies = [call.kwargs["text"] for call in mock_say_class.return_value.call_args_list]
+        self.assertIn("Trying again shortly", replies[0])
+        self.assertNotIn("Trying again shortly", replies[1])
+
+    @patch('handlers.message_handler.BedrockService')
+    @patch('handlers.message_handler.MessagePreparationHelper')
+    @patch('handlers.message_handler.UserPreferencesAccessor')
+    def test_read_timeout_is_answered_and_not_retried(self, mock_prefs, mock_message_prep, mock_bedrock):
+        # Setup - a real handler whose model call timed out on the first attempt
+        SlackMetadataCache.clear()
+        EventIdempotencyStore.clear()
+        mock_prefs.return_value.get_user_preferences.return_value = UserPreferences(user_id="U1", model_id="model123")
+        mock_message_prep.return_value.prepare_message.return_value = {"role": "user", "content": [{"text": "Hello"}]}
+        mock_bedrock.return_value.invoke_model.side_effect = ReadTimeoutError(endpoint_url="https://bedrock")
+        self.app_client.auth_test.return_value = {"user_id": "BOT123"}
+        worker = QueueWorker(MessageHandler(), self.app_client, max_attempts=3)
+        job = make_job("100.000", text="<@BOT123> Hello")
+        event = {"Records": [{
+            "messageId": "m1",
+            "body": job.to_json(),
+            "eventSource": "aws:sqs",
+            "attributes": {"ApproximateReceiveCount": "1"}
+        }]}
+
+        # Execute
+        with patch('handlers.queue_worker.Say') as mock_say_class:
+            result = worker.handle_sqs_event(event)
+
+        # Assert - the user got the error and the job was not sent back to the queue
+        self.assertEqual(result, {"batchItemFailures": []})
+        self.assertEqual(mock_bedrock.return_value.invoke_model.call_count, 1)
+        replies = [call.kwargs["text"] for call in mock_say_class.return_value.call_args_list]
+        self.assertEqual(len(replies), 1)
+        self.assertTrue(replies[0].startswith("Error:"))
+        self.assertNotIn("Trying again shortly", replies[0])
+
+    def test_drain_processes_local_queue(self):
+        # Setup
+        queue = SQLiteJobQueue(max_attempts=1)
+        queue.enqueue(make_job("100.000"))
+        queue.enqueue(make_job("200.000", channel="C456"))
+        self.message_handler.handle_message.side_effect = fail_for("Ev200.000")
+
+        # Execute
+        received = self.worker.drain(queue, batch_size=10)
+
+        # Assert
+        self.assertEqual(received, 2)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual([job.job_id for job in queue.dead_letters()], ["Ev200.000"])
+
+if __name__ == '__main__':
+    unittest.main()
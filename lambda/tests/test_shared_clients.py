@@ -0,0 +1,108 @@
+import threading
+import unittest
+from unittest.mock import Mock, patch
+from service.shared_clients import SharedClients
+from service.bedrock_service import BedrockService
+from service.file_service import FileService
+
+class TestSharedClients(unittest.TestCase):
+    def setUp(self):
+        SharedClients.clear()
+
+    def tearDown(self):
+        SharedClients.clear()
+
+    @patch('service.shared_clients.boto3.client')
+    def test_client_is_created_once_and_shared(self, mock_boto3_client):
+        # Setup
+        first_service = BedrockService()
+        second_service = BedrockService()
+
+        # Execute
+        first_client = first_service.client
+        second_client = second_service.client
+
+        # Assert
+        mock_boto3_client.assert_called_once()
+        self.assertEqual(mock_boto3_client.call_args.args, ("bedrock-runtime",))
+        self.assertIs(first_client, second_client)
+
+    @patch('service.shared_clients.boto3.client')
+    def test_bedrock_client_is_tuned_for_long_calls(self, mock_boto3_client):
+        # Execute
+        SharedClients.bedrock_runtime()
+
+        # Assert
+        client_config = mock_boto3_client.call_args.kwargs["config"]
+        self.assertEqual(client_config.retries, {"mode": "adaptive", "max_attempts": 1})
+        self.assertEqual(client_config.read_timeout, 240)
+        self.assertEqual(client_config.max_pool_connections, 25)
+
+    @patch('service.shared_clients.boto3.client')
+    def test_services_do_not_create_clients_until_used(self, mock_boto3_client):
+        # Execute
+        BedrockService()
+
+        # Assert
+        mock_boto3_client.assert_not_called()
+
+    @patch('service.shared_clients.boto3.resource')
+    def test_concurrent_first_use_creates_one_resource(self, mock_boto3_resource):
+        # Setup
+        barrier = threading.Barrier(8, timeout=5)
+        resources = []
+
+        def use_resource():
+            barrier.wait()
+            resources.append(SharedClients.dynamodb())
+
+        # Execute
+        threads = [threading.Thread(target=use_resource) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Assert
+        mock_boto3_resource.assert_called_once_with("dynamodb")
+        self.assertEqual(len({id(resource) for resource in resources}), 1)
+
+    def test_file_service_uses_shared_http_session(self):
+        # Execute / Assert
+        self.assertIs(FileService.get_session(), SharedClients.http_session())
+
+    @patch('service.shared_clients.DYNAMODB_TABLE_NAME', "preferences")
+    @patch('service.shared_clients.boto3.resource')
+    @patch('service.shared_clients.boto3.client')
+    def test_prewarm_opens_every_connection_and_ignores_errors(self, mock_boto3_client, mock_boto3_resource):
+        # Setup
+        mock_boto3_client.return_value.list_async_invokes.side_effect = Exception("AccessDenied")
+        mock_session = Mock()
+        SharedClients._clients["http"] = mock_session
+
+        # Execute
+        timings = SharedClients.prewarm(timeout=5)
+
+        # Assert
+        self.assertEqual(set(timings), {"bedrock-runtime", "dynamodb", "http"})
+        mock_boto3_client.return_value.list_async_invokes.assert_called_once_with(maxResults=1)
+        mock_boto3_resource.return_value.meta.client.describe_table.assert_called_once_with(TableName="preferences")
+        mock_session.head.assert_called_once()
+
+    @patch('service.shared_clients.DYNAMODB_TABLE_NAME', None)
+    @patch('service.shared_clients.boto3.client')
+    def test_prewarm_gives_up_after_timeout(self, mock_boto3_client):
+        # Setup
+        release = threading.Event()
+        mock_boto3_client.return_value.list_async_invokes.side_effect = lambda **kwargs: release.wait(5)
+        SharedClients._clients["http"] = Mock()
+
+        # Execute
+        timings = SharedClients.prewarm(timeout=0.05)
+        release.set()
+
+        # Assert
+        self.assertEqual(set(timings), {"http"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+from unittest.mock import Mock, patch
+from service.slack_message_streamer import SlackMessageStreamer
+
+class TestSlackMessageStreamer(unittest.TestCase):
+    def setUp(self):
+        self.mock_app_client = Mock()
+        self.mock_app_client.chat_postMessage.return_value = {"ts": "200.000"}
+        self.streamer = SlackMessageStreamer(
+            self.mock_app_client,
+            "C123",
+            "100.000",
+            update_interval=1.0,
+            min_chars=5
+        )
+
+    def test_start_posts_placeholder(self):
+        # Execute
+        self.streamer.start()
+
+        # Assert
+        self.mock_app_client.chat_postMessage.assert_called_once_with(
+            channel="C123",
+            thread_ts="100.000",
+            text=SlackMessageStreamer.PLACEHOLDER_TEXT
+        )
+
+    @patch('service.slack_message_streamer.time.monotonic')
+    def test_update_publishes_first_token_immediately_then_batches(self, mock_monotonic):
+        # Setup
+        mock_monotonic.return_value = 0.0
+        self.streamer.start()
+
+        # Execute - first token is shown right away
+        mock_monotonic.return_value = 0.1
+        self.streamer.update(lambda: "He")
+
+        # Execute - too soon and too little new text, skipped
+        mock_monotonic.return_value = 0.5
+        self.streamer.update(lambda: "Hello")
+        mock_monotonic.return_value = 1.5
+        self.streamer.update(lambda: "Hell")
+
+        # Execute - enough time and text, published
+        mock_monotonic.return_value = 2.0
+        self.streamer.update(lambda: "Hello there!")
+
+        # Assert
+        self.assertEqual(
+            [call.kwargs["text"] for call in self.mock_app_client.chat_update.call_args_list],
+            ["He", "Hello there!"]
+        )
+        for call in self.mock_app_client.chat_update.call_args_list:
+            self.assertEqual(call.kwargs["ts"], "200.000")
+            self.assertEqual(call.kwargs["channel"], "C123")
+
+    def test_update_error_is_not_fatal(self):
+        # Setup
+        self.streamer.start()
+        self.mock_app_client.chat_update.side_effect = Exception("ratelimited")
+
+        # Execute and Assert - does not raise
+        self.streamer.update(lambda: "Hello")
+
+    def test_finish_publishes_full_text(self):
+        # Setup
+        self.streamer.start()
+
+        # Execute
+        self.streamer.finish("Complete answer")
+
+        # Assert
+        self.mock_app_client.chat_update.assert_called_once_with(
+            channel="C123",
+            ts="200.000",
+            text="Complete answer"
+        )
+
+    def test_finish_splits_long_output_into_follow_up_messages(self):
+        # Setup
+        self.streamer.MAX_MESSAGE_CHARS = 10
+        self.streamer.start()
+        self.mock_app_client.chat_postMessage.return_value = {"ts": "201.000"}
+
+        # Execute
+        self.streamer.finish("0123456789abcde")
+
+        # Assert
+        self.mock_app_client.chat_update.assert_called_once_with(
+            channel="C123",
+            ts="200.000",
+            text="0123456789"
+        )
+        self.mock_app_client.chat_postMessage.assert_called_with(
+            channel="C123",
+            thread_ts="100.000",
+            text="abcde"
+        )
+
+    def test_fail_replaces_placeholder_when_nothing_was_shown(self):
+        # Setup
+        self.streamer.start()
+
+        # Execute
+        self.streamer.fail("Error: boom")
+
+        # Assert
+        self.mock_app_client.chat_update.assert_called_once_with(
+            channel="C123",
+            ts="200.000",
+            text="Error: boom"
+        )
+
+if __name__ == '__main__':
+    unittest.main()
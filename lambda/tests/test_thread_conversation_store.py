@@ -0,0 +1,185 @@
+import unittest
+from unittest.mock import Mock, patch
+from service.thread_conversation_store import (
+    ThreadState,
+    ThreadConversationStore,
+    InMemoryThreadStoreBackend,
+    DynamoDBThreadStoreBackend,
+)
+
+class FakeTable:
+    """A minimal stand-in for a DynamoDB table keyed by thread_key and chunk."""
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, Item):
+        self.items[(Item["thread_key"], Item["chunk"])] = dict(Item)
+
+    def delete_item(self, Key):
+        self.items.pop((Key["thread_key"], Key["chunk"]), None)
+
+    def query(self, KeyConditionExpression, **kwargs):
+        expression = KeyConditionExpression.get_expression()
+        if expression["operator"] == "AND":
+            thread_key = expression["values"][0].get_expression()["values"][1]
+            min_chunk = expression["values"][1].get_expression()["values"][1]
+        else:
+            thread_key = expression["values"][1]
+            min_chunk = 0
+        items = [
+            item for (key, chunk), item in sorted(self.items.items())
+            if key == thread_key and chunk >= min_chunk
+        ]
+        return {"Items": items}
+
+class TestThreadState(unittest.TestCase):
+    def test_append_messages_groups_consecutive_messages(self):
+        # Setup
+        state = ThreadState(channel="C123", thread_ts="100.000")
+
+        # Execute
+        appended = state.append_messages([
+            {"user": "U1", "ts": "100.000", "text": "Hi", "files": [{"id": "F1", "name": "a.png", "filetype": "png", "url_private_download": "url", "thumb_64": "x"}]},
+            {"user": "U1", "ts": "100.100", "text": "there"},
+            {"subtype": "channel_join", "ts": "100.150", "text": "joined"},
+            {"user": "BOT", "ts": "100.200", "text": "Hello"}
+        ], "BOT")
+
+        # Assert
+        self.assertEqual(appended, 3)
+        self.assertTrue(state.bot_responded)
+        self.assertEqual(state.cursor, "100.100")
+        self.assertEqual(state.all_turns(), [
+            {"role": "user", "text": "Hi there", "files": [{"id": "F1", "name": "a.png", "filetype": "png", "url_private_download": "url"}]},
+            {"role": "assistant", "text": "Hello", "files": []}
+        ])
+
+    def test_append_messages_skips_messages_at_or_before_cursor(self):
+        # Setup
+        state = ThreadState(channel="C123", thread_ts="100.000")
+        state.append_messages([
+            {"user": "U1", "ts": "100.000", "text": "Hi"},
+            {"user": "BOT", "ts": "100.100", "text": "Hello"}
+        ], "BOT")
+
+        # Execute
+        appended = state.append_messages([
+            {"user": "U1", "ts": "100.000", "text": "Hi"},
+            {"user": "BOT", "ts": "100.100", "text": "Hello"},
+            {"user": "U1", "ts": "100.500", "text": "again"}
+        ], "BOT")
+
+        # Assert
+        self.assertEqual(appended, 2)
+        self.assertEqual([turn["text"] for turn in state.all_turns()], ["Hi", "Hello", "again"])
+
+    def test_latest_bot_reply_and_later_messages_are_read_again(self):
+        # Setup - the reply is still streaming into its placeholder when a follow up arrives
+        state = ThreadState(channel="C123", thread_ts="100.000")
+        state.append_messages([
+            {"user": "U1", "ts": "100.000", "text": "Question"},
+            {"user": "BOT", "ts": "100.100", "text": ":hourglass_flowing_sand: Thinking..."},
+            {"user": "U1", "ts": "100.200", "text": "Follow up"}
+        ], "BOT")
+        stored = state.to_dict()
+
+        # Execute - the next read starts at the cursor and sees the finished reply
+        state = ThreadState.from_dict("C123", "100.000", stored)
+        state.append_messages([
+            {"user": "U1", "ts": "100.000", "text": "Question"},
+            {"user": "BOT", "ts": "100.100", "text": "Answer"},
+            {"user": "U1", "ts": "100.200", "text": "Follow up, edited"}
+        ], "BOT")
+
+        # Assert
+        self.assertEqual(stored["cursor"], "100.000")
+        self.assertEqual(stored["turns"], [{"role": "user", "text": "Question", "files": []}])
+        self.assertEqual(
+            [(turn["role"], turn["text"]) for turn in state.all_turns()],
+            [("user", "Question"), ("assistant", "Answer"), ("user", "Follow up, edited")]
+        )
+
+class TestThreadConversationStore(unittest.TestCase):
+    def setUp(self):
+        InMemoryThreadStoreBackend.clear()
+
+    def test_load_missing_thread_returns_empty_state(self):
+        # Execute
+        state = ThreadConversationStore(InMemoryThreadStoreBackend()).load("C123", "100.000")
+
+        # Assert
+        self.assertEqual(state, ThreadState(channel="C123", thread_ts="100.000"))
+
+    def test_save_and_load_round_trip(self):
+        # Setup
+        store = ThreadConversationStore(InMemoryThreadStoreBackend())
+        state = ThreadState(channel="C123", thread_ts="100.000")
+        state.append_messages([
+            {"user": "U1", "ts": "100.000", "text": "Hi"},
+            {"user": "BOT", "ts": "100.100", "text": "Hello"}
+        ], "BOT")
+
+        # Execute
+        store.save(state)
+
+        # Assert
+        self.assertEqual(store.load("C123", "100.000"), state)
+
+    def test_load_error_returns_empty_state(self):
+        # Setup
+        backend = Mock()
+        backend.load.side_effect = Exception("DynamoDB error")
+
+        # Execute
+        state = ThreadConversationStore(backend).load("C123", "100.000")
+
+        # Assert
+        self.assertEqual(state.turns, [])
+
+class TestDynamoDBThreadStoreBackend(unittest.TestCase):
+    def setUp(self):
+        self.backend = DynamoDBThreadStoreBackend(table_name="test-table")
+        self.table = FakeTable()
+        self.backend._table = self.table
+
+    def test_round_trip_single_chunk(self):
+        # Setup
+        data = {"turns": [{"role": "user", "text": "Hi", "files": []}], "cursor": "100.000", "bot_responded": False}
+
+        # Execute
+        self.backend.save("C123#100.000", data)
+
+        # Assert
+        self.assertEqual(len(self.table.items), 1)
+        self.assertEqual(self.backend.load("C123#100.000"), data)
+
+    @patch('service.thread_conversation_store.THREAD_STORE_CHUNK_BYTES', 64)
+    def test_large_state_is_chunked_and_stale_chunks_removed(self):
+        # Setup - random-looking text that does not compress well
+        text = "".join(chr(33 + (i * 7919) % 90) for i in range(1000))
+        large = {"turns": [{"role": "user", "text": text, "files": []}], "cursor": "1", "bot_responded": True}
+        small = {"turns": [], "cursor": "2", "bot_responded": True}
+
+        # Execute
+        self.backend.save("C123#100.000", large)
+        chunk_count = len(self.table.items)
+        loaded_large = self.backend.load("C123#100.000")
+        self.backend.save("C123#100.000", small)
+
+        # Assert
+        self.assertGreater(chunk_count, 1)
+        self.assertEqual(loaded_large, large)
+        self.assertEqual(len(self.table.items), 1)
+        self.assertEqual(self.backend.load("C123#100.000"), small)
+
+    def test_mismatched_chunk_versions_are_ignored(self):
+        # Setup
+        self.table.put_item(Item={"thread_key": "k", "chunk": 0, "version": "a", "chunk_count": 2, "data": b""})
+        self.table.put_item(Item={"thread_key": "k", "chunk": 1, "version": "b", "data": b""})
+
+        # Execute and Assert
+        self.assertIsNone(self.backend.load("k"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+from unittest.mock import Mock
+from service.thread_history_reader import ThreadHistoryReader
+
+class TestThreadHistoryReader(unittest.TestCase):
+    def setUp(self):
+        self.reader = ThreadHistoryReader(page_size=2)
+        self.app_client = Mock()
+        self.app_client.conversations_replies.side_effect = [
+            {
+                "messages": [
+                    {"user": "U1", "ts": "100.000", "text": "Parent"},
+                    {"user": "U2", "ts": "100.100", "text": "First"}
+                ],
+                "response_metadata": {"next_cursor": "page2"}
+            },
+            {
+                "messages": [
+                    {"user": "U1", "ts": "100.200", "text": "Second"},
+                    {"user": "U2", "ts": "100.300", "text": "Third"}
+                ],
+                "response_metadata": {"next_cursor": ""}
+            }
+        ]
+
+    def test_follows_next_cursor(self):
+        # Execute
+        messages = list(self.reader.iter_messages(self.app_client, "C123", "100.000"))
+
+        # Assert
+        self.assertEqual([m["text"] for m in messages], ["Parent", "First", "Second", "Third"])
+        self.assertEqual(self.app_client.conversations_replies.call_count, 2)
+        self.app_client.conversations_replies.assert_called_with(
+            channel="C123", ts="100.000", limit=2, cursor="page2"
+        )
+
+    def test_pages_are_fetched_lazily(self):
+        # Execute
+        messages = self.reader.iter_messages(self.app_client, "C123", "100.000")
+        first = next(messages)
+
+        # Assert
+        self.assertEqual(first["text"], "Parent")
+        self.assertEqual(self.app_client.conversations_replies.call_count, 1)
+
+    def test_message_budget_keeps_newest_messages(self):
+        # Execute
+        messages = list(self.reader.iter_messages(self.app_client, "C123", "100.000", max_messages=2))
+
+        # Assert
+        self.assertEqual([m["text"] for m in messages], ["Second", "Third"])
+        self.assertEqual(self.app_client.conversations_replies.call_count, 2)
+
+    def test_token_budget_keeps_newest_messages(self):
+        # Setup - each short message is estimated at 2 tokens
+        budget = 2 * 3
+
+        # Execute
+        messages = list(self.reader.iter_messages(self.app_client, "C123", "100.000", max_tokens=budget))
+
+        # Assert
+        self.assertEqual([m["text"] for m in messages], ["First", "Second", "Third"])
+
+    def test_latest_message_is_kept_when_budget_is_exceeded(self):
+        # Setup
+        self.app_client.conversations_replies.side_effect = [{
+            "messages": [{"user": "U1", "ts": f"100.{index:03d}", "text": f"m{index}"} for index in range(12)]
+        }]
+
+        # Execute
+        by_count = list(self.reader.iter_messages(self.app_client, "C123", "100.000", max_messages=5))
+        self.app_client.conversations_replies.side_effect = [{
+            "messages": [
+                {"user": "U1", "ts": "100.000", "text": "Parent"},
+                {"user": "U2", "ts": "100.100", "text": "A long question " * 50}
+            ]
+        }]
+        by_tokens = list(self.reader.iter_messages(self.app_client, "C123", "100.000", max_tokens=10))
+
+        # Assert
+        self.assertEqual([m["text"] for m in by_count], ["m7", "m8", "m9", "m10", "m11"])
+        self.assertEqual([m["ts"] for m in by_tokens], ["100.100"])
+
+    def test_oldest_skips_parent_and_earlier_messages(self):
+        # Execute
+        messages = list(self.reader.iter_messages(self.app_client, "C123", "100.000", oldest="100.100"))
+
+        # Assert
+        self.assertEqual([m["text"] for m in messages], ["Second", "Third"])
+        self.app_client.conversations_replies.assert_any_call(
+            channel="C123", ts="100.000", limit=2, oldest="100.100"
+        )
+
+if __name__ == '__main__':
+    unittest.main()
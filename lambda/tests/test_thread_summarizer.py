@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import Mock
+from service.thread_conversation_store import ThreadState
+from service.thread_summarizer import ThreadSummarizer, SUMMARY_SYSTEM_PROMPT
+
+def make_state(turn_count, summary=None):
+    turns = [
+        {"role": "user" if i % 2 == 0 else "assistant", "text": f"turn {i}", "files": []}
+        for i in range(turn_count)
+    ]
+    return ThreadState(channel="C123", thread_ts="100.000", turns=turns, summary=summary)
+
+class TestThreadSummarizer(unittest.TestCase):
+    def setUp(self):
+        self.bedrock_service = Mock()
+        self.bedrock_service.invoke_model.return_value = " New summary "
+        self.summarizer = ThreadSummarizer(
+            self.bedrock_service,
+            enabled=True,
+            model_id="summary.model",
+            trigger_turns=6,
+            keep_recent_turns=3
+        )
+
+    def test_short_threads_are_not_summarized(self):
+        # Setup
+        state = make_state(6)
+
+        # Execute
+        updated = self.summarizer.update(state)
+
+        # Assert
+        self.assertFalse(updated)
+        self.bedrock_service.invoke_model.assert_not_called()
+
+    def test_disabled_summarizer_does_nothing(self):
+        # Setup
+        self.summarizer.enabled = False
+        state = make_state(10)
+
+        # Execute and Assert
+        self.assertFalse(self.summarizer.update(state))
+        self.bedrock_service.invoke_model.assert_not_called()
+
+    def test_older_turns_are_folded_into_summary(self):
+        # Setup
+        state = make_state(8, summary="Old summary")
+        state.turns[0]["files"] = [{"id": "F1", "name": "report.pdf"}]
+
+        # Execute
+        updated = self.summarizer.update(state, user_id="USER123")
+
+        # Assert - the boundary moves forward so the kept turns start with a user turn
+        self.assertTrue(updated)
+        self.assertEqual(state.summary, "New summary")
+        self.assertEqual([turn["text"] for turn in state.turns], ["turn 6", "turn 7"])
+
+        call_kwargs = self.bedrock_service.invoke_model.call_args.kwargs
+        self.assertEqual(call_kwargs["model_id"], "summary.model")
+        self.assertEqual(call_kwargs["user_id"], "USER123")
+        self.assertEqual(call_kwargs["system_prompt"], SUMMARY_SYSTEM_PROMPT)
+        prompt = call_kwargs["messages"][0]["content"][0]["text"]
+        self.assertIn("<summary>\nOld summary\n</summary>", prompt)
+        self.assertIn("User: turn 0 [Attached: report.pdf]", prompt)
+        self.assertIn("Assistant: turn 5", prompt)
+        self.assertNotIn("turn 6", prompt)
+
+    def test_failed_summarization_leaves_state_unchanged(self):
+        # Setup
+        self.bedrock_service.invoke_model.side_effect = Exception("Bedrock error")
+        state = make_state(8)
+
+        # Execute
+        updated = self.summarizer.update(state)
+
+        # Assert
+        self.assertFalse(updated)
+        self.assertIsNone(state.summary)
+        self.assertEqual(len(state.turns), 8)
+
+    def test_summary_messages(self):
+        # Execute and Assert
+        self.assertEqual(self.summarizer.summary_messages(make_state(2)), [])
+        messages = self.summarizer.summary_messages(make_state(2, summary="Earlier"))
+        self.assertEqual([message["role"] for message in messages], ["user", "assistant"])
+        self.assertIn("Earlier", messages[0]["content"][0]["text"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import threading
+import unittest
+from decimal import Decimal
+from unittest.mock import Mock, patch
+from botocore.exceptions import ClientError
+from service.usage_tracker import UsageTracker
+
+USAGE = {"inputTokens": 1200, "outputTokens": 300, "totalTokens": 1500}
+
+class TestUsageTracker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = UsageTracker(table_name="test-usage")
+        self.mock_table = Mock()
+        self.mock_table.get_item.return_value = {}
+        self.tracker._table = self.mock_table
+
+    @patch('service.usage_tracker.RATE_LIMIT_ENABLED', False)
+    @patch('service.usage_tracker.time.time', return_value=7300.0)
+    def test_record_adds_to_a_sharded_counter(self, _):
+        # Execute
+        self.tracker.record("USER123", USAGE)
+
+        # Assert
+        call_kwargs = self.mock_table.update_item.call_args.kwargs
+        user_id, window_start, shard = call_kwargs["Key"]["usage_key"].split("#")
+        self.assertEqual(user_id, "USER123")
+        self.assertEqual(window_start, "7200")
+        self.assertIn(int(shard), range(8))
+        self.assertTrue(call_kwargs["UpdateExpression"].startswith("ADD input_tokens :input"))
+        self.assertEqual(call_kwargs["ExpressionAttributeValues"][":total"], 1500)
+        self.mock_table.put_item.assert_not_called()
+
+    def test_record_without_user_is_not_charged(self):
+        # Execute
+        self.tracker.record(None, USAGE)
+
+        # Assert
+        self.mock_table.update_item.assert_not_called()
+
+    @patch('service.usage_tracker.SharedClients')
+    def test_get_usage_sums_all_shards(self, mock_shared_clients):
+        # Setup
+        mock_shared_clients.dynamodb.return_value.batch_get_item.return_value = {
+            "Responses": {"test-usage": [
+                {"input_tokens": Decimal(100), "output_tokens": Decimal(10), "total_tokens": Decimal(110), "requests": Decimal(1)},
+                {"input_tokens": Decimal(200), "output_tokens": Decimal(20), "total_tokens": Decimal(220), "requests": Decimal(2)},
+            ]}
+        }
+
+        # Execute
+        usage = self.tracker.get_usage("USER123", window_start=3600)
+
+        # Assert
+        request = mock_shared_clients.dynamodb.return_value.batch_get_item.call_args.kwargs["RequestItems"]
+        self.assertEqual(len(request["test-usage"]["Keys"]), 8)
+        self.assertEqual(usage, {"input_tokens": 300, "output_tokens": 30, "total_tokens": 330, "requests": 3})
+
+    @patch('service.usage_tracker.RATE_LIMIT_ENABLED', True)
+    @patch('service.usage_tracker.time.time', return_value=1000.0)
+    def test_record_debits_the_bucket_atomically(self, _):
+        # Execute
+        self.tracker.record("USER123", USAGE)
+
+        # Assert - the bucket is never read, the debit is a single ADD
+        self.mock_table.get_item.assert_not_called()
+        self.mock_table.put_item.assert_not_called()
+        call_kwargs = self.mock_table.update_item.call_args.kwargs
+        self.assertEqual(call_kwargs["Key"], {"usage_key": "USER123#bucket"})
+        self.assertTrue(call_kwargs["UpdateExpression"].startswith("ADD consumed :tokens"))
+        self.assertEqual(call_kwargs["ExpressionAttributeValues"][":tokens"], 1500)
+        self.assertNotIn("ConditionExpression", call_kwargs)
+
+    @patch('service.usage_tracker.RATE_LIMIT_ENABLED', True)
+    @patch('service.usage_tracker.RATE_LIMIT_CAPACITY_TOKENS', 10000)
+    @patch('service.usage_tracker.RATE_LIMIT_REFILL_TOKENS_PER_SECOND', 10.0)
+    @patch('service.usage_tracker.time.time', return_value=1000.0)
+    def test_check_credits_the_refill_once(self, _):
+        # Setup
+        self.mock_table.get_item.return_value = {"Item": {"consumed": Decimal("9000"), "refilled_at": Decimal("900")}}
+
+        # Execute
+        allowance = self.tracker.check("USER123")
+
+        # Assert - 100 seconds refilled 1000 of the 9000 consumed tokens
+        self.assertTrue(allowance.allowed)
+        call_kwargs = self.mock_table.update_item.call_args.kwargs
+        self.assertEqual(call_kwargs["UpdateExpression"], "SET consumed = consumed - :refill, refilled_at = :now")
+        self.assertEqual(call_kwargs["ConditionExpression"], "refilled_at = :previous")
+        self.assertEqual(call_kwargs["ExpressionAttributeValues"][":refill"], Decimal("1000.0"))
+        self.assertEqual(call_kwargs["ExpressionAttributeValues"][":previous"], Decimal("900"))
+
+    @patch('service.usage_tracker.RATE_LIMIT_ENABLED', True)
+    @patch('service.usage_tracker.RATE_LIMIT_CAPACITY_TOKENS', 10000)
+    @patch('service.usage_tracker.RATE_LIMIT_REFILL_TOKENS_PER_SECOND', 10.0)
+    @patch('service.usage_tracker.time.time', return_value=1000.0)
+    def test_check_refill_never_exceeds_capacity(self, _):
+        # Setup - a full bucket that has been idle for a long time
+        self.mock_table.get_item.return_value = {"Item": {"consumed": Decimal("0"), "refilled_at": Decimal("0")}}
+
+        # Execute
+        allowance = self.tracker.check("USER123")
+
+        # Assert - only the idle time is dropped, no tokens are credited beyond full
+        self.assertTrue(allowance.allowed)
+        call_kwargs = self.mock_table.update_item.call_args.kwargs
+        self.assertEqual(call_kwargs["ExpressionAttributeValues"][":refill"], Decimal("0"))
+        self.assertEqual(call_kwargs["ExpressionAttributeValues"][":now"], Decimal("1000.0"))
+
+    @patch('service.usage_tracker.RATE_LIMIT_ENABLED', True)
+    @patch('service.usage_tracker.RATE_LIMIT_CAPACITY_TOKENS', 10000)
+    @patch('service.usage_tracker.RATE_LIMIT_REFILL_TOKENS_PER_SECOND', 10.0)
+    @patch('service.usage_tracker.time.time', return_value=1000.0)
+    def test_check_rejects_an_empty_bucket(self, _):
+        # Setup
+        self.mock_table.get_item.return_value = {"Item": {"consumed": Decimal("14000"), "refilled_at": Decimal("900")}}
+        self.mock_table.update_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException", "Message": "Refilled"}}, "UpdateItem"
+        )
+
+        # Execute
+        allowance = self.tracker.check("USER123")
+
+        # Assert - 14000 consumed minus 1000 refilled leaves the bucket at -3000
+        self.assertFalse(allowance.allowed)
+        self.assertAlmostEqual(allowance.retry_after_seconds, 300)
+
+    @patch('service.usage_tracker.RATE_LIMIT_ENABLED', False)
+    def test_record_in_background_is_waited_for(self):
+        # Setup - the write only finishes once the caller has moved on
+        release = threading.Event()
+        released = []
+        self.mock_table.update_item.side_effect = lambda **kwargs: released.append(release.wait(5))
+
+        # Execute
+        self.tracker.record_in_background("USER123", USAGE)
+        release.set()
+        UsageTracker.wait_for_pending(timeout=5)
+
+        # Assert
+        self.assertEqual(released, [True])
+
+    @patch('service.usage_tracker.RATE_LIMIT_ENABLED', True)
+    def test_check_fails_open(self):
+        # Setup
+        self.mock_table.get_item.side_effect = ClientError(
+            {"Error": {"Code": "ProvisionedThroughputExceededException", "Message": "Slow down"}},
+            "GetItem"
+        )
+
+        # Execute and Assert
+        self.assertTrue(self.tracker.check("USER123").allowed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,14 @@
 import unittest
 from unittest.mock import Mock, patch
 from botocore.exceptions import ClientError
-from service.user_preferences_accessor import UserPreferencesAccessor
+from service.user_preferences_accessor import UserPreferencesAccessor, UserPreferences
+from service.shared_clients import SharedClients
 from config import BEDROCK_MODELS, BedrockModelConfig
 
 class TestUserPreferencesAccessor(unittest.TestCase):
     def setUp(self):
+        UserPreferencesAccessor.clear_cache()
+        SharedClients.clear()
         self.accessor = UserPreferencesAccessor()
         self.test_user_id = "U123456"
         self.test_model_id = "model-123"
@@ -137,11 +140,21 @@ class TestUserPreferencesAccessor(unittest.TestCase):
         accessor = UserPreferencesAccessor()
 
         # Test
-        result = accessor.get_model_display_name(test_model.arn)
+        result = accessor.get_model_display_name(test_model.key)
 
         # Assert
         self.assertEqual(result, test_model.description)
 
+    def test_get_model_display_name_accepts_legacy_arn(self):
+        # Setup
+        accessor = UserPreferencesAccessor()
+
+        # Test
+        result = accessor.get_model_display_name(BEDROCK_MODELS[0].arn)
+
+        # Assert
+        self.assertEqual(result, BEDROCK_MODELS[0].description)
+
     def test_get_available_models(self):
         # Setup
         accessor = UserPreferencesAccessor()
@@ -152,7 +165,7 @@ class TestUserPreferencesAccessor(unittest.TestCase):
         # Assert
         self.assertEqual(len(result), len(BEDROCK_MODELS))
         for i, model in enumerate(BEDROCK_MODELS):
-            self.assertEqual(result[i]["id"], model.arn)
+            self.assertEqual(result[i]["id"], model.key)
             self.assertEqual(result[i]["name"], model.description)
 
     @patch('boto3.resource')
@@ -178,6 +191,48 @@ class TestUserPreferencesAccessor(unittest.TestCase):
         self.assertEqual(result, "Test system prompt")
         mock_table.get_item.assert_called_once_with(Key={"user_id": self.test_user_id})
 
+    def test_system_prompt_saved_under_legacy_arn_applies_to_model_keys(self):
+        # Setup
+        reasoning_models = [model for model in BEDROCK_MODELS if model.isReasoningModel]
+        model = reasoning_models[0]
+        preferences = UserPreferences(
+            user_id=self.test_user_id,
+            system_prompts={model.arn: "Legacy prompt"}
+        )
+        updated = UserPreferences(
+            user_id=self.test_user_id,
+            system_prompts={model.arn: "Legacy prompt", model.key: "New prompt"}
+        )
+
+        # Execute and Assert
+        self.assertEqual(preferences.get_system_prompt(model.key), "Legacy prompt")
+        self.assertEqual(preferences.get_system_prompt(model.arn), "Legacy prompt")
+        self.assertEqual(updated.get_system_prompt(model.key), "New prompt")
+        self.assertEqual(updated.get_system_prompt(model.arn), "New prompt")
+        self.assertIsNone(preferences.get_system_prompt("unknown-model"))
+
+    @patch('boto3.resource')
+    def test_prompt_saved_for_legacy_arn_model_replaces_legacy_prompt(self, mock_boto3_resource):
+        # Setup - the user's stored model and prompt both predate model keys
+        model = [model for model in BEDROCK_MODELS if model.isReasoningModel][0]
+        item = {"user_id": self.test_user_id, "model_id": model.arn, "system_prompts": {model.arn: "Legacy prompt"}}
+        mock_table = Mock()
+        mock_table.get_item.side_effect = lambda Key: {"Item": item}
+        mock_table.put_item.side_effect = lambda Item: item.update(Item)
+        mock_dynamodb = Mock()
+        mock_dynamodb.Table.return_value = mock_table
+        mock_boto3_resource.return_value = mock_dynamodb
+
+        # Execute
+        saved = self.accessor.set_user_system_prompt(self.test_user_id, model.arn, "New prompt")
+        UserPreferencesAccessor.clear_cache()
+        prompt = self.accessor.get_user_system_prompt(self.test_user_id, model.arn)
+
+        # Assert
+        self.assertTrue(saved)
+        self.assertEqual(item["system_prompts"][model.key], "New prompt")
+        self.assertEqual(prompt, "New prompt")
+
     @patch('boto3.resource')
     def test_get_user_system_prompt_not_found(self, mock_boto3_resource):
         # Setup
@@ -302,5 +357,78 @@ class TestUserPreferencesAccessor(unittest.TestCase):
             self.assertIsInstance(option["text"]["text"], str)
             self.assertIsInstance(option["value"], str)
 
+    @patch('boto3.resource')
+    def test_get_user_preferences_reads_item_once_across_accessors(self, mock_boto3_resource):
+        # Setup
+        mock_table = Mock()
+        mock_table.get_item.return_value = {
+            "Item": {
+                "user_id": self.test_user_id,
+                "model_id": self.test_model_id,
+                "system_prompts": {self.test_model_id: "Test system prompt"}
+            }
+        }
+        mock_dynamodb = Mock()
+        mock_dynamodb.Table.return_value = mock_table
+        mock_boto3_resource.return_value = mock_dynamodb
+
+        # Execute
+        preferences = self.accessor.get_user_preferences(self.test_user_id)
+        model_id = UserPreferencesAccessor().get_user_model(self.test_user_id)
+        system_prompt = UserPreferencesAccessor().get_user_system_prompt(self.test_user_id, self.test_model_id)
+
+        # Assert
+        self.assertEqual(preferences, UserPreferences(
+            user_id=self.test_user_id,
+            model_id=self.test_model_id,
+            system_prompts={self.test_model_id: "Test system prompt"}
+        ))
+        self.assertEqual(model_id, self.test_model_id)
+        self.assertEqual(system_prompt, "Test system prompt")
+        mock_table.get_item.assert_called_once_with(Key={"user_id": self.test_user_id})
+
+    @patch('boto3.resource')
+    def test_get_user_preferences_does_not_cache_errors(self, mock_boto3_resource):
+        # Setup
+        mock_table = Mock()
+        mock_table.get_item.side_effect = [
+            Exception("DynamoDB error"),
+            {"Item": {"user_id": self.test_user_id, "model_id": self.test_model_id}}
+        ]
+        mock_dynamodb = Mock()
+        mock_dynamodb.Table.return_value = mock_table
+        mock_boto3_resource.return_value = mock_dynamodb
+
+        # Execute
+        first = self.accessor.get_user_model(self.test_user_id)
+        second = self.accessor.get_user_model(self.test_user_id)
+
+        # Assert
+        self.assertIsNone(first)
+        self.assertEqual(second, self.test_model_id)
+
+    @patch('boto3.resource')
+    def test_setters_write_through_to_cache(self, mock_boto3_resource):
+        # Setup
+        mock_table = Mock()
+        mock_table.get_item.return_value = {"Item": {"user_id": self.test_user_id, "model_id": "old-model"}}
+        mock_dynamodb = Mock()
+        mock_dynamodb.Table.return_value = mock_table
+        mock_boto3_resource.return_value = mock_dynamodb
+        self.assertEqual(self.accessor.get_user_model(self.test_user_id), "old-model")
+
+        # Execute
+        self.accessor.set_user_model(self.test_user_id, self.test_model_id)
+        self.accessor.set_user_system_prompt(self.test_user_id, self.test_model_id, "New prompt")
+
+        # Assert - reads are served from the cache with the new values
+        mock_table.get_item.reset_mock()
+        self.assertEqual(self.accessor.get_user_model(self.test_user_id), self.test_model_id)
+        self.assertEqual(
+            self.accessor.get_user_system_prompt(self.test_user_id, self.test_model_id),
+            "New prompt"
+        )
+        mock_table.get_item.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -9,9 +9,10 @@ class HomeTab:
 
     def update_view(self, client, user_id):
         try:
-            current_model_id = self.user_preferences_accessor.get_user_model(user_id)
+            preferences = self.user_preferences_accessor.get_user_preferences(user_id)
+            current_model_id = preferences.model_id
             current_model_display = self.user_preferences_accessor.get_model_display_name(current_model_id)
-            current_system_prompt = self.user_preferences_accessor.get_user_system_prompt(user_id, current_model_id)
+            current_system_prompt = preferences.get_system_prompt(current_model_id)
             
             # If no custom prompt is set, get the default prompt
             if current_system_prompt is None and current_model_id:
@@ -2,6 +2,8 @@ import * as cdk from 'aws-cdk-lib';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as iam from 'aws-cdk-lib/aws-iam';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import * as lambdaEventSources from 'aws-cdk-lib/aws-lambda-event-sources';
 import * as path from 'path';
 import { Construct } from 'constructs';
 
@@ -33,6 +35,79 @@ export class SlackllmStack extends cdk.Stack {
       removalPolicy: cdk.RemovalPolicy.DESTROY,
     });
 
+    const threadsTable = new dynamodb.Table(this, 'SlackllmThreadsTable', {
+      tableName: 'SlackllmThreads',
+      partitionKey: {
+        name: 'thread_key',
+        type: dynamodb.AttributeType.STRING
+      },
+      sortKey: {
+        name: 'chunk',
+        type: dynamodb.AttributeType.NUMBER
+      },
+      timeToLiveAttribute: 'expires_at',
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
+    const eventsTable = new dynamodb.Table(this, 'SlackllmEventsTable', {
+      tableName: 'SlackllmEvents',
+      partitionKey: {
+        name: 'event_id',
+        type: dynamodb.AttributeType.STRING
+      },
+      timeToLiveAttribute: 'expires_at',
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
+    // Per-user token usage counters and rate limit buckets
+    const usageTable = new dynamodb.Table(this, 'SlackllmUsageTable', {
+      tableName: 'SlackllmUsage',
+      partitionKey: {
+        name: 'usage_key',
+        type: dynamodb.AttributeType.STRING
+      },
+      timeToLiveAttribute: 'expires_at',
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
+    // Job queue used when EXECUTION_MODE is 'queue', ordered per Slack thread
+    const jobDeadLetterQueue = new sqs.Queue(this, 'SlackllmJobsDeadLetterQueue', {
+      queueName: 'SlackllmJobsDlq.fifo',
+      fifo: true,
+      retentionPeriod: cdk.Duration.days(14),
+    });
+
+    const jobQueue = new sqs.Queue(this, 'SlackllmJobsQueue', {
+      queueName: 'SlackllmJobs.fifo',
+      fifo: true,
+      // Must exceed the function timeout so jobs are not redelivered while running
+      visibilityTimeout: cdk.Duration.minutes(15),
+      deadLetterQueue: {
+        queue: jobDeadLetterQueue,
+        maxReceiveCount: 3,
+      },
+    });
+
+    // Reasoning jobs run for minutes, their own queue keeps them from delaying quick replies
+    const reasoningJobDeadLetterQueue = new sqs.Queue(this, 'SlackllmReasoningJobsDeadLetterQueue', {
+      queueName: 'SlackllmReasoningJobsDlq.fifo',
+      fifo: true,
+      retentionPeriod: cdk.Duration.days(14),
+    });
+
+    const reasoningJobQueue = new sqs.Queue(this, 'SlackllmReasoningJobsQueue', {
+      queueName: 'SlackllmReasoningJobs.fifo',
+      fifo: true,
+      visibilityTimeout: cdk.Duration.minutes(15),
+      deadLetterQueue: {
+        queue: reasoningJobDeadLetterQueue,
+        maxReceiveCount: 3,
+      },
+    });
+
     const lambdaRole = new iam.Role(this, 'SlackllmRole', {
       assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com'),
       managedPolicies: [
@@ -43,7 +118,7 @@ export class SlackllmStack extends cdk.Stack {
     lambdaRole.addToPolicy(new iam.PolicyStatement({
       sid: 'AllowBedrockInvoke',
       effect: iam.Effect.ALLOW,
-      actions: ['bedrock:InvokeModel'],
+      actions: ['bedrock:InvokeModel', 'bedrock:InvokeModelWithResponseStream'],
       resources: ['*']
     }));
 
@@ -75,11 +150,42 @@ export class SlackllmStack extends cdk.Stack {
         SLACK_BOT_TOKEN: `{{resolve:secretsmanager:${slackSecretsName.valueAsString}:SecretString:SLACK_BOT_TOKEN}}`,
         SLACK_SIGNING_SECRET: `{{resolve:secretsmanager:${slackSecretsName.valueAsString}:SecretString:SLACK_SIGNING_SECRET}}`,
         BEDROCK_MODEL_ID: 'arn:aws:bedrock:us-east-1:705478596818:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0',
-        DYNAMODB_TABLE_NAME: table.tableName
+        DYNAMODB_TABLE_NAME: table.tableName,
+        THREAD_STORE_TABLE_NAME: threadsTable.tableName,
+        IDEMPOTENCY_TABLE_NAME: eventsTable.tableName,
+        USAGE_TABLE_NAME: usageTable.tableName,
+        RATE_LIMIT_ENABLED: 'true',
+        EXECUTION_MODE: 'lazy',
+        JOB_QUEUE_URL: jobQueue.queueUrl,
+        REASONING_JOB_QUEUE_URL: reasoningJobQueue.queueUrl,
+        STREAMING_RESPONSES_ENABLED: 'true',
+        CLIENT_PREWARM_ENABLED: 'true',
+        METRICS_EMF_ENABLED: 'true'
       }
     });
 
     table.grantReadWriteData(lambdaRole);
+    threadsTable.grantReadWriteData(lambdaRole);
+    eventsTable.grantWriteData(lambdaRole);
+    usageTable.grantReadWriteData(lambdaRole);
+    jobQueue.grantSendMessages(lambdaRole);
+    reasoningJobQueue.grantSendMessages(lambdaRole);
+
+    // Each lane is capped below the reserved concurrency, so Slack requests and UI
+    // interactions always find an execution environment
+    lambdaFn.addEventSource(new lambdaEventSources.SqsEventSource(jobQueue, {
+      batchSize: 10,
+      reportBatchItemFailures: true,
+      maxConcurrency: 5,
+    }));
+
+    // A reasoning reply can take minutes, so each invocation takes a single job to finish
+    // within the function timeout
+    lambdaFn.addEventSource(new lambdaEventSources.SqsEventSource(reasoningJobQueue, {
+      batchSize: 1,
+      reportBatchItemFailures: true,
+      maxConcurrency: 3,
+    }));
 
     const fnUrl = lambdaFn.addFunctionUrl({
       authType: lambda.FunctionUrlAuthType.NONE